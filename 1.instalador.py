@@ -25,7 +25,8 @@ _DIR_PATHS = {
     'EVENTOS':  ROOT_DIR / 'packs' / '0' / 'EVENTOS',
     'TOMADOS':  ROOT_DIR / 'packs' / '0' / 'TOMADOS',
     'PRESTADOS':  ROOT_DIR / 'packs' / '0' / 'PRESTADOS',
-    'temp': ROOT_DIR / 'temp'
+    'temp': ROOT_DIR / 'temp',
+    'dados': ROOT_DIR / 'dados'
 }
 
 _DIR_FILES = {
@@ -0,0 +1,236 @@
+import hashlib
+import json
+import logging
+import os
+import struct
+import tempfile
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+## Módulos auxiliares
+from downloader.pastas import EXTENSAO_GZIP, EXTENSAO_XML
+logger = logging.getLogger(__name__)
+
+# Cabeçalho gzip (RFC 1952): assinatura + método deflate
+_GZIP_ASSINATURA = b"\x1f\x8b\x08"
+_FHCRC, _FEXTRA, _FNAME, _FCOMMENT = 0x02, 0x04, 0x08, 0x10
+_ZIP_CABECALHO_LOCAL = b"PK\x03\x04"
+
+# Arquivos já compactados entram no ZIP sem nova compressão (ZIP_STORED)
+EXTENSOES_COMPACTADAS = (".pdf", ".zip", ".gz", ".xlsm", ".xlsx", ".png", ".jpg", ".jpeg")
+LOTE_ARQUIVOS = 64  # Arquivos compactados em paralelo antes de gravar em ordem
+
+## ------------------------------------------------------------------------------
+## Membros gravados a partir de dados já compactados
+## ------------------------------------------------------------------------------
+def membro_gzip(dados: bytes) -> tuple:
+    """
+    Separa um gzip de membro único (como o ``ArquivoXml`` do ADN) em
+    (fluxo deflate, CRC-32, tamanho descompactado), sem descompactar.
+    """
+    if dados[:3] != _GZIP_ASSINATURA or len(dados) < 18:
+        raise ValueError("Conteúdo não é gzip/deflate")
+    flags = dados[3]
+    inicio = 10
+    if flags & _FEXTRA:
+        inicio += 2 + int.from_bytes(dados[inicio:inicio + 2], "little")
+    if flags & _FNAME:
+        inicio = dados.index(b"\0", inicio) + 1
+    if flags & _FCOMMENT:
+        inicio = dados.index(b"\0", inicio) + 1
+    if flags & _FHCRC:
+        inicio += 2
+    crc, tamanho = struct.unpack("<II", dados[-8:])
+    return dados[inicio:-8], crc, tamanho
+
+def _gravar_bruto(zipf: zipfile.ZipFile, info: zipfile.ZipInfo, dados: bytes,
+                  crc: int, tamanho: int, metodo: int) -> None:
+    """
+    Grava ``dados`` já compactados (deflate ou não) como membro do ZIP. O
+    zipfile só aceita dados brutos como ZIP_STORED; o cabeçalho local é
+    reescrito em seguida com o método, CRC e tamanho reais do conteúdo.
+    """
+    info.file_size = tamanho  # Decide o ZIP64 pelo tamanho real
+    info.compress_type = zipfile.ZIP_STORED
+    with zipf.open(info, "w") as destino:
+        destino.write(dados)
+    info.compress_type = metodo
+    info.CRC = crc
+    info.file_size = tamanho
+    fim = zipf.fp.tell()
+    zipf.fp.seek(info.header_offset)
+    zipf.fp.write(info.FileHeader())
+    zipf.fp.seek(fim)
+
+def _ler_bruto(arquivo_zip, info: zipfile.ZipInfo) -> bytes:
+    """Dados compactados de um membro, lidos direto do ZIP anterior (sem descompactar)"""
+    arquivo_zip.seek(info.header_offset)
+    cabecalho = arquivo_zip.read(30)
+    if cabecalho[:4] != _ZIP_CABECALHO_LOCAL:
+        raise zipfile.BadZipFile(f"Cabeçalho inválido para {info.filename}")
+    tamanho_nome, tamanho_extra = struct.unpack("<HH", cabecalho[26:30])
+    arquivo_zip.seek(info.header_offset + 30 + tamanho_nome + tamanho_extra)
+    return arquivo_zip.read(info.compress_size)
+
+def nome_no_zip(caminho_relativo: str) -> str:
+    """Nome do membro: barras normais e ``.xml.gz`` exportado como ``.xml``"""
+    nome = caminho_relativo.replace("\\", "/")
+    if nome.lower().endswith(EXTENSAO_GZIP):
+        nome = nome[:-len(EXTENSAO_GZIP)] + EXTENSAO_XML
+    return nome
+
+def _hash(caminho: str) -> str:
+    with open(caminho, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+## ------------------------------------------------------------------------------
+## Compactador incremental
+## ------------------------------------------------------------------------------
+class CompactadorZip:
+    """
+    Gera o ``{cod}.zip`` da pasta da empresa compactando os arquivos em
+    paralelo (threads; o zlib libera o GIL) e gravando-os em ordem.
+
+    Um manifesto ao lado do ZIP (``{cod}.zip.json``) guarda tamanho, data e
+    hash de cada arquivo. Na próxima vez, os arquivos sem mudança têm os dados
+    compactados copiados do ZIP anterior, sem recompactar; só os novos ou
+    alterados passam pelo zlib. PDFs e outros formatos já compactados entram
+    como ZIP_STORED, e ``.xml.gz`` entra como ``.xml`` aproveitando o deflate.
+    """
+
+    def __init__(self, workers: int = 4, nivel: int = 6):
+        self.workers = max(1, int(workers))
+        self.nivel = nivel
+
+    @classmethod
+    def do_config(cls, config) -> "CompactadorZip":
+        return cls(getattr(config, "zip_workers", 4))
+
+    @staticmethod
+    def arquivo_manifesto(caminho_zip: str) -> str:
+        return caminho_zip + ".json"
+
+    def _carregar_manifesto(self, caminho_zip: str) -> dict:
+        """Arquivos do ZIP anterior (caminho relativo -> tamanho, mtime e hash); vazio se não houver"""
+        arquivo = self.arquivo_manifesto(caminho_zip)
+        if not os.path.exists(caminho_zip) or not os.path.exists(arquivo):
+            return {}
+        try:
+            with open(arquivo, "r", encoding="utf-8") as f:
+                return json.load(f).get("arquivos", {})
+        except (OSError, ValueError, AttributeError) as e:
+            logger.warning(f"Manifesto do ZIP ilegível, compactando tudo: {e}")
+            return {}
+
+    def _salvar_manifesto(self, caminho_zip: str, arquivos: dict) -> None:
+        destino = self.arquivo_manifesto(caminho_zip)
+        fd, temp = tempfile.mkstemp(dir=os.path.dirname(destino) or ".", prefix=".zip_", suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"arquivos": arquivos}, f, ensure_ascii=False)
+        os.replace(temp, destino)
+
+    def _compactar(self, caminho: str) -> tuple:
+        """(dados, CRC, tamanho, método, hash) de um arquivo novo ou alterado"""
+        with open(caminho, "rb") as f:
+            conteudo = f.read()
+        hash_conteudo = hashlib.sha1(conteudo).hexdigest()
+        if caminho.lower().endswith(EXTENSAO_GZIP):
+            dados, crc, tamanho = membro_gzip(conteudo)
+            return dados, crc, tamanho, zipfile.ZIP_DEFLATED, hash_conteudo
+        crc = zlib.crc32(conteudo)
+        if caminho.lower().endswith(EXTENSOES_COMPACTADAS):
+            return conteudo, crc, len(conteudo), zipfile.ZIP_STORED, hash_conteudo
+        compressor = zlib.compressobj(self.nivel, zlib.DEFLATED, -15)
+        dados = compressor.compress(conteudo) + compressor.flush()
+        return dados, crc, len(conteudo), zipfile.ZIP_DEFLATED, hash_conteudo
+
+    def compactar(self, pasta_origem: str, caminho_zip: str) -> dict:
+        """
+        Compacta a pasta (com subpastas) em ``caminho_zip``, reaproveitando o ZIP
+        anterior. Grava num temporário e troca no final (os.replace).
+
+        Returns:
+            Quantidade de arquivos novos, alterados, mantidos e removidos
+        """
+        manifesto = self._carregar_manifesto(caminho_zip)
+        pastas, arquivos = [], []
+        for raiz, dirs, nomes in os.walk(pasta_origem):
+            dirs.sort()
+            for nome in dirs:
+                pastas.append(os.path.relpath(os.path.join(raiz, nome), pasta_origem))
+            for nome in sorted(nomes):
+                arquivos.append(os.path.relpath(os.path.join(raiz, nome), pasta_origem))
+
+        novo_manifesto: dict = {}
+        antigo = None
+        if manifesto:
+            try:
+                antigo = zipfile.ZipFile(caminho_zip)
+            except (OSError, zipfile.BadZipFile) as e:
+                logger.warning(f"ZIP anterior ilegível, compactando tudo: {e}")
+                manifesto = {}
+        resumo = {"novos": 0, "alterados": 0, "mantidos": 0, "removidos": len(set(manifesto) - set(arquivos))}
+        bruto = open(caminho_zip, "rb") if antigo is not None else None
+        temporario = caminho_zip + ".tmp"
+        try:
+            membros_antigos = {info.filename: info for info in antigo.infolist()} if antigo else {}
+            # Decide o que pode ser copiado do ZIP anterior
+            tarefas = []
+            for relativo in arquivos:
+                caminho = os.path.join(pasta_origem, relativo)
+                info_arquivo = os.stat(caminho)
+                registro = {"tamanho": info_arquivo.st_size, "mtime": info_arquivo.st_mtime_ns}
+                anterior = manifesto.get(relativo)
+                membro = membros_antigos.get(nome_no_zip(relativo))
+                if anterior and membro is not None and anterior["tamanho"] == registro["tamanho"]:
+                    if anterior["mtime"] == registro["mtime"] or anterior.get("hash") == _hash(caminho):
+                        registro["hash"] = anterior.get("hash")
+                        novo_manifesto[relativo] = registro
+                        tarefas.append((relativo, caminho, membro))
+                        resumo["mantidos"] += 1
+                        continue
+                resumo["alterados" if anterior else "novos"] += 1
+                novo_manifesto[relativo] = registro
+                tarefas.append((relativo, caminho, None))
+
+            with zipfile.ZipFile(temporario, "w", zipfile.ZIP_DEFLATED) as zipf, \
+                    ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="zip") as pool:
+                for relativo in pastas:
+                    zipf.writestr(zipfile.ZipInfo(nome_no_zip(relativo) + "/"), "")
+                for inicio in range(0, len(tarefas), LOTE_ARQUIVOS):
+                    lote = tarefas[inicio:inicio + LOTE_ARQUIVOS]
+                    futuros = [pool.submit(self._compactar, caminho) if membro is None else None
+                               for _, caminho, membro in lote]
+                    for (relativo, caminho, membro), futuro in zip(lote, futuros):
+                        self._gravar(zipf, bruto, relativo, caminho, membro, futuro, novo_manifesto)
+        except Exception:
+            if os.path.exists(temporario):
+                os.remove(temporario)
+            raise
+        finally:
+            if bruto is not None:
+                bruto.close()
+            if antigo is not None:
+                antigo.close()
+
+        os.replace(temporario, caminho_zip)
+        self._salvar_manifesto(caminho_zip, novo_manifesto)
+        logger.info(f"{caminho_zip}: {resumo['novos']} novos, {resumo['alterados']} alterados, "
+                    f"{resumo['mantidos']} mantidos, {resumo['removidos']} removidos")
+        return resumo
+
+    @staticmethod
+    def _gravar(zipf, bruto, relativo: str, caminho: str, membro: Optional[zipfile.ZipInfo],
+                futuro, manifesto: dict) -> None:
+        """Grava um membro: copiado do ZIP anterior ou compactado agora"""
+        if membro is not None:
+            info = zipfile.ZipInfo(membro.filename, membro.date_time)
+            info.external_attr = membro.external_attr
+            _gravar_bruto(zipf, info, _ler_bruto(bruto, membro), membro.CRC, membro.file_size, membro.compress_type)
+            return
+        dados, crc, tamanho, metodo, hash_conteudo = futuro.result()
+        info = zipfile.ZipInfo.from_file(caminho, nome_no_zip(relativo), strict_timestamps=False)
+        _gravar_bruto(zipf, info, dados, crc, tamanho, metodo)
+        manifesto[relativo]["hash"] = hash_conteudo
@@ -11,6 +11,8 @@ from typing import Any, Dict
 # Status de parada
 STATUS_STOP = [204, 400]
 MAX_TENT = 2
+# Repetições do mesmo NSU após 429 (Too Many Requests) antes de desistir
+MAX_TENT_429 = 5
 
 ## ------------------------------------------------------------------------------
 ## Diretórios padrão
@@ -34,7 +36,8 @@ _DIR_PATHS = {
     'EVENTOS':  ROOT_DIR / 'packs' / 'EVENTOS',
     'TOMADOS':  ROOT_DIR / 'packs' / 'TOMADOS',
     'PRESTADOS':  ROOT_DIR / 'packs' / 'PRESTADOS',
-    'temp': ROOT_DIR / 'temp'
+    'temp': ROOT_DIR / 'temp',
+    'dados': ROOT_DIR / 'dados'
 }
 
 _DIR_FILES = {
@@ -45,11 +48,18 @@ _DIR_FILES = {
     'instrucoes': ROOT_DIR / 'README.md',
     'versao': _DIR_PATHS['docs'] / 'versao.txt',
     'vba' : _DIR_PATHS['docs'] / 'vba.bas',
+    'exportacoes_json': _DIR_PATHS['dados'] / 'exportacoes.json',
 }
 
 # Combinar todos os diretórios em um único dicionário
 DIRETORIOS = {**_DIR_PATHS, **_DIR_FILES}
 
+def pasta_dados_empresa(cnpj: str) -> Path:
+    """Retorna (criando se necessário) a pasta de dados internos da empresa, fora do pacote exportado."""
+    pasta = DIRETORIOS['dados'] / cnpj
+    pasta.mkdir(parents=True, exist_ok=True)
+    return pasta
+
 ## ------------------------------------------------------------------------------
 ## Carregamento de configuração padrão
 ## ------------------------------------------------------------------------------
@@ -61,6 +71,26 @@ class Config:
     timeout: int = 60
     consult_mode : str = "Competência"
     save_mode : str = "Código"
+    max_workers: int = 3
+    rate_min: float = 0.1
+    rate_max: float = 2.0
+    latency_target: float = 5.0
+    connect_timeout: float = 10.0
+    retry_attempts: int = 4
+    retry_backoff: float = 1.0
+    retry_backoff_max: float = 30.0
+    prefetch_pages: int = 2
+    checkpoint_interval: int = 50
+    armazem_max_mb: int = 500
+    decode_processes: int = 0
+    decode_min_batch: int = 20
+    pdf_workers: int = 4
+    pdf_rate_max: float = 4.0
+    pdf_retry_attempts: int = 3
+    pdf_mode: str = "Remoto"
+    incremental_folders: bool = True
+    archive_gzip: bool = False
+    zip_workers: int = 4
 
     @classmethod
     def load(cls, path: str | Path) -> Config:
@@ -0,0 +1,98 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+logger = logging.getLogger(__name__)
+
+# Como cada pacote chegou ao destino
+PULADO = "pulado"
+HARDLINK = "hardlink"
+COPIA = "cópia"
+
+def _assinatura(caminho: str) -> list:
+    info = os.stat(caminho)
+    return [info.st_size, info.st_mtime_ns]
+
+## ------------------------------------------------------------------------------
+## Exportação dos pacotes .zip
+## ------------------------------------------------------------------------------
+class ExportadorPacotes:
+    """
+    Leva o ``{cod}.zip`` da empresa direto para a pasta escolhida, sem cópia
+    intermediária: no mesmo volume cria um hardlink (nenhum byte copiado); em
+    outro volume usa ``shutil.copy2``, que delega a cópia ao sistema
+    (sendfile/fcopyfile/CopyFile) quando disponível.
+
+    O hardlink é seguro porque o compactador nunca altera o ``.zip`` no lugar:
+    grava um novo arquivo e troca com ``os.replace``, deixando o exportado
+    intacto. O manifesto (``exportacoes.json``) guarda tamanho e data da origem
+    e do destino de cada exportação; se nenhum dos dois mudou, o pacote é pulado.
+    """
+
+    def __init__(self, arquivo_manifesto):
+        self.arquivo_manifesto = str(arquivo_manifesto)
+        self._lock = threading.Lock()
+        self._manifesto = self._carregar()
+
+    def _carregar(self) -> dict:
+        if not os.path.exists(self.arquivo_manifesto):
+            return {}
+        try:
+            with open(self.arquivo_manifesto, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Manifesto de exportação ilegível, exportando tudo: {e}")
+            return {}
+
+    def salvar(self) -> None:
+        with self._lock:
+            dados = json.dumps(self._manifesto, ensure_ascii=False, indent=2)
+        pasta = os.path.dirname(self.arquivo_manifesto) or "."
+        os.makedirs(pasta, exist_ok=True)
+        fd, temp = tempfile.mkstemp(dir=pasta, prefix=".exportacoes_", suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(dados)
+        os.replace(temp, self.arquivo_manifesto)
+
+    def _inalterado(self, chave: str, origem: str, destino: str) -> bool:
+        with self._lock:
+            registro = self._manifesto.get(chave)
+        if not registro or not os.path.exists(destino):
+            return False
+        return (registro.get("origem") == _assinatura(origem)
+                and registro.get("destino") == _assinatura(destino))
+
+    def exportar(self, origem: str, destino: str) -> str:
+        """
+        Exporta ``origem`` para ``destino`` (caminho completo do arquivo).
+
+        Returns:
+            PULADO, HARDLINK ou COPIA
+        """
+        chave = os.path.normcase(os.path.abspath(destino))
+        if self._inalterado(chave, origem, destino):
+            return PULADO
+
+        # Nome temporário na própria pasta de destino: o arquivo final só
+        # aparece completo e a troca com os.replace não copia nada
+        temp = os.path.join(os.path.dirname(destino) or ".", f".{os.path.basename(destino)}.tmp")
+        if os.path.exists(temp):
+            os.remove(temp)
+        try:
+            try:
+                os.link(origem, temp)
+                modo = HARDLINK
+            except OSError:
+                shutil.copy2(origem, temp)
+                modo = COPIA
+            os.replace(temp, destino)
+        except Exception:
+            if os.path.exists(temp):
+                os.remove(temp)
+            raise
+
+        with self._lock:
+            self._manifesto[chave] = {"origem": _assinatura(origem), "destino": _assinatura(destino)}
+        return modo
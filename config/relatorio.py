@@ -0,0 +1,388 @@
+import logging
+import os
+import xml.etree.ElementTree as ET
+from copy import copy
+from datetime import date
+from typing import Optional
+from openpyxl import load_workbook
+from openpyxl.formatting.formatting import ConditionalFormattingList
+from openpyxl.styles import Font
+from openpyxl.utils import get_column_letter, range_boundaries
+from openpyxl.worksheet.cell_range import CellRange
+
+## Módulos auxiliares
+from config.utils import limpar_cnpj
+from downloader.extrator import cancela_nota, codigo_evento, nome_local
+from downloader.pastas import base_documento, eh_documento, ler_documento
+logger = logging.getLogger(__name__)
+
+URL_DANFSE = "https://adn.nfse.gov.br/danfse/"
+PLANILHA_CONTROLE = "importados"  # Planilha oculta com os XMLs já importados
+FONTE = Font(name="Consolas", size=9)
+FONTE_LINK = Font(name="Consolas", size=9, color="0032B4", underline="single")
+
+# Planilha e tabela de cada grupo, como na macro ImportarTodosXMLs
+TABELAS = {
+    "PRESTADOS": ("PRESTADOS", "NFSE_PRESTADOS"),
+    "TOMADOS": ("TOMADOS", "NFSE_TOMADOS"),
+    "EVENTOS": ("EVENTOS", "NFSE_EVENTO"),
+}
+# Colunas (base 0) zeradas nas notas canceladas: Valor Serviço, Total Retenções e Valor Líquido
+COLUNAS_VALORES = (11, 12, 13)
+
+## ------------------------------------------------------------------------------
+## Leitura dos XMLs
+## ------------------------------------------------------------------------------
+def _filho(el: Optional[ET.Element], *caminho: str) -> Optional[ET.Element]:
+    """Desce pelos filhos diretos com os nomes dados (sem namespace)"""
+    for nome in caminho:
+        if el is None:
+            return None
+        el = next((f for f in el if nome_local(f.tag) == nome), None)
+    return el
+
+def _texto(el: Optional[ET.Element], *caminho: str) -> str:
+    no = _filho(el, *caminho)
+    return (no.text or "").strip() if no is not None else ""
+
+def _documento(el: Optional[ET.Element], *caminho: str) -> str:
+    """CNPJ ou, na falta dele, CPF do bloco"""
+    return _texto(el, *caminho, "CNPJ") or _texto(el, *caminho, "CPF")
+
+def _primeira(pedido: Optional[ET.Element], campo: str) -> str:
+    """Campo do evento e101101 ou, na falta dele, do primeiro grupo de evento que o tenha"""
+    valor = _texto(pedido, "e101101", campo)
+    if not valor and pedido is not None:
+        valor = next((_texto(grupo, campo) for grupo in pedido if _filho(grupo, campo) is not None), "")
+    return valor
+
+def _data(texto: str):
+    texto = texto.split("T")[0]
+    try:
+        return date.fromisoformat(texto)
+    except ValueError:
+        return texto or None
+
+def _numero(texto: str):
+    try:
+        return float(texto) if texto else None
+    except ValueError:
+        return texto
+
+def _inteiro(texto: str):
+    return int(texto) if texto.isdigit() else (texto or None)
+
+def ler_xml(caminho: str, alvo: str) -> dict:
+    """
+    Linhas de PRESTADOS, TOMADOS e EVENTOS de um XML, com o mesmo mapeamento
+    da macro. A última coluna de cada linha é a chave (destino do link);
+    ``CANCELADAS`` traz as chaves anuladas pelos eventos do arquivo.
+    """
+    linhas = {grupo: [] for grupo in TABELAS}
+    linhas["CANCELADAS"] = set()
+    raiz = ET.fromstring(ler_documento(caminho))
+
+    inf = raiz if nome_local(raiz.tag) == "infNFSe" else next(
+        (el for el in raiz.iter() if nome_local(el.tag) == "infNFSe"), None
+    )
+    if inf is not None:
+        dps = ("DPS", "infDPS")
+        chave = (inf.get("Id") or "").replace("NFS", "") or "SemChave"
+        prestador = _documento(inf, *dps, "prest")
+        tomador = _documento(inf, *dps, "toma")
+        linha = [
+            _inteiro(_texto(inf, "nNFSe")),
+            _data(_texto(inf, "dhProc")),
+            _data(_texto(inf, *dps, "dCompet")),
+            _texto(inf, "xLocIncid"),
+            _inteiro(prestador),
+            _texto(inf, *dps, "prest", "xNome") or _texto(inf, "emit", "xNome"),
+            _inteiro(tomador),
+            _texto(inf, *dps, "toma", "xNome"),
+            _texto(inf, *dps, "serv", "cServ", "cTribNac"),
+            _texto(inf, *dps, "serv", "cServ", "cNBS"),
+            _texto(inf, *dps, "serv", "cServ", "xDescServ"),
+            _numero(_texto(inf, *dps, "valores", "vServPrest", "vServ")),
+            _numero(_texto(inf, "valores", "vTotalRet")),
+            _numero(_texto(inf, "valores", "vLiq")),
+            chave,
+        ]
+        if prestador == alvo:
+            linhas["PRESTADOS"].append(linha)
+        if tomador == alvo:
+            linhas["TOMADOS"].append(list(linha))
+
+    for evento in (el for el in raiz.iter() if nome_local(el.tag) == "infEvento"):
+        pedido = _filho(evento, "pedRegEvento", "infPedReg")
+        autor = _texto(pedido, "CNPJAutor")
+        codigo = next((codigo_evento(nome_local(g.tag)) for g in pedido if codigo_evento(nome_local(g.tag))), None) \
+            if pedido is not None else None
+        if cancela_nota(codigo) and _texto(pedido, "chNFSe"):
+            linhas["CANCELADAS"].add(_texto(pedido, "chNFSe"))
+        linhas["EVENTOS"].append([
+            _inteiro(_texto(evento, "nDFe")),
+            _data(_texto(evento, "dhProc")),
+            _inteiro(autor),
+            "Prestador" if autor == alvo else "Tomador",
+            _primeira(pedido, "xDesc"),
+            _primeira(pedido, "xMotivo"),
+            _texto(pedido, "chNFSe"),
+        ])
+    return linhas
+
+def _zerar(registro: list) -> None:
+    """Nota cancelada ou substituída: valores zerados, como na macro ZerarValoresPorEvento"""
+    for coluna in COLUNAS_VALORES:
+        registro[coluna] = 0
+
+def _percorrer(pasta: str):
+    """Arquivos da pasta e das subpastas, na ordem da macro (arquivos antes das subpastas)"""
+    for raiz, pastas, arquivos in os.walk(pasta):
+        pastas.sort(key=str.lower)
+        for nome in sorted(arquivos, key=str.lower):
+            yield os.path.join(raiz, nome)
+
+## ------------------------------------------------------------------------------
+## Escrita das tabelas
+## ------------------------------------------------------------------------------
+def _expandir_formatacao(ws, linha_modelo: int, ultima_linha: int) -> None:
+    """Estende a formatação condicional da linha modelo às linhas de dados"""
+    nova = ConditionalFormattingList()
+    for formatacao in ws.conditional_formatting:
+        faixas = []
+        for faixa in formatacao.sqref.ranges:
+            if faixa.min_row == linha_modelo:
+                faixa = CellRange(min_col=faixa.min_col, min_row=linha_modelo,
+                                  max_col=faixa.max_col, max_row=ultima_linha)
+            faixas.append(faixa.coord)
+        for regra in formatacao.rules:
+            nova.add(" ".join(faixas), regra)
+    ws.conditional_formatting = nova
+
+def _linhas_existentes(ws, tabela) -> int:
+    """Linhas de dados já preenchidas na tabela (contíguas a partir da primeira)"""
+    min_col, min_row, max_col, max_row = range_boundaries(tabela.ref)
+    fim = max_row - (1 if tabela.totalsRowCount else 0)
+    total = 0
+    for linha in ws.iter_rows(min_row=min_row + 1, max_row=fim, min_col=min_col, max_col=max_col, values_only=True):
+        if linha[0] is None and linha[-1] is None:
+            break
+        total += 1
+    return total
+
+def _preencher_tabela(ws, nome_tabela: str, linhas: list, links: list, manter: bool = False) -> None:
+    """
+    Grava as linhas de dados da tabela de uma só vez, mantendo o estilo da
+    primeira linha de dados e a linha de totais, e reajusta o intervalo da tabela.
+    Com ``manter``, as linhas novas entram depois das já existentes.
+    """
+    tabela = ws.tables[nome_tabela]
+    min_col, min_row, max_col, max_row = range_boundaries(tabela.ref)
+    com_totais = bool(tabela.totalsRowCount)
+    colunas = range(min_col, max_col + 1)
+    existentes = _linhas_existentes(ws, tabela) if manter else 0
+
+    # Formato numérico da coluna: o da linha modelo ou, se geral, o do cabeçalho
+    modelo = []
+    for coluna in colunas:
+        estilo = ws.cell(min_row + 1, coluna)
+        formato = estilo.number_format
+        if formato == "General":
+            formato = ws.cell(min_row, coluna).number_format
+        modelo.append((copy(estilo._style), formato))
+    totais = [
+        (ws.cell(max_row, coluna).value, copy(ws.cell(max_row, coluna)._style)) for coluna in colunas
+    ] if com_totais else []
+
+    # Limpa a linha de totais e, na importação completa, os dados anteriores
+    for linha in ws.iter_rows(min_row=min_row + 1 + existentes, max_row=max_row, min_col=min_col, max_col=max_col):
+        for celula in linha:
+            celula.value = None
+            celula.hyperlink = None
+
+    for deslocamento, (valores, link) in enumerate(zip(linhas, links), 1 + existentes):
+        for coluna, valor in zip(colunas, valores):
+            celula = ws.cell(min_row + deslocamento, coluna, valor)
+            celula._style = copy(modelo[coluna - min_col][0])
+            celula.number_format = modelo[coluna - min_col][1]
+            celula.font = FONTE
+        if link:
+            celula.hyperlink = link
+            celula.hyperlink.tooltip = "Abrir DANFSe no portal nacional" if link.startswith(URL_DANFSE) else "Clique para abrir o PDF"
+            celula.font = FONTE_LINK
+
+    # Tabela do Excel precisa de ao menos uma linha de dados
+    ultima_dados = min_row + max(1, existentes + len(linhas))
+    ultima = ultima_dados
+    if com_totais:
+        ultima += 1
+        for coluna, (valor, estilo) in zip(colunas, totais):
+            celula = ws.cell(ultima, coluna, valor)
+            celula._style = estilo
+
+    inicio, fim = get_column_letter(min_col), get_column_letter(max_col)
+    tabela.ref = f"{inicio}{min_row}:{fim}{ultima}"
+    if tabela.autoFilter is not None:
+        tabela.autoFilter.ref = f"{inicio}{min_row}:{fim}{ultima_dados}"
+    _expandir_formatacao(ws, min_row + 1, ultima_dados)
+
+## ------------------------------------------------------------------------------
+## Controle da importação incremental
+## ------------------------------------------------------------------------------
+def _assinatura(caminho: str) -> str:
+    info = os.stat(caminho)
+    return f"{info.st_size}:{info.st_mtime_ns}"
+
+def _ler_controle(wb) -> tuple:
+    """(alvo, {arquivo relativo: assinatura}, chaves canceladas) da última importação"""
+    alvo, arquivos, canceladas = None, {}, set()
+    if PLANILHA_CONTROLE in wb.sheetnames:
+        for tipo, valor, assinatura in wb[PLANILHA_CONTROLE].iter_rows(min_row=2, max_col=3, values_only=True):
+            if tipo == "alvo":
+                alvo = valor
+            elif tipo == "arquivo":
+                arquivos[valor] = assinatura
+            elif tipo == "cancelada":
+                canceladas.add(valor)
+    return alvo, arquivos, canceladas
+
+def _gravar_controle(wb, alvo: str, arquivos: dict, canceladas: set) -> None:
+    """Planilha oculta com os XMLs já importados e as chaves canceladas"""
+    if PLANILHA_CONTROLE in wb.sheetnames:
+        del wb[PLANILHA_CONTROLE]
+    ws = wb.create_sheet(PLANILHA_CONTROLE)
+    ws.sheet_state = "hidden"
+    ws.append(("tipo", "valor", "assinatura"))
+    ws.append(("alvo", alvo, None))
+    for arquivo, assinatura in sorted(arquivos.items()):
+        ws.append(("arquivo", arquivo, assinatura))
+    for chave in sorted(canceladas):
+        ws.append(("cancelada", chave, None))
+
+def _zerar_existentes(ws, nome_tabela: str, chaves: set) -> int:
+    """Zera os valores das linhas já gravadas cujas chaves foram canceladas agora"""
+    tabela = ws.tables[nome_tabela]
+    min_col, min_row, max_col, _ = range_boundaries(tabela.ref)
+    existentes = _linhas_existentes(ws, tabela)
+    zeradas = 0
+    for (celula,) in ws.iter_rows(min_row=min_row + 1, max_row=min_row + existentes, min_col=max_col, max_col=max_col):
+        if celula.value in chaves:
+            for coluna in COLUNAS_VALORES:
+                ws.cell(celula.row, min_col + coluna).value = 0
+            zeradas += 1
+    return zeradas
+
+## ------------------------------------------------------------------------------
+## Importação
+## ------------------------------------------------------------------------------
+def importar_relatorio(caminho_xlsm: str, cnpj: Optional[str] = None, completo: bool = False) -> dict:
+    """
+    Importa os XMLs da pasta da planilha (e subpastas) para as tabelas
+    NFSE_PRESTADOS, NFSE_TOMADOS e NFSE_EVENTO, no lugar da macro
+    ``ImportarTodosXMLs``: grava as linhas em bloco e liga a chave ao PDF (ou
+    ao DANFSe no portal). Notas com evento de cancelamento ou substituição são
+    zeradas durante a leitura, sem segunda passada.
+
+    A importação é incremental: a planilha oculta ``importados`` guarda os XMLs
+    já lidos (tamanho e data), e só os novos são acrescentados às tabelas;
+    eventos novos zeram apenas as linhas das notas afetadas. Se algum XML já
+    importado sumiu ou mudou, ou o CNPJ alvo mudou, as tabelas são refeitas.
+
+    Não depende do Excel; pode rodar em paralelo para empresas diferentes
+    (inclusive em outro processo).
+
+    Args:
+        caminho_xlsm: Planilha de relatório da empresa
+        cnpj: CNPJ usado se a célula alvo!A1 estiver vazia
+        completo: Limpa as tabelas e importa todos os XMLs
+
+    Returns:
+        Quantidade de linhas acrescentadas por tabela
+    """
+    pasta = os.path.dirname(os.path.abspath(caminho_xlsm))
+    wb = load_workbook(caminho_xlsm, keep_vba=True)
+    try:
+        alvo = limpar_cnpj(wb["alvo"]["A1"].value if "alvo" in wb.sheetnames else None) or limpar_cnpj(cnpj)
+        if not alvo:
+            logger.warning(f"Planilha sem CNPJ alvo, nada importado: {caminho_xlsm}")
+            return {grupo: 0 for grupo in TABELAS}
+
+        arquivos = list(_percorrer(pasta))
+        pdfs: dict = {}
+        xmls: dict = {}  # arquivo relativo -> assinatura
+        for arquivo in arquivos:
+            nome, extensao = os.path.splitext(os.path.basename(arquivo))
+            if extensao.lower() == ".pdf":
+                pdfs.setdefault(nome.lower(), arquivo)
+            elif eh_documento(arquivo):
+                xmls[os.path.relpath(arquivo, pasta)] = _assinatura(arquivo)
+
+        alvo_anterior, importados, canceladas = _ler_controle(wb)
+        if not completo and (alvo_anterior != alvo or any(
+                xmls.get(arquivo) != assinatura for arquivo, assinatura in importados.items())):
+            motivo = "sem controle de importação" if alvo_anterior is None else "XMLs importados mudaram"
+            logger.info(f"Planilha {os.path.basename(caminho_xlsm)} será refeita: {motivo}")
+            completo = True
+        if completo:
+            importados, canceladas = {}, set()
+        lidos_antes = len(importados)
+
+        linhas = {grupo: [] for grupo in TABELAS}
+        links = {grupo: [] for grupo in TABELAS}
+        # Cruzamento notas x eventos na leitura: chaves canceladas e notas já lidas por chave
+        novas_canceladas: set = set()
+        notas: dict = {}
+        for arquivo in arquivos:
+            relativo = os.path.relpath(arquivo, pasta)
+            if relativo not in xmls or relativo in importados:
+                continue
+            try:
+                lidas = ler_xml(arquivo, alvo)
+            except (ET.ParseError, OSError, EOFError) as e:
+                logger.warning(f"XML ignorado na importação da planilha {arquivo}: {e}")
+                continue
+            importados[relativo] = xmls[relativo]
+
+            base = base_documento(arquivo)
+            pdf = base + ".pdf"
+            if not os.path.exists(pdf):
+                pdf = pdfs.get(os.path.basename(base).lower())
+            for chave in lidas.pop("CANCELADAS") - canceladas:
+                canceladas.add(chave)
+                novas_canceladas.add(chave)
+                for registro in notas.pop(chave, ()):
+                    _zerar(registro)
+            for grupo, registros in lidas.items():
+                for registro in registros:
+                    chave = registro[-1]
+                    if grupo != "EVENTOS":
+                        if chave in canceladas:
+                            _zerar(registro)
+                        else:
+                            notas.setdefault(chave, []).append(registro)
+                    linhas[grupo].append(registro)
+                    if pdf:
+                        links[grupo].append(os.path.relpath(pdf, pasta))
+                    else:
+                        links[grupo].append(URL_DANFSE + chave if chave else None)
+
+        if not completo and len(importados) == lidos_antes:
+            logger.info(f"Planilha {os.path.basename(caminho_xlsm)} já atualizada, nenhum XML novo")
+            return {grupo: 0 for grupo in TABELAS}
+
+        for grupo, (planilha, tabela) in TABELAS.items():
+            if not completo and grupo != "EVENTOS" and novas_canceladas:
+                _zerar_existentes(wb[planilha], tabela, novas_canceladas)
+            if completo or linhas[grupo]:
+                _preencher_tabela(wb[planilha], tabela, linhas[grupo], links[grupo], manter=not completo)
+        _gravar_controle(wb, alvo, importados, canceladas)
+
+        temporario = caminho_xlsm + ".tmp"
+        wb.save(temporario)
+        os.replace(temporario, caminho_xlsm)
+    finally:
+        wb.close()
+
+    contagem = {grupo: len(registros) for grupo, registros in linhas.items()}
+    logger.info(f"Planilha {os.path.basename(caminho_xlsm)} importada ({'completa' if completo else 'incremental'}): {contagem}")
+    return contagem
@@ -153,4 +153,10 @@ def formatar_milhar(event: tk.Event) -> None:
             chars_encontrados += 1
         novo_cursor += 1
     
-    widget.icursor(novo_cursor)
\ No newline at end of file
+    widget.icursor(novo_cursor)
+
+def meses_entre(ano_ini: str, mes_ini: str, ano_fim: str, mes_fim: str) -> list[tuple[str, str]]:
+    """Lista os meses (ano, mês) de ``ano_ini/mes_ini`` até ``ano_fim/mes_fim``, inclusive."""
+    inicio = int(ano_ini) * 12 + int(mes_ini) - 1
+    fim = int(ano_fim) * 12 + int(mes_fim) - 1
+    return [(str(i // 12), f"{i % 12 + 1:02d}") for i in range(inicio, fim + 1)]
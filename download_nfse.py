@@ -1,6 +1,7 @@
 from tkhtmlview import HTMLLabel
 import markdown
 import logging
+import multiprocessing
 import os
 import sys
 import tkinter as tk
@@ -13,7 +14,6 @@ from ui.download_window import DownloadUI
 from config.config import configurar_logging
 from ui.ui_basic import modal_window, back_window, centralizar
 
-configurar_logging(nivel=logging.INFO)
 logger = logging.getLogger(__name__)
 
 try:
@@ -201,6 +201,9 @@ class App:
         text.config(state=tk.DISABLED)
 
 if __name__ == "__main__":
+    # Processos do pool de decodificação no executável (PyInstaller) não reabrem a interface
+    multiprocessing.freeze_support()
+    configurar_logging(nivel=logging.INFO)
     try:
         cfg = Config.load(DIRETORIOS['config_json'])
         logger.info(f"Configuração carregada: \n{cfg}")
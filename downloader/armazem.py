@@ -0,0 +1,238 @@
+import base64
+import bisect
+import json
+import logging
+import os
+import shutil
+import tempfile
+from typing import Optional
+logger = logging.getLogger(__name__)
+
+ARQUIVO_INDICE = "indice.json"
+LOTE_MAX = 50           # Documentos por página, como no LoteDFe do ADN
+SALVAR_A_CADA = 20      # Páginas novas entre gravações do índice
+
+## ------------------------------------------------------------------------------
+## Armazém local dos documentos brutos do ADN
+## ------------------------------------------------------------------------------
+class ArmazemDFe:
+    """
+    Guarda o ``ArquivoXml`` (gzip) de cada documento em
+    ``dados/{cnpj}/armazem/{NSU // 1000}/{NSU}_{chave}.gz`` e um índice com as
+    faixas de NSU já consultadas no ADN. Uma faixa coberta pode ser servida
+    do disco no mesmo formato do LoteDFe, sem nova requisição.
+
+    Ao passar de ``limite_bytes``, os documentos de NSU mais baixo são
+    descartados e a cobertura recua junto, de modo que a faixa restante
+    continue completa.
+
+    Usado pela thread de busca de uma única empresa; ``salvar()`` é chamado
+    depois que a busca terminou.
+    """
+
+    def __init__(self, pasta: str, limite_bytes: int):
+        self.pasta = pasta
+        self.limite_bytes = limite_bytes
+        self.arquivo_indice = os.path.join(pasta, ARQUIVO_INDICE)
+        self.documentos: dict = {}      # NSU -> (chave, tamanho em bytes)
+        self.intervalos: list = []      # Faixas [inicial, final] cobertas, ordenadas
+        self.tamanho_total = 0
+        self.servidos = 0
+        self._nsus: list = []
+        self._por_chave: dict = {}
+        self._paginas_novas = 0
+        self._carregar()
+
+    @classmethod
+    def do_config(cls, config) -> Optional["ArmazemDFe"]:
+        """Cria o armazém da empresa; ``armazem_max_mb`` <= 0 desativa"""
+        limite_mb = float(config.armazem_max_mb)
+        if limite_mb <= 0:
+            return None
+        return cls(os.path.join(config.data_dir, "armazem"), int(limite_mb * 1024 * 1024))
+
+    ## ------------------------------------------------------------------------------
+    ## Índice
+    ## ------------------------------------------------------------------------------
+    def _carregar(self) -> None:
+        try:
+            if os.path.exists(self.arquivo_indice):
+                with open(self.arquivo_indice, "r", encoding="utf-8") as f:
+                    dados = json.load(f)
+                self.intervalos = [list(faixa) for faixa in dados.get("intervalos", [])]
+                self.documentos = {int(nsu): tuple(doc) for nsu, doc in dados.get("documentos", {}).items()}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Índice do armazém ilegível, iniciando vazio: {e}")
+            self.intervalos, self.documentos = [], {}
+
+        self._nsus = sorted(self.documentos)
+        self.tamanho_total = sum(tamanho for _, tamanho in self.documentos.values())
+        for nsu, (chave, _) in self.documentos.items():
+            self._por_chave.setdefault(chave, []).append(nsu)
+
+    def salvar(self) -> None:
+        """Aplica o limite de tamanho e grava o índice (arquivo temporário + os.replace)"""
+        self._despejar()
+        dados = {
+            "intervalos": self.intervalos,
+            "documentos": {str(nsu): list(doc) for nsu, doc in self.documentos.items()},
+        }
+        try:
+            os.makedirs(self.pasta, exist_ok=True)
+            fd, temp = tempfile.mkstemp(dir=self.pasta, prefix=".indice_", suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(dados, f, ensure_ascii=False)
+            os.replace(temp, self.arquivo_indice)
+            self._paginas_novas = 0
+        except OSError as e:
+            logger.warning(f"Não foi possível gravar o índice do armazém: {e}")
+
+    def _caminho(self, nsu: int, chave: str) -> str:
+        return os.path.join(self.pasta, f"{nsu // 1000:06d}", f"{nsu}_{chave}.gz")
+
+    ## ------------------------------------------------------------------------------
+    ## Cobertura de NSU
+    ## ------------------------------------------------------------------------------
+    def _cobertura(self, nsu: int) -> Optional[int]:
+        """NSU final da faixa coberta que contém ``nsu``, ou None"""
+        for inicial, final in self.intervalos:
+            if inicial <= nsu <= final:
+                return final
+            if inicial > nsu:
+                break
+        return None
+
+    def _cobrir(self, inicial: int, final: int) -> None:
+        """Inclui a faixa [inicial, final] e funde as adjacentes/sobrepostas"""
+        faixas = sorted(self.intervalos + [[inicial, final]])
+        self.intervalos = [faixas[0]]
+        for ini, fim in faixas[1:]:
+            if ini <= self.intervalos[-1][1] + 1:
+                self.intervalos[-1][1] = max(self.intervalos[-1][1], fim)
+            else:
+                self.intervalos.append([ini, fim])
+
+    def _descobrir_a_partir(self, nsu: int) -> None:
+        """Remove da cobertura tudo a partir de ``nsu`` (documento perdido no disco)"""
+        self.intervalos = [
+            [ini, min(fim, nsu - 1)] for ini, fim in self.intervalos if ini < nsu
+        ]
+
+    ## ------------------------------------------------------------------------------
+    ## Leitura e gravação
+    ## ------------------------------------------------------------------------------
+    def pagina(self, nsu: int) -> Optional[tuple]:
+        """
+        Monta, a partir do disco, a página que o ADN devolveria para o cursor
+        ``nsu``. Retorna (documentos, proximo) ou None se a faixa não está coberta.
+        """
+        final = self._cobertura(nsu + 1)
+        if final is None:
+            return None
+
+        inicio = bisect.bisect_right(self._nsus, nsu)
+        fim = bisect.bisect_right(self._nsus, final)
+        nsus = self._nsus[inicio:min(fim, inicio + LOTE_MAX)]
+
+        documentos = []
+        for nsu_doc in nsus:
+            chave = self.documentos[nsu_doc][0]
+            try:
+                with open(self._caminho(nsu_doc, chave), "rb") as f:
+                    conteudo = f.read()
+            except OSError:
+                logger.warning(f"Documento NSU {nsu_doc} ausente no armazém; será consultado no ADN")
+                self._descobrir_a_partir(nsu_doc)
+                break
+            documentos.append({
+                "NSU": nsu_doc,
+                "ChaveAcesso": chave,
+                "ArquivoXml": base64.b64encode(conteudo).decode("ascii"),
+            })
+
+        if len(documentos) < len(nsus):
+            # Parte do lote sumiu do disco: entrega o que há e busca o resto no ADN
+            if not documentos:
+                return None
+            proximo = documentos[-1]["NSU"]
+        elif fim - inicio > LOTE_MAX:
+            proximo = nsus[-1]
+        else:
+            proximo = final
+
+        self.servidos += len(documentos)
+        return documentos, proximo
+
+    def guardar(self, nsu: int, documentos: list) -> None:
+        """Grava os documentos recebidos do ADN para o cursor ``nsu`` e marca a faixa como coberta"""
+        if not documentos:
+            return
+        try:
+            for doc in documentos:
+                nsu_doc = int(doc["NSU"])
+                chave = doc["ChaveAcesso"]
+                if nsu_doc in self.documentos:
+                    continue
+                conteudo = base64.b64decode(doc["ArquivoXml"])
+                caminho = self._caminho(nsu_doc, chave)
+                os.makedirs(os.path.dirname(caminho), exist_ok=True)
+                with open(caminho, "wb") as f:
+                    f.write(conteudo)
+                self.documentos[nsu_doc] = (chave, len(conteudo))
+                self.tamanho_total += len(conteudo)
+                bisect.insort(self._nsus, nsu_doc)
+                self._por_chave.setdefault(chave, []).append(nsu_doc)
+        except (OSError, KeyError, ValueError) as e:
+            # Sem gravar a faixa inteira, não marca cobertura
+            logger.warning(f"Não foi possível armazenar o lote do NSU {nsu}: {e}")
+            return
+
+        self._cobrir(nsu + 1, max(int(doc["NSU"]) for doc in documentos))
+        self._paginas_novas += 1
+        if self._paginas_novas >= SALVAR_A_CADA:
+            self.salvar()
+
+    def por_chave(self, chave: str) -> list:
+        """Conteúdos gzip armazenados para ``chave`` (nota e eventos), em ordem de NSU"""
+        conteudos = []
+        for nsu in sorted(self._por_chave.get(chave, [])):
+            try:
+                with open(self._caminho(nsu, chave), "rb") as f:
+                    conteudos.append(f.read())
+            except OSError:
+                continue
+        return conteudos
+
+    ## ------------------------------------------------------------------------------
+    ## Limite de tamanho
+    ## ------------------------------------------------------------------------------
+    def _despejar(self) -> None:
+        """Descarta os NSUs mais antigos até ficar abaixo de 90% do limite"""
+        if self.tamanho_total <= self.limite_bytes:
+            return
+
+        alvo = int(self.limite_bytes * 0.9)
+        corte = None
+        removidos = 0
+        while self._nsus and self.tamanho_total > alvo:
+            corte = self._nsus.pop(0)
+            chave, tamanho = self.documentos.pop(corte)
+            self.tamanho_total -= tamanho
+            self._por_chave[chave].remove(corte)
+            if not self._por_chave[chave]:
+                del self._por_chave[chave]
+            try:
+                os.remove(self._caminho(corte, chave))
+            except OSError:
+                pass
+            removidos += 1
+
+        if corte is None:
+            return
+        # A cobertura passa a começar depois do último NSU descartado
+        self.intervalos = [[max(ini, corte + 1), fim] for ini, fim in self.intervalos if fim > corte]
+        for nome in os.listdir(self.pasta):
+            caminho = os.path.join(self.pasta, nome)
+            if os.path.isdir(caminho) and nome.isdigit() and int(nome) < corte // 1000:
+                shutil.rmtree(caminho, ignore_errors=True)
+        logger.info(f"Armazém acima do limite: {removidos} documentos antigos descartados (até NSU {corte})")
@@ -0,0 +1,115 @@
+import json
+import logging
+import os
+import tempfile
+from datetime import datetime
+from typing import Optional
+logger = logging.getLogger(__name__)
+
+ARQUIVO_CHECKPOINT = "checkpoint.json"
+
+## ------------------------------------------------------------------------------
+## Checkpoint do download em andamento
+## ------------------------------------------------------------------------------
+class CheckpointDownload:
+    """
+    Estado parcial de um download, gravado de forma atômica a cada
+    ``intervalo`` documentos: último NSU concluído e intervalos parciais por
+    mês. Permite retomar uma execução interrompida sem limpar as pastas da
+    empresa; a retomada recomeça no NSU seguinte ao concluído, então nenhum
+    documento é reprocessado.
+    """
+
+    def __init__(self, pasta_dados: str, modo: str, ano: str, mes: str, intervalo: int = 50,
+                 ate: Optional[str] = None):
+        self.arquivo = os.path.join(pasta_dados, ARQUIVO_CHECKPOINT)
+        self.modo = modo
+        self.ano = ano
+        self.mes = mes
+        self.ate = ate  # Último mês (AAAA-MM) quando a execução cobre vários meses
+        self.intervalo = max(1, int(intervalo))
+        self.nsu_atual: Optional[int] = None
+        self.intervalos: dict = {}
+        self.documentos = 0
+        self.tent_post = 0
+        self._pendentes = 0
+
+    @staticmethod
+    def _identidade(dados: dict) -> tuple:
+        return (dados.get("modo"), dados.get("ano"), dados.get("mes"), dados.get("ate"))
+
+    @staticmethod
+    def pendente(pasta_dados: str, modo: str, ano: str, mes: str, ate: Optional[str] = None) -> bool:
+        """Indica se há checkpoint desta competência/modo para retomar"""
+        dados = CheckpointDownload._ler(os.path.join(pasta_dados, ARQUIVO_CHECKPOINT))
+        return bool(dados) and CheckpointDownload._identidade(dados) == (modo, ano, mes, ate)
+
+    @staticmethod
+    def _ler(arquivo: str) -> Optional[dict]:
+        try:
+            if os.path.exists(arquivo):
+                with open(arquivo, "r", encoding="utf-8") as f:
+                    return json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Checkpoint ilegível ({arquivo}): {e}")
+        return None
+
+    def carregar(self) -> bool:
+        """Carrega o checkpoint se for da mesma competência/modo. Retorna True se carregou"""
+        dados = self._ler(self.arquivo)
+        if not dados or self._identidade(dados) != (self.modo, self.ano, self.mes, self.ate):
+            return False
+
+        self.nsu_atual = int(dados["nsu_atual"])
+        self.intervalos = {
+            tuple(chave.split("-")): intervalo for chave, intervalo in dados.get("intervalos", {}).items()
+        }
+        self.documentos = int(dados.get("documentos", 0))
+        self.tent_post = int(dados.get("tent_post", 0))
+        logger.info(f"Checkpoint carregado: NSU {self.nsu_atual}, {self.documentos} documentos já baixados")
+        return True
+
+    def registrar(self, nsu_item: int, intervalos_por_mes: dict, tent_post: int, documentos: int) -> None:
+        """Marca ``nsu_item`` como concluído e grava a cada ``intervalo`` documentos"""
+        self.nsu_atual = nsu_item
+        self.intervalos = intervalos_por_mes
+        self.tent_post = tent_post
+        self.documentos = documentos
+        self._pendentes += 1
+        if self._pendentes >= self.intervalo:
+            self.salvar()
+
+    def salvar(self) -> None:
+        """Grava o checkpoint (arquivo temporário + os.replace)"""
+        if self.nsu_atual is None:
+            return
+        dados = {
+            "modo": self.modo,
+            "ano": self.ano,
+            "mes": self.mes,
+            "ate": self.ate,
+            "nsu_atual": self.nsu_atual,
+            "documentos": self.documentos,
+            "tent_post": self.tent_post,
+            "intervalos": {f"{a}-{m}": intervalo for (a, m), intervalo in self.intervalos.items()},
+            "atualizado_em": datetime.now().isoformat(timespec="seconds"),
+        }
+        pasta = os.path.dirname(self.arquivo)
+        try:
+            fd, temp = tempfile.mkstemp(dir=pasta, prefix=".checkpoint_", suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(dados, f, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp, self.arquivo)
+            self._pendentes = 0
+        except OSError as e:
+            logger.warning(f"Não foi possível gravar checkpoint: {e}")
+
+    def descartar(self) -> None:
+        """Remove o checkpoint (execução concluída ou nova execução do zero)"""
+        try:
+            if os.path.exists(self.arquivo):
+                os.remove(self.arquivo)
+        except OSError as e:
+            logger.warning(f"Não foi possível remover checkpoint: {e}")
@@ -1,6 +1,4 @@
 import os
-import base64
-import gzip
 import logging
 from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
@@ -9,12 +7,23 @@ import time
 import json
 from pathlib import Path
 from contextlib import contextmanager
+from functools import partial
 from typing import Callable, Iterable, Optional
-import xml.etree.ElementTree as ET
 import requests
 
 ## Módulos auxiliares
+from downloader.armazem import ArmazemDFe
+from downloader.checkpoint import CheckpointDownload
+from downloader.decodificacao import DecodificadorLotes
+from downloader.erros import DiarioErros
+from downloader.extrator import ExtratorNFSe
+from downloader.intervalos import IndiceIntervalos
+from downloader.indice import IndiceDocumentos, PDF_OK, PDF_PENDENTE
+from downloader.pastas import PastasEmpresa, documento_para_gravar
 from downloader.pdf import NFSePDFDownloader
+from downloader.pipeline import BuscadorLotes
+from downloader.rate_limit import LimitadorTaxa
+from downloader.retry import PoliticaRetry
 from config.config import Config, STATUS_STOP, MAX_TENT
 
 logger = logging.getLogger(__name__)
@@ -40,6 +49,11 @@ class NFSeDownloaderCompetencia:
         self.session: Optional[requests.Session] = None
         self.base_url = "https://adn.nfse.gov.br/contribuintes/DFe"
         self._running = True
+        self.retry = PoliticaRetry.do_config(config, running=self.running)
+        self.extrator = ExtratorNFSe()
+        self.decodificador = DecodificadorLotes.do_config(config, self.extrator)
+        self.pastas = PastasEmpresa.do_config(config)
+        self.erros = DiarioErros.do_config(config)
 
     def stop(self):
         """Para a execução do download"""
@@ -51,105 +65,39 @@ class NFSeDownloaderCompetencia:
         """Verifica se o processo deve continuar"""
         return self._running
 
+    def _consultar(self, url: str) -> requests.Response:
+        """Uma requisição ao ADN, informando o resultado ao limitador de taxa"""
+        inicio = time.monotonic()
+        try:
+            resp = self.session.get(url, timeout=self.retry.timeout)
+        except requests.exceptions.Timeout:
+            self.limitador.registrar(None, time.monotonic() - inicio)
+            raise
+        self.limitador.registrar(resp.status_code, time.monotonic() - inicio, resp.headers.get("Retry-After"))
+        return resp
+
+    def _requisitar_lote(self, nsu: int, running: Callable[[], bool]) -> Optional[requests.Response]:
+        """Consulta o lote a partir de ``nsu`` via limitador e retry; None se interrompido"""
+        if not self.limitador.aguardar(running):
+            return None
+        url = f"{self.base_url}/{nsu:020d}?cnpj={self.config.cnpj}"
+        return self.retry.executar(lambda: self._consultar(url), f"NSU {nsu}", running)
+
     @staticmethod
     def extrair_competencia(xml_bytes: bytes) -> tuple[str, str]:
         """Extrai ano e mês do campo dCompet (competência) do XML"""
-        now = datetime.now()
-        try:
-            root = ET.fromstring(xml_bytes)
-            
-            # Procurar pelo campo dCompet em diferentes locais possíveis
-            for tag in ("dCompet", "Competencia", "DataCompetencia"):
-                el = root.find(f'.//{{*}}{tag}')
-                if el is None:
-                    el = root.find(f'.//*[local-name()="{tag}"]')
-                
-                if el is not None and el.text:
-                    txt = el.text.strip()
-                    try:
-                        # Tentar formato ISO (AAAA-MM-DD)
-                        dt = datetime.fromisoformat(txt.replace("Z", ""))
-                        return str(dt.year), f"{dt.month:02d}"
-                    except Exception:
-                        # Tentar outros formatos
-                        for fmt in ("%Y-%m-%d", "%d/%m/%Y", "%Y%m"):
-                            try:
-                                dt = datetime.strptime(txt[:10], fmt)
-                                return str(dt.year), f"{dt.month:02d}"
-                            except Exception:
-                                continue
-        except Exception as e:
-            logger.debug(f"Erro ao extrair competência: {e}")
-        
-        # Se não encontrou, retorna data atual
-        return str(now.year), f"{now.month:02d}"
+        dados = ExtratorNFSe().extrair(xml_bytes)
+        return dados.ano_compet, dados.mes_compet
 
     @staticmethod
     def extrair_data_emissao(xml_bytes: bytes) -> tuple[str, str]:
         """Extrai ano e mês da data de emissão (dhEmi, dhEvento, DataEmissao)"""
-        now = datetime.now()
-        try:
-            root = ET.fromstring(xml_bytes)
-            el = None
-            for tag in ("dhEmi", "dhEvento", "DataEmissao"):
-                el = root.find(f'.//{{*}}{tag}')
-                if el is None:
-                    el = root.find(f'.//*[local-name()="{tag}"]')
-                
-                if el is not None and el.text:
-                    break
-            
-            if el is not None and el.text:
-                txt = el.text.strip()
-                try:
-                    dt = datetime.fromisoformat(txt.replace("Z", ""))
-                    return str(dt.year), f"{dt.month:02d}"
-                except Exception:
-                    for fmt in ("%Y-%m-%d", "%d/%m/%Y"):
-                        try:
-                            dt = datetime.strptime(txt[:10], fmt)
-                            return str(dt.year), f"{dt.month:02d}"
-                        except Exception:
-                            continue
-        except Exception:
-            pass
-        
-        return str(now.year), f"{now.month:02d}"
+        dados = ExtratorNFSe().extrair(xml_bytes)
+        return dados.ano_emissao, dados.mes_emissao
 
     def determinar_tipo_documento(self, xml_bytes: bytes) -> str:
         """Determina se o documento é PRESTADO, TOMADO ou EVENTO"""
-        try:
-            root = ET.fromstring(xml_bytes)
-            
-            # Tentar encontrar o CNPJ do prestador
-            cnpj_prestador = None
-            
-            # Procurar em diferentes locais possíveis para o CNPJ do prestador
-            for cnpj_tag in ['.//{*}CNPJ', './/{*}Cnpj', './/{*}prestador/{*}CNPJ', 
-                            './/{*}Prestador/{*}Cnpj', './/{*}infDPS/{*}prest/{*}CNPJ']:
-                element = root.find(cnpj_tag)
-                if element is not None and element.text:
-                    cnpj_prestador = element.text.strip()
-                    break
-            
-            # Se encontrou CNPJ do prestador, comparar com CNPJ da empresa
-            if cnpj_prestador:
-                if cnpj_prestador == self.config.cnpj:
-                    return "PRESTADOS"
-                else:
-                    return "TOMADOS"
-            
-            # Se não encontrou CNPJ do prestador, verificar se é evento
-            evento_tags = ['{*}evento', '{*}Evento', '{*}InfEvento']
-            for tag in evento_tags:
-                if root.find(f'.//{tag}') is not None:
-                    return "EVENTOS"
-                    
-        except Exception as e:
-            self.logger.error(f"Erro ao determinar tipo do documento: {e}")
-        
-        # Default para eventos se não conseguir determinar
-        return "EVENTOS"
+        return self.extrator.extrair(xml_bytes).tipo(self.config.cnpj)
 
     @contextmanager
     def pfx_to_pem(
@@ -183,45 +131,16 @@ class NFSeDownloaderCompetencia:
     ## ------------------------------------------------------------------------------
     ## Tratamentos por execução
     ## ------------------------------------------------------------------------------
-    def limpar_pastas_empresa(self):
-        """Limpa o conteúdo das pastas PRESTADOS, TOMADOS e EVENTOS"""
-        pastas = ["PRESTADOS", "TOMADOS", "EVENTOS"]
-        
-        for pasta in pastas:
-            pasta_path = os.path.join(self.config.output_dir, pasta)
-            if os.path.exists(pasta_path):
-                for arquivo in os.listdir(pasta_path):
-                    caminho_arquivo = os.path.join(pasta_path, arquivo)
-                    try:
-                        if os.path.isfile(caminho_arquivo):
-                            os.remove(caminho_arquivo)
-                        elif os.path.isdir(caminho_arquivo):
-                            import shutil
-                            shutil.rmtree(caminho_arquivo)
-                    except Exception as e:
-                        self.logger.error(f"Erro ao deletar {caminho_arquivo}: {e}")
-
-    def criar_pastas_empresa(self):
-        """Cria as pastas PRESTADOS, TOMADOS e EVENTOS se não existirem"""
-        pastas = ["PRESTADOS", "TOMADOS", "EVENTOS"]
-        
-        for pasta in pastas:
-            pasta_path = os.path.join(self.config.output_dir, pasta)
-            os.makedirs(pasta_path, exist_ok=True)
-
     def registrar_erro(self, nsu: int, chave: str, tipo: str, descricao: str, 
-                      ano_compet: str = None, mes_compet: str = None):
-        """Registra erro no arquivo erros.txt da empresa"""
+                      ano_compet: str = None, mes_compet: str = None, status: int = None, tentativa: int = None):
+        """Registra erro no diário da empresa (erros.jsonl/erros.txt), gravado em bloco"""
         try:
             if ano_compet is None or mes_compet is None:
                 ano_compet = str(datetime.now().year)
                 mes_compet = f"{datetime.now().month:02d}"
             
-            erro_file = os.path.join(self.config.output_dir, "erros.txt")
-            timestamp = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
-            
-            with open(erro_file, "a", encoding="utf-8") as f:
-                f.write(f"[{timestamp}] Competência: {mes_compet}/{ano_compet} - NSU: {nsu} - Chave: {chave} - Tipo: {tipo} - Erro: {descricao}\n")
+            # PDFs registram falhas a partir das threads do pool; o diário grava em bloco
+            self.erros.registrar(nsu, chave, tipo, descricao, f"{ano_compet}-{mes_compet}", status, tentativa)
             
             self.logger.error(f"Erro registrado: Competência {mes_compet}/{ano_compet} - NSU {nsu} - {tipo} - {descricao}")
             return True
@@ -230,14 +149,9 @@ class NFSeDownloaderCompetencia:
             return False
         
     def limpar_arquivo_erros(self):
-        """Limpa o arquivo de erros no início de cada execução"""
+        """Limpa o diário de erros no início de cada execução"""
         try:
-            erro_file = os.path.join(self.config.output_dir, "erros.txt")
-            if os.path.exists(erro_file):
-                os.remove(erro_file)
-                self.logger.info("Arquivo de erros anterior removido")
-            with open(erro_file, "w", encoding="utf-8"):
-                pass
+            self.erros.limpar()
             self.logger.info("Arquivo de erros limpo para nova execução")
         except Exception as e:
             self.logger.error(f"Erro ao limpar arquivo de erros: {e}")
@@ -253,31 +167,9 @@ class NFSeDownloaderCompetencia:
 
     def obter_nsu_inicial_competencia(self, nsu_comp, ano, mes):
         """Obtém o NSU inicial para uma competência - SEMPRE do início"""
-        registros = nsu_comp.get("registros", {})
-        
-        # Se já existe registro para esta competência, usar o nsu_inicial registrado
-        if ano in registros and mes in registros[ano]:
-            registro = registros[ano][mes]
-            return registro.get("nsu_inicial", 1)
-        
-        # Buscar o maior NSU final de competências anteriores
-        maior_nsu_anterior = 0
-        competencia_atual = datetime(int(ano), int(mes), 1)  
-        
-        for a, meses_reg in registros.items():
-            for m, dados in meses_reg.items():
-                competencia_reg = datetime(int(a), int(m), 1) 
-                if competencia_reg < competencia_atual:
-                    nsu_final = dados.get("nsu_final", 0)
-                    if nsu_final > maior_nsu_anterior:
-                        maior_nsu_anterior = nsu_final
-        
-        # Se encontrou competências anteriores, começar do maior NSU + 1
-        if maior_nsu_anterior > 0:
-            return maior_nsu_anterior + 1
-        
-        # Primeira execução - começar do 1
-        return 1
+        # Registrado: o nsu_inicial da competência; senão o maior NSU final
+        # das competências anteriores + 1 (1 na primeira execução)
+        return IndiceIntervalos.do_nsu_comp(nsu_comp).nsu_inicial(ano, mes)
 
     def calcular_competencia_limite(self, ano_compet: str, mes_compet: str) -> tuple[str, str]:
         """Calcula a competência 6 meses após a escolhida (ano, mês)"""
@@ -337,16 +229,19 @@ class NFSeDownloaderCompetencia:
     ## ------------------------------------------------------------------------------
     ## Processo principal de download
     ## ------------------------------------------------------------------------------
-    def run_competencia(self, ano_compet, mes_compet, nsu_competencia_file, write=None):
+    def run_competencia(self, ano_compet, mes_compet, nsu_competencia_file, write=None, retomar=False, meses=None):
         """
         Executa download por competência específica (campo dCompet).
-        Baixa documentos cuja competência OU emissão seja do mês escolhido.
+        Baixa documentos cuja competência OU emissão seja do(s) mês(es) escolhido(s).
         
         Args:
             ano_compet: Ano da competência (string)
             mes_compet: Mês da competência (string, formato "01" a "12")
             nsu_competencia_file: Caminho do arquivo de controle JSON
             write: Função callback para atualização de progresso
+            retomar: Continua do checkpoint da execução interrompida, sem limpar as pastas
+            meses: Lista (ano, mês) de competências numa única passada; com mais de
+                uma, os arquivos vão para {TIPO}/{AAAA-MM}
         
         Returns:
             int: Número de documentos baixados
@@ -354,25 +249,39 @@ class NFSeDownloaderCompetencia:
         if write is None:
             write = lambda msg, log=True: self.logger.info(msg) if log else None
         
-        self.logger.info(f"Iniciando download VERIFICAÇÃO DUPLA para mês {mes_compet}/{ano_compet}")
+        alvos = sorted(set(meses or [(ano_compet, mes_compet)]))
+        ano_compet, mes_compet = alvos[0]
+        ano_ult, mes_ult = alvos[-1]
+        varios_meses = len(alvos) > 1
+        
+        self.logger.info(f"Iniciando download VERIFICAÇÃO DUPLA para mês {mes_compet}/{ano_compet}"
+                         + (f" até {mes_ult}/{ano_ult}" if varios_meses else ""))
         self.logger.info("Baixando documentos cuja COMPETÊNCIA OU EMISSÃO seja do mês escolhido")
         
-        # Calcular competência limite (6 meses após)
-        ano_limite, mes_limite = self.calcular_competencia_limite(ano_compet, mes_compet)
+        # Calcular competência limite (6 meses após o último mês escolhido)
+        ano_limite, mes_limite = self.calcular_competencia_limite(ano_ult, mes_ult)
         self.logger.info(f"Buscando até NSU final da competência {mes_limite}/{ano_limite}")
         
-        # Limpar e criar pastas da empresa
-        self.limpar_pastas_empresa()
-        self.criar_pastas_empresa()
+        # Checkpoint para retomar execuções interrompidas
+        checkpoint = CheckpointDownload(
+            self.config.data_dir, "Competência", ano_compet, mes_compet, self.config.checkpoint_interval,
+            ate=f"{ano_ult}-{mes_ult}" if varios_meses else None
+        )
+        retomando = retomar and checkpoint.carregar()
         
-        # Limpar arquivo de erros
-        self.limpar_arquivo_erros()
+        # Incremental: mantém os arquivos e remove ao final só o que saiu do período
+        self.pastas.preparar(retomando)
+        if not retomando:
+            checkpoint.descartar()
+            
+            # Limpar arquivo de erros
+            self.limpar_arquivo_erros()
         
         # Carregar/Criar arquivo de competência
         nsu_comp = self.carregar_nsu_competencia(nsu_competencia_file)
         
-        # Obter NSU inicial baseado nos registros existentes
-        nsu_inicial = self.obter_nsu_inicial_competencia(nsu_comp, ano_compet, mes_compet)
+        # Obter NSU inicial baseado nos registros existentes (o menor entre os meses escolhidos)
+        nsu_inicial = min(self.obter_nsu_inicial_competencia(nsu_comp, a, m) for a, m in alvos)
         nsu_atual = nsu_inicial - 1
         
         self.logger.info(f"NSU inicial: {nsu_inicial}")
@@ -387,13 +296,20 @@ class NFSeDownloaderCompetencia:
                 self.logger.info(f"NSU limite definido: {nsu_limite} (final de {mes_limite}/{ano_limite})")
         
         # Contadores
-        tent_erro = 0
         tent_post = 0  # Contador de competências posteriores ao limite
         documentos_baixados = 0
         auditorias_encontradas = 0
         
         # Dicionário para armazenar os intervalos por mês (emissão) durante esta execução
         intervalos_por_mes = {}  # chave: (ano, mes), valor: {"nsu_inicial": int, "nsu_final": int}
+        concluido = False
+        
+        if retomando:
+            nsu_atual = checkpoint.nsu_atual
+            tent_post = checkpoint.tent_post
+            documentos_baixados = checkpoint.documentos
+            intervalos_por_mes = checkpoint.intervalos
+            self.logger.info(f"Retomando execução interrompida a partir do NSU {nsu_atual}")
 
         # Configurar sessão
         with self.pfx_to_pem() as pem_cert:
@@ -402,185 +318,203 @@ class NFSeDownloaderCompetencia:
             self.session.verify = True
             
             if self.config.download_pdf:
-                pdf_dl = NFSePDFDownloader(self.session, self.config.timeout)
+                # PDFs baixam em paralelo, com limitador próprio, enquanto os XMLs seguem
+                pdf_dl = NFSePDFDownloader.do_config(self.config, self.session, self.retry, self.running)
+            
+            # Limitador adaptativo, com a última taxa boa salva por certificado
+            self.limitador = LimitadorTaxa.do_config(
+                self.config, os.path.join(self.config.data_dir, "limitador.json")
+            )
+            # Produtor busca o próximo lote enquanto este é processado; faixas já
+            # consultadas em execuções anteriores vêm do armazém local
+            armazem = ArmazemDFe.do_config(self.config)
+            # Índice SQLite dos documentos gravados, consultável depois do download
+            indice = IndiceDocumentos.do_config(self.config)
+            if self.config.download_pdf:
+                pdf_dl.ao_concluir = indice.concluir_pdf
+            buscador = BuscadorLotes(
+                self._requisitar_lote, nsu_atual, self.running, write, self.config.prefetch_pages, armazem
+            ).iniciar()
             
             try:
-                while self.running() and tent_post < MAX_TENT:
+                for pagina in buscador:
+                    nsu_atual = pagina.nsu
                     
-                    # Se já temos NSU limite e passamos dele, verificar se deve parar
-                    if nsu_limite and nsu_atual > nsu_limite:
-                        if tent_post >= MAX_TENT:
-                            self.logger.info(f"Alcançado NSU final do 6º mês ({nsu_limite}). Encerrando busca.")
-                            break
-                    
-                    url = f"{self.base_url}/{nsu_atual:020d}?cnpj={self.config.cnpj}"
+                    if pagina.erro:
+                        self.logger.error(pagina.erro)
+                        self.registrar_erro(nsu_atual, "N/A", pagina.tipo_erro, pagina.erro, ano_compet, mes_compet,
+                                            pagina.status_code)
+                        # Status de parada é o fim normal da busca
+                        concluido = pagina.status_code in STATUS_STOP
+                        continue
                     
-                    write(f"Consultando NSU: {nsu_atual}", log=False)
-                    self.logger.info(f"Consultando NSU {nsu_atual}...")
-
-                    try:
-                        resp = self.session.get(url, timeout=self.config.timeout)
-                    except requests.exceptions.RequestException as e:
-                        status_code = getattr(e.response, 'status_code', 'N/A') if hasattr(e, 'response') else 'N/A'
-                        error_msg = f"Erro de conexão no NSU {nsu_atual}: {e} (Status: {status_code})"
-                        self.logger.error(error_msg)
-                        self.registrar_erro(nsu_atual, "N/A", "CONEXÃO", f"{e} - Status: {status_code}", 
-                                          ano_compet, mes_compet)
-                        break
+                    # base64 + gzip + extração do lote inteiro (no pool de processos se configurado)
+                    decodificados = self.decodificador.decodificar(pagina.documentos)
                     
-                    if resp.status_code == 200:
-                        resposta = resp.json()
-                        if resposta.get("StatusProcessamento") == "DOCUMENTOS_LOCALIZADOS":
-                            documentos = resposta.get("LoteDFe", [])
-                            documentos = sorted(documentos, key=lambda d: int(d.get("NSU", 0)))
+                    for nfse, (xml_bytes, dados, erro_decodificacao) in zip(pagina.documentos, decodificados):
+                        if not self.running():
+                            break
                             
-                            for nfse in documentos:
-                                if not self.running():
-                                    break
-                                    
-                                nsu_item = int(nfse["NSU"])
-                                chave = nfse["ChaveAcesso"]
-                                arquivo_xml = nfse["ArquivoXml"]
+                        nsu_item = int(nfse["NSU"])
+                        chave = nfse["ChaveAcesso"]
+                        
+                        write(f"Processando NSU: {nsu_item}", log=False)
+                        
+                        try:
+                            if erro_decodificacao:
+                                raise ValueError(erro_decodificacao)
+                            
+                            # COMPETÊNCIA, EMISSÃO e tipo numa única leitura do XML
+                            ano_doc_compet, mes_doc_compet = dados.ano_compet, dados.mes_compet
+                            ano_doc_emissao, mes_doc_emissao = dados.ano_emissao, dados.mes_emissao
+                            
+                            self.logger.info(f"NSU {nsu_item} - Competência: {mes_doc_compet}/{ano_doc_compet}, "
+                                        f"Emissão: {mes_doc_emissao}/{ano_doc_emissao}")
+                            
+                            # ATUALIZAR REGISTRO DE EMISSÃO no dicionário temporário
+                            chave_mes = (ano_doc_emissao, mes_doc_emissao)
+                            if chave_mes not in intervalos_por_mes:
+                                intervalos_por_mes[chave_mes] = {"nsu_inicial": nsu_item, "nsu_final": nsu_item}
+                            else:
+                                # Atualizar o menor nsu_inicial e maior nsu_final
+                                if nsu_item < intervalos_por_mes[chave_mes]["nsu_inicial"]:
+                                    intervalos_por_mes[chave_mes]["nsu_inicial"] = nsu_item
+                                if nsu_item > intervalos_por_mes[chave_mes]["nsu_final"]:
+                                    intervalos_por_mes[chave_mes]["nsu_final"] = nsu_item
+                            
+                            # VERIFICAÇÃO DUPLA: verificar se deve baixar (competência OU emissão)
+                            # O documento vai para todos os meses escolhidos que casarem
+                            destinos = []
+                            for ano_alvo, mes_alvo in alvos:
+                                casou, motivo = self.deve_baixar_documento(
+                                    ano_doc_compet, mes_doc_compet, 
+                                    ano_doc_emissao, mes_doc_emissao,
+                                    ano_alvo, mes_alvo
+                                )
+                                if casou:
+                                    destinos.append((ano_alvo, mes_alvo, motivo))
+                            deve_baixar = bool(destinos)
+                            
+                            if deve_baixar:
+                                tent_post = 0
                                 
-                                write(f"Processando NSU: {nsu_item}", log=False)
+                                # VERIFICAR SE É CASO DE AUDITORIA (documento "passado"), uma vez por documento
+                                ano_alvo, mes_alvo, _ = destinos[0]
+                                if self.verificar_documento_passado(
+                                    ano_doc_compet, mes_doc_compet,
+                                    ano_doc_emissao, mes_doc_emissao,
+                                    ano_alvo, mes_alvo,
+                                    nsu_item, chave
+                                ):
+                                    self.logger.warning(f"AUDITORIA: Documento NSU {nsu_item} 'passado indevidamente' - "
+                                                      f"Competência: {mes_doc_compet}/{ano_doc_compet}, "
+                                                      f"Emissão: {mes_doc_emissao}/{ano_doc_emissao}")
+                                    auditorias_encontradas += 1
                                 
-                                try:
-                                    # Processar XML
-                                    xml_gzip = base64.b64decode(arquivo_xml)
-                                    xml_bytes = gzip.decompress(xml_gzip)
-                                    
-                                    # Extrair COMPETÊNCIA e EMISSÃO
-                                    ano_doc_compet, mes_doc_compet = self.extrair_competencia(xml_bytes)
-                                    ano_doc_emissao, mes_doc_emissao = self.extrair_data_emissao(xml_bytes)
-                                    
-                                    self.logger.info(f"NSU {nsu_item} - Competência: {mes_doc_compet}/{ano_doc_compet}, "
-                                                f"Emissão: {mes_doc_emissao}/{ano_doc_emissao}")
-                                    
-                                    # ATUALIZAR REGISTRO DE EMISSÃO no dicionário temporário
-                                    chave_mes = (ano_doc_emissao, mes_doc_emissao)
-                                    if chave_mes not in intervalos_por_mes:
-                                        intervalos_por_mes[chave_mes] = {"nsu_inicial": nsu_item, "nsu_final": nsu_item}
-                                    else:
-                                        # Atualizar o menor nsu_inicial e maior nsu_final
-                                        if nsu_item < intervalos_por_mes[chave_mes]["nsu_inicial"]:
-                                            intervalos_por_mes[chave_mes]["nsu_inicial"] = nsu_item
-                                        if nsu_item > intervalos_por_mes[chave_mes]["nsu_final"]:
-                                            intervalos_por_mes[chave_mes]["nsu_final"] = nsu_item
-                                    
-                                    # VERIFICAÇÃO DUPLA: verificar se deve baixar (competência OU emissão)
-                                    deve_baixar, motivo = self.deve_baixar_documento(
-                                        ano_doc_compet, mes_doc_compet, 
-                                        ano_doc_emissao, mes_doc_emissao,
-                                        ano_compet, mes_compet
-                                    )
+                                # Determinar tipo do documento
+                                tipo_documento = dados.tipo(self.config.cnpj)
+                                conteudo, extensao = documento_para_gravar(self.config, nfse, xml_bytes)
+                                
+                                self.logger.info(f"Documento {chave} classificado como: {tipo_documento} - Motivo: {destinos[0][2]}")
+                                
+                                # Uma cópia do XML em cada mês escolhido que casou (pastas {TIPO}/{AAAA-MM})
+                                arquivos = []  # (xml, pdf, pdf já no lugar?, ano, mês)
+                                for ano_alvo, mes_alvo, motivo in destinos:
+                                    pasta_tipo = os.path.join(self.config.output_dir, tipo_documento)
+                                    if varios_meses:
+                                        pasta_tipo = os.path.join(pasta_tipo, f"{ano_alvo}-{mes_alvo}")
+                                        os.makedirs(pasta_tipo, exist_ok=True)
+                                    nome_base = os.path.join(pasta_tipo, f"{self.config.file_prefix}_NSU-{nsu_item}_{chave}")
+                                    filename = nome_base + extensao
                                     
-                                    if deve_baixar:
-                                        tent_erro = 0
-                                        tent_post = 0
-                                        
-                                        # VERIFICAR SE É CASO DE AUDITORIA (documento "passado")
-                                        if self.verificar_documento_passado(
-                                            ano_doc_compet, mes_doc_compet,
-                                            ano_doc_emissao, mes_doc_emissao,
-                                            ano_compet, mes_compet,
-                                            nsu_item, chave
-                                        ):
-                                            self.logger.warning(f"AUDITORIA: Documento NSU {nsu_item} 'passado indevidamente' - "
-                                                              f"Competência: {mes_doc_compet}/{ano_doc_compet}, "
-                                                              f"Emissão: {mes_doc_emissao}/{ano_doc_emissao}")
-                                            auditorias_encontradas += 1
-                                        
-                                        # Determinar tipo do documento
-                                        tipo_documento = self.determinar_tipo_documento(xml_bytes)
-                                        self.logger.info(f"Documento {chave} classificado como: {tipo_documento} - Motivo: {motivo}")
-                                        
-                                        # Baixar arquivo
-                                        pasta_tipo = os.path.join(self.config.output_dir, tipo_documento)
-                                        filename = os.path.join(
-                                            pasta_tipo, 
-                                            f"{self.config.file_prefix}_NSU-{nsu_item}_{chave}.xml"
-                                        )
-                                        
-                                        # Salvar XML
+                                    # Salvar XML (no modo incremental, o que já está no lugar é mantido)
+                                    if not self.pastas.manter(filename, len(conteudo)):
                                         with open(filename, "wb") as fxml:
-                                            fxml.write(xml_bytes)
-                                        
-                                        documentos_baixados += 1
-                                        write(f"XML baixado ({tipo_documento}): {chave} (NSU: {nsu_item}) - Motivo: {motivo}")
-                                        
-                                        # Baixar PDF se configurado
-                                        if self.config.download_pdf:
-                                            pdf_file = os.path.join(
-                                                pasta_tipo,
-                                                f"{self.config.file_prefix}_{nsu_item}_{chave}.pdf",
-                                            )
-                                            if pdf_dl.baixar(chave, pdf_file):
-                                                self.logger.info(f"PDF baixado ({tipo_documento}): {chave}")
-                                            else:
-                                                self.logger.error(f"Falha ao baixar PDF: {chave}")
-                                                self.registrar_erro(nsu_item, chave, "PDF", "Falha no download", 
-                                                                  ano_compet, mes_compet)
-                                    else:
-                                        # Documento não é do mês escolhido (nem por competência, nem por emissão)
-                                        self.logger.info(f"Documento fora do período: {mes_doc_compet}/{ano_doc_compet} - {mes_doc_emissao}/{ano_doc_emissao}")
-                                        
-                                        # Verificar se é posterior ao limite (pela EMISSÃO)
-                                        doc_date_emissao = datetime(int(ano_doc_emissao), int(mes_doc_emissao), 1)
-                                        doc_date_compet = datetime(int(ano_doc_compet), int(mes_doc_compet), 1)
-                                        limite_date = datetime(int(ano_limite), int(mes_limite), 1)
-                                        
-                                        # Usar a data mais recente entre competência e emissão
-                                        data_doc = max(doc_date_emissao, doc_date_compet)
-                                        
-                                        if data_doc > limite_date:
-                                            # Competência/Emissão posterior ao limite
-                                            tent_post += 1
-                                            self.logger.info(f"Competência/Emissão posterior ao limite. Contador: {tent_post}/{MAX_TENT}")
-                                        else:
-                                            # Competência/Emissão anterior ou dentro do período
-                                            tent_post = 0
+                                            fxml.write(conteudo)
                                     
-                                except Exception as e:
-                                    self.logger.error(f"Erro ao processar documento NSU {nsu_item}: {str(e)}")
-                                    self.registrar_erro(nsu_item, chave, "XML", str(e), ano_compet, mes_compet)
-                                    continue
-                            
-                            # Atualizar NSU atual
-                            if documentos:
-                                ultimo_nsu_processado = max(int(nfse["NSU"]) for nfse in documentos)
-                                nsu_atual = ultimo_nsu_processado
+                                    # Mesmo nome do XML, para o PDF ficar ao lado da nota
+                                    pdf_file = nome_base + ".pdf"
+                                    arquivos.append((filename, pdf_file, self.pastas.pertence(pdf_file), ano_alvo, mes_alvo))
+                                
+                                documentos_baixados += 1
+                                write(f"XML baixado ({tipo_documento}): {chave} (NSU: {nsu_item}) - Motivo: {destinos[0][2]}")
+                                situacoes = [
+                                    (xml, (PDF_OK if mantido else PDF_PENDENTE) if self.config.download_pdf else None)
+                                    for xml, _, mantido, _, _ in arquivos
+                                ]
+                                indice.registrar(nsu_item, chave, dados, tipo_documento, *situacoes[0],
+                                                 copias=situacoes[1:])
+                                
+                                # PDF obtido uma vez e replicado nos demais meses (erro registrado no mês de destino)
+                                pendentes = [(pdf, a, m) for _, pdf, mantido, a, m in arquivos if not mantido]
+                                if self.config.download_pdf and pendentes:
+                                    pdf_file, ano_alvo, mes_alvo = pendentes[0]
+                                    pdf_dl.enfileirar(chave, pdf_file, partial(
+                                        self.registrar_erro, nsu_item, chave, "PDF", "Falha no download",
+                                        ano_alvo, mes_alvo, tentativa=pdf_dl.tentativas
+                                    ), nsu=nsu_item, xml_bytes=xml_bytes, copias=[pdf for pdf, _, _ in pendentes[1:]])
                             else:
-                                nsu_atual += 1
+                                # Documento não é do mês escolhido (nem por competência, nem por emissão)
+                                self.logger.info(f"Documento fora do período: {mes_doc_compet}/{ano_doc_compet} - {mes_doc_emissao}/{ano_doc_emissao}")
+                                
+                                # Verificar se é posterior ao limite (pela EMISSÃO)
+                                doc_date_emissao = datetime(int(ano_doc_emissao), int(mes_doc_emissao), 1)
+                                doc_date_compet = datetime(int(ano_doc_compet), int(mes_doc_compet), 1)
+                                limite_date = datetime(int(ano_limite), int(mes_limite), 1)
+                                
+                                # Usar a data mais recente entre competência e emissão
+                                data_doc = max(doc_date_emissao, doc_date_compet)
+                                
+                                if data_doc > limite_date:
+                                    # Competência/Emissão posterior ao limite
+                                    tent_post += 1
+                                    self.logger.info(f"Competência/Emissão posterior ao limite. Contador: {tent_post}/{MAX_TENT}")
+                                else:
+                                    # Competência/Emissão anterior ou dentro do período
+                                    tent_post = 0
                             
-                    elif resp.status_code in STATUS_STOP:
-                        error_msg = f"Status de parada {resp.status_code} no NSU {nsu_atual}"
-                        self.logger.info(error_msg)
-                        self.registrar_erro(nsu_atual, "N/A", "HTTP", error_msg, ano_compet, mes_compet)
-                        break
-
-                    elif resp.status_code == 429:
-                        error_msg = f"Rate limit (429) no NSU {nsu_atual}"
-                        self.logger.info(error_msg)
-                        self.registrar_erro(nsu_atual, "N/A", "MT.REQ (aumentar delay)", error_msg, 
-                                          ano_compet, mes_compet)
-                        break
-
-                    else:
-                        error_msg = f"Erro HTTP {resp.status_code} no NSU {nsu_atual}: {resp.text}"
-                        self.logger.error(error_msg)
-                        self.registrar_erro(nsu_atual, "N/A", "HTTP", error_msg, ano_compet, mes_compet)
-                        tent_erro += 1
-                        
-                        nsu_atual += 1
-                        
-                        if tent_erro >= MAX_TENT:
-                            self.logger.info(f"Máximo de tentativas de erro ({MAX_TENT}) atingido. Parando.")
-                            break
+                            # Documento concluído: avança o checkpoint
+                            checkpoint.registrar(
+                                nsu_item, intervalos_por_mes, tent_post, documentos_baixados
+                            )
+                            
+                        except Exception as e:
+                            self.logger.error(f"Erro ao processar documento NSU {nsu_item}: {str(e)}")
+                            self.registrar_erro(nsu_item, chave, "XML", str(e), ano_compet, mes_compet)
+                            # Mantém o XML/PDF de uma execução anterior desse NSU
+                            self.pastas.preservar(nsu_item)
+                            continue
                     
-                    # Delay entre requisições
-                    time.sleep(self.config.delay_seconds)
+                    nsu_atual = pagina.proximo
+                    
+                    if tent_post >= MAX_TENT:
+                        if nsu_limite and nsu_atual > nsu_limite:
+                            self.logger.info(f"Alcançado NSU final do 6º mês ({nsu_limite}). Encerrando busca.")
+                        concluido = True
+                        break
                     
             finally:
+                buscador.parar()
+                if self.config.download_pdf:
+                    write("Aguardando PDFs pendentes...", log=False)
+                    pdf_dl.encerrar()
+                indice.fechar()
+                self.erros.fechar()
+                self.limitador.salvar()
+                if armazem:
+                    armazem.salvar()
+                self.logger.info(f"Extração de XML: {self.extrator.rapidos} pelo caminho rápido, "
+                                 f"{self.extrator.completos} pela leitura completa")
+                # Concluído: descarta o checkpoint; interrompido: grava para retomar
+                if concluido and self.running():
+                    checkpoint.descartar()
+                    # Arquivos de documentos que falharam já foram preservados (pastas.preservar)
+                    self.pastas.remover_antigos()
+                    resumo = self.pastas.resumo()
+                    write(f"Pastas: {resumo['mantidos']} mantidos, {resumo['novos']} novos, "
+                          f"{resumo['removidos']} removidos")
+                else:
+                    checkpoint.salvar()
                 # Atualizar o arquivo JSON com os intervalos coletados
                 self.atualizar_arquivo_competencia(nsu_competencia_file, intervalos_por_mes, ano_compet, mes_compet)
                 
@@ -618,77 +552,47 @@ class NFSeDownloaderCompetencia:
         """
         nsu_comp = self.carregar_nsu_competencia(nsu_competencia_file)
         registros = nsu_comp.get("registros", {})
+        indice = IndiceIntervalos(registros)
         
         self.logger.info(f"=== AUDITORIA COMPETÊNCIA {mes}/{ano} ===")
         
         # Verificar se a competência existe
-        if ano not in registros or mes not in registros[ano]:
+        if not indice.contem(ano, mes):
             self.logger.warning(f"Competência {mes}/{ano} não encontrada para auditoria")
             return False
         
         correcoes_realizadas = False
         
-        # 1. Coletar todos os registros em uma lista simples
-        registros_lista = []
-        
-        for ano_reg, meses_reg in registros.items():
-            for mes_reg, dados in meses_reg.items():
-                registros_lista.append({
-                    'ano': ano_reg,
-                    'mes': mes_reg,
-                    'nsu_inicial': dados.get("nsu_inicial", 0),
-                    'nsu_final': dados.get("nsu_final", 0)
-                })
-        
-        # 2. Encontrar o período mais recente (último)
-        if registros_lista:
-            # Converter para inteiros para encontrar o mais recente
-            registros_com_data = []
-            for reg in registros_lista:
-                try:
-                    ano_int = int(reg['ano'])
-                    mes_int = int(reg['mes'])
-                    registros_com_data.append({
-                        'ano': reg['ano'],
-                        'mes': reg['mes'],
-                        'ano_int': ano_int,
-                        'mes_int': mes_int,
-                        'nsu_inicial': reg['nsu_inicial'],
-                        'nsu_final': reg['nsu_final']
-                    })
-                except ValueError:
-                    continue
+        # 1-2. Período mais recente (último) e penúltimo, pela ordem cronológica do índice
+        ultimos = indice.ultimos(2)
+        if ultimos:
+            mais_recente = ultimos[0]
+            self.logger.info(f"Período mais recente identificado: {mais_recente['ano']}-{mais_recente['mes']}")
             
-            if registros_com_data:
-                # Encontrar o mais recente (maior ano, maior mês)
-                mais_recente = max(registros_com_data, key=lambda x: (x['ano_int'], x['mes_int']))
-                self.logger.info(f"Período mais recente identificado: {mais_recente['ano']}-{mais_recente['mes']}")
+            # Encontrar o penúltimo (segundo mais recente)
+            if len(ultimos) > 1:
+                penultimo = ultimos[1]
                 
-                # Encontrar o penúltimo (segundo mais recente)
-                registros_sem_mais_recente = [r for r in registros_com_data if r != mais_recente]
-                if registros_sem_mais_recente:
-                    penultimo = max(registros_sem_mais_recente, key=lambda x: (x['ano_int'], x['mes_int']))
-                    
-                    # VERIFICAÇÃO: Último período deve começar onde o anterior terminou +1
-                    esperado_inicial = penultimo['nsu_final'] + 1
+                # VERIFICAÇÃO: Último período deve começar onde o anterior terminou +1
+                esperado_inicial = penultimo['nsu_final'] + 1
+                
+                if mais_recente['nsu_inicial'] != esperado_inicial:
+                    self.logger.warning(
+                        f"✗ ÚLTIMO PERÍODO {mais_recente['ano']}-{mais_recente['mes']}: "
+                        f"nsu_inicial ({mais_recente['nsu_inicial']}) não começa após período anterior "
+                        f"(deveria ser: {esperado_inicial} = {penultimo['ano']}-{penultimo['mes']}.nsu_final + 1)"
+                    )
+                    self.logger.info(f"✓ Corrigindo nsu_inicial do último período para {esperado_inicial}")
                     
-                    if mais_recente['nsu_inicial'] != esperado_inicial:
-                        self.logger.warning(
-                            f"✗ ÚLTIMO PERÍODO {mais_recente['ano']}-{mais_recente['mes']}: "
-                            f"nsu_inicial ({mais_recente['nsu_inicial']}) não começa após período anterior "
-                            f"(deveria ser: {esperado_inicial} = {penultimo['ano']}-{penultimo['mes']}.nsu_final + 1)"
-                        )
-                        self.logger.info(f"✓ Corrigindo nsu_inicial do último período para {esperado_inicial}")
-                        
-                        # Atualizar no dicionário original
-                        registros[mais_recente['ano']][mais_recente['mes']]["nsu_inicial"] = esperado_inicial
-                        correcoes_realizadas = True
-                    else:
-                        self.logger.info(
-                            f"✓ ÚLTIMO PERÍODO {mais_recente['ano']}-{mais_recente['mes']}: "
-                            f"nsu_inicial ({mais_recente['nsu_inicial']}) está correto "
-                            f"(continua de {penultimo['ano']}-{penultimo['mes']}.nsu_final + 1)"
-                        )
+                    # Atualizar no dicionário original
+                    registros[mais_recente['ano']][mais_recente['mes']]["nsu_inicial"] = esperado_inicial
+                    correcoes_realizadas = True
+                else:
+                    self.logger.info(
+                        f"✓ ÚLTIMO PERÍODO {mais_recente['ano']}-{mais_recente['mes']}: "
+                        f"nsu_inicial ({mais_recente['nsu_inicial']}) está correto "
+                        f"(continua de {penultimo['ano']}-{penultimo['mes']}.nsu_final + 1)"
+                    )
         
         # 3. Verificar consistência interna (nsu_inicial <= nsu_final)
         for ano_reg, meses_reg in registros.items():
@@ -810,35 +714,10 @@ class NFSeDownloaderCompetencia:
         """
         self.logger.info("Verificando consistência sequencial dos registros...")
         
-        # Coletar todos os registros em ordem temporal
-        registros_ordenados = []
-        
-        for ano, meses in nsu_comp.get("registros", {}).items():
-            for mes, dados in meses.items():
-                try:
-                    ano_int = int(ano)
-                    mes_int = int(mes)
-                    registros_ordenados.append({
-                        'ano': ano,
-                        'mes': mes,
-                        'ano_int': ano_int,
-                        'mes_int': mes_int,
-                        'nsu_inicial': dados.get("nsu_inicial", 0),
-                        'nsu_final': dados.get("nsu_final", 0)
-                    })
-                except ValueError:
-                    continue
-        
-        # Ordenar por data
-        registros_ordenados.sort(key=lambda x: (x['ano_int'], x['mes_int']))
-        
         correcoes = 0
         
-        # Corrigir sequência
-        for i in range(1, len(registros_ordenados)):
-            atual = registros_ordenados[i]
-            anterior = registros_ordenados[i-1]
-            
+        # Corrigir sequência (pares de meses consecutivos, em ordem temporal)
+        for anterior, atual in IndiceIntervalos.do_nsu_comp(nsu_comp).sequencia():
             # O NSU inicial do mês atual deve ser > NSU final do mês anterior
             esperado_inicial = anterior['nsu_final'] + 1
             
@@ -0,0 +1,391 @@
+import logging
+import textwrap
+import xml.etree.ElementTree as ET
+import zlib
+from concurrent.futures import BrokenExecutor
+from datetime import datetime
+from typing import Optional
+
+## Módulos auxiliares
+from config.utils import formatar_cnpj
+from downloader.decodificacao import descartar_pool, obter_pool
+from downloader.extrator import nome_local
+logger = logging.getLogger(__name__)
+
+# Página A4 em pontos
+LARGURA = 595
+ALTURA = 842
+MARGEM = 36
+UTIL = LARGURA - 2 * MARGEM
+# Largura média de um caractere da Helvetica, em fração do tamanho da fonte
+LARGURA_CARACTERE = 0.55
+
+AVISO = "Gerado localmente a partir do XML da NFS-e. Não substitui o DANFSe oficial do ADN."
+
+## ------------------------------------------------------------------------------
+## Gerador mínimo de PDF
+## ------------------------------------------------------------------------------
+def _escapar(texto: str) -> bytes:
+    """Texto para string literal do PDF (WinAnsi), sem quebras de linha"""
+    texto = " ".join(str(texto).split())
+    dados = texto.encode("cp1252", errors="replace")
+    return dados.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)")
+
+class DocumentoPDF:
+    """
+    PDF com páginas A4, texto em Helvetica/Helvetica-Bold (WinAnsi) e linhas.
+    As coordenadas são medidas a partir do canto superior esquerdo.
+    """
+
+    def __init__(self):
+        self.paginas: list = []
+        self.nova_pagina()
+
+    def nova_pagina(self) -> None:
+        self._atual: list = []
+        self.paginas.append(self._atual)
+
+    def texto(self, x: float, y: float, texto: str, tamanho: float = 9, negrito: bool = False) -> None:
+        fonte = "F2" if negrito else "F1"
+        self._atual.append(
+            b"BT /%s %g Tf %g %g Td (%s) Tj ET" % (fonte.encode(), tamanho, x, ALTURA - y, _escapar(texto))
+        )
+
+    def linha(self, x1: float, y1: float, x2: float, y2: float, espessura: float = 0.5) -> None:
+        self._atual.append(b"%g w %g %g m %g %g l S" % (espessura, x1, ALTURA - y1, x2, ALTURA - y2))
+
+    def faixa(self, x: float, y: float, largura: float, altura: float, cinza: float = 0.9) -> None:
+        """Retângulo preenchido (fundo dos títulos de seção)"""
+        self._atual.append(b"%g g %g %g %g %g re f 0 g" % (cinza, x, ALTURA - y - altura, largura, altura))
+
+    def gerar(self) -> bytes:
+        objetos = [
+            b"<< /Type /Catalog /Pages 2 0 R >>",
+            None,  # Pages, montado depois dos ids das páginas
+            b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+            b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>",
+        ]
+        kids = []
+        for comandos in self.paginas:
+            conteudo = zlib.compress(b"\n".join(comandos))
+            id_pagina = len(objetos) + 1
+            kids.append(b"%d 0 R" % id_pagina)
+            objetos.append(
+                b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] "
+                b"/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents %d 0 R >>"
+                % (LARGURA, ALTURA, id_pagina + 1)
+            )
+            objetos.append(
+                b"<< /Length %d /Filter /FlateDecode >>\nstream\n%s\nendstream" % (len(conteudo), conteudo)
+            )
+        objetos[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(kids), len(kids))
+
+        saida = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        posicoes = []
+        for numero, objeto in enumerate(objetos, 1):
+            posicoes.append(len(saida))
+            saida += b"%d 0 obj\n%s\nendobj\n" % (numero, objeto)
+        inicio_xref = len(saida)
+        saida += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objetos) + 1)
+        for posicao in posicoes:
+            saida += b"%010d 00000 n \n" % posicao
+        saida += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objetos) + 1, inicio_xref)
+        return bytes(saida)
+
+## ------------------------------------------------------------------------------
+## Diagramação
+## ------------------------------------------------------------------------------
+class _Diagramacao:
+    """Escreve seções e campos de cima para baixo, abrindo páginas quando preciso"""
+
+    def __init__(self, pdf: DocumentoPDF):
+        self.pdf = pdf
+        self.y = MARGEM
+
+    def _garantir(self, altura: float) -> None:
+        if self.y + altura > ALTURA - MARGEM:
+            self.pdf.nova_pagina()
+            self.y = MARGEM
+
+    @staticmethod
+    def _quebrar(texto: str, largura: float, tamanho: float) -> list:
+        colunas = max(1, int(largura / (tamanho * LARGURA_CARACTERE)))
+        return textwrap.wrap(" ".join(str(texto).split()), colunas) or [""]
+
+    def cabecalho(self, titulo: str, subtitulo: str) -> None:
+        self.pdf.texto(MARGEM, self.y + 14, titulo, 14, negrito=True)
+        self.pdf.texto(MARGEM, self.y + 28, subtitulo, 9)
+        self.y += 36
+        self.pdf.linha(MARGEM, self.y, LARGURA - MARGEM, self.y, 1)
+        self.y += 6
+
+    def secao(self, titulo: str) -> None:
+        self._garantir(40)
+        self.y += 4
+        self.pdf.faixa(MARGEM, self.y, UTIL, 13)
+        self.pdf.texto(MARGEM + 3, self.y + 9.5, titulo.upper(), 8, negrito=True)
+        self.y += 17
+
+    def campos(self, pares: list, colunas: int = 3) -> None:
+        """Rótulo e valor em grade; valores longos quebram dentro da coluna"""
+        pares = [(rotulo, valor) for rotulo, valor in pares if valor]
+        largura = UTIL / colunas
+        for inicio in range(0, len(pares), colunas):
+            linha = pares[inicio:inicio + colunas]
+            quebras = [self._quebrar(valor, largura - 6, 9) for _, valor in linha]
+            altura = 10 + 11 * max(len(q) for q in quebras)
+            self._garantir(altura)
+            for coluna, ((rotulo, _), valor) in enumerate(zip(linha, quebras)):
+                x = MARGEM + coluna * largura
+                self.pdf.texto(x, self.y + 7, rotulo, 7, negrito=True)
+                for i, trecho in enumerate(valor):
+                    self.pdf.texto(x, self.y + 17 + 11 * i, trecho, 9)
+            self.y += altura + 4
+
+    def paragrafo(self, rotulo: str, texto: Optional[str]) -> None:
+        if not texto:
+            return
+        self._garantir(20)
+        if rotulo:
+            self.pdf.texto(MARGEM, self.y + 7, rotulo, 7, negrito=True)
+            self.y += 8
+        for trecho in self._quebrar(texto, UTIL, 9):
+            self._garantir(11)
+            self.pdf.texto(MARGEM, self.y + 9, trecho, 9)
+            self.y += 11
+        self.y += 4
+
+    def rodape(self, texto: str) -> None:
+        self._garantir(20)
+        self.y += 6
+        self.pdf.linha(MARGEM, self.y, LARGURA - MARGEM, self.y)
+        self.pdf.texto(MARGEM, self.y + 10, texto, 7)
+        self.y += 14
+
+## ------------------------------------------------------------------------------
+## Leitura do XML
+## ------------------------------------------------------------------------------
+def _bloco(raiz: ET.Element, nome: str) -> Optional[ET.Element]:
+    return next((el for el in raiz.iter() if nome_local(el.tag) == nome), None)
+
+def _folhas(*blocos: Optional[ET.Element]) -> dict:
+    """Primeiro texto de cada tag sem filhos dentro dos blocos, na ordem dada"""
+    campos: dict = {}
+    for bloco in blocos:
+        if bloco is None:
+            continue
+        for el in bloco.iter():
+            if len(el) == 0 and el.text and el.text.strip():
+                campos.setdefault(nome_local(el.tag), el.text.strip())
+    return campos
+
+def _documento(campos: dict) -> Optional[str]:
+    if campos.get("CNPJ"):
+        return formatar_cnpj(campos["CNPJ"])
+    cpf = campos.get("CPF")
+    if cpf and len(cpf) == 11:
+        return f"{cpf[:3]}.{cpf[3:6]}.{cpf[6:9]}-{cpf[9:]}"
+    return cpf or campos.get("NIF")
+
+def _data(texto: Optional[str], com_hora: bool = True) -> Optional[str]:
+    if not texto:
+        return None
+    try:
+        dt = datetime.fromisoformat(texto.replace("Z", "+00:00"))
+    except ValueError:
+        return texto
+    return dt.strftime("%d/%m/%Y %H:%M:%S" if com_hora else "%d/%m/%Y")
+
+def _valor(texto: Optional[str]) -> Optional[str]:
+    if not texto:
+        return None
+    try:
+        numero = float(texto)
+    except ValueError:
+        return texto
+    return "R$ " + f"{numero:,.2f}".replace(",", "_").replace(".", ",").replace("_", ".")
+
+def _endereco(campos: dict) -> Optional[str]:
+    partes = [campos.get("xLgr"), campos.get("nro"), campos.get("xCpl"), campos.get("xBairro")]
+    return ", ".join(p for p in partes if p) or None
+
+def _pessoa(campos: dict, municipio: Optional[str] = None) -> list:
+    cidade = municipio or campos.get("xMun") or campos.get("cMun")
+    if cidade and campos.get("UF"):
+        cidade = f"{cidade} - {campos['UF']}"
+    return [
+        ("CNPJ / CPF / NIF", _documento(campos)),
+        ("Inscrição Municipal", campos.get("IM")),
+        ("Telefone", campos.get("fone")),
+        ("Nome / Nome Empresarial", campos.get("xNome")),
+        ("E-mail", campos.get("email")),
+        ("Endereço", _endereco(campos)),
+        ("Município", cidade),
+        ("CEP", campos.get("CEP")),
+    ]
+
+## ------------------------------------------------------------------------------
+## Renderização
+## ------------------------------------------------------------------------------
+def renderizar_danfse(xml_bytes: bytes) -> bytes:
+    """
+    Monta um PDF equivalente ao DANFSe a partir do XML da NFS-e (ou um resumo
+    do evento, para XMLs de evento). Executável em outro processo.
+
+    Raises:
+        ValueError: XML ilegível ou sem NFS-e/evento
+    """
+    try:
+        raiz = ET.fromstring(xml_bytes)
+    except ET.ParseError as e:
+        raise ValueError(f"XML ilegível: {e}") from e
+
+    inf_nfse = _bloco(raiz, "infNFSe")
+    if inf_nfse is not None:
+        return _renderizar_nota(inf_nfse)
+    inf_evento = _bloco(raiz, "infEvento")
+    if inf_evento is None:
+        inf_evento = _bloco(raiz, "evento")
+    if inf_evento is not None:
+        return _renderizar_evento(inf_evento)
+    raise ValueError("XML sem infNFSe ou evento")
+
+def _renderizar_nota(inf: ET.Element) -> bytes:
+    dps = _bloco(inf, "infDPS")
+    nota = _folhas(*[el for el in inf if nome_local(el.tag) not in ("emit", "valores", "DPS")])
+    dados_dps = _folhas(*[el for el in dps if nome_local(el.tag) not in ("prest", "toma", "interm", "serv", "valores")]) if dps is not None else {}
+    emitente = _folhas(_bloco(inf, "emit"), _bloco(dps, "prest") if dps is not None else None)
+    servico = _folhas(_bloco(dps, "serv")) if dps is not None else {}
+    # valores da NFS-e (apuração) e da DPS (valor do serviço, tributos)
+    valores = _folhas(*[el for el in inf.iter() if nome_local(el.tag) == "valores"])
+    chave = (inf.get("Id") or "").removeprefix("NFS")
+
+    doc = DocumentoPDF()
+    corpo = _Diagramacao(doc)
+    corpo.cabecalho("DANFSe", "Documento Auxiliar da NFS-e")
+    corpo.campos([
+        ("Chave de Acesso da NFS-e", chave),
+    ], colunas=1)
+    corpo.campos([
+        ("Número da NFS-e", nota.get("nNFSe")),
+        ("Competência da NFS-e", _data(dados_dps.get("dCompet"), com_hora=False)),
+        ("Data e Hora da emissão da NFS-e", _data(nota.get("dhProc"))),
+        ("Número da DPS", dados_dps.get("nDPS")),
+        ("Série da DPS", dados_dps.get("serie")),
+        ("Data e Hora da emissão da DPS", _data(dados_dps.get("dhEmi"))),
+    ])
+
+    corpo.secao("Emitente da NFS-e")
+    corpo.campos(_pessoa(emitente, nota.get("xLocEmi")))
+
+    tomador = _bloco(dps, "toma") if dps is not None else None
+    corpo.secao("Tomador do Serviço")
+    if tomador is None:
+        corpo.paragrafo("", "TOMADOR DO SERVIÇO NÃO IDENTIFICADO NA NFS-e")
+    else:
+        corpo.campos(_pessoa(_folhas(tomador)))
+
+    intermediario = _bloco(dps, "interm") if dps is not None else None
+    if intermediario is not None:
+        corpo.secao("Intermediário do Serviço")
+        corpo.campos(_pessoa(_folhas(intermediario)))
+
+    corpo.secao("Serviço Prestado")
+    corpo.campos([
+        ("Código de Tributação Nacional", servico.get("cTribNac")),
+        ("Código de Tributação Municipal", servico.get("cTribMun")),
+        ("Local da Prestação", nota.get("xLocPrestacao") or servico.get("cLocPrestacao")),
+        ("Código NBS", servico.get("cNBS")),
+        ("Tributação Nacional", nota.get("xTribNac")),
+    ])
+    corpo.paragrafo("Descrição do Serviço", servico.get("xDescServ"))
+
+    corpo.secao("Valor Total da NFS-e")
+    corpo.campos([
+        ("Valor do Serviço", _valor(valores.get("vServ"))),
+        ("Desconto Incondicionado", _valor(valores.get("vDescIncond"))),
+        ("Desconto Condicionado", _valor(valores.get("vDescCond"))),
+        ("Base de Cálculo ISSQN", _valor(valores.get("vBC"))),
+        ("Alíquota Aplicada", f"{valores['pAliqAplic'].replace('.', ',')}%" if valores.get("pAliqAplic") else None),
+        ("ISSQN Apurado", _valor(valores.get("vISSQN"))),
+        ("Total das Retenções", _valor(valores.get("vTotalRet"))),
+        ("Valor Líquido da NFS-e", _valor(valores.get("vLiq"))),
+    ])
+
+    corpo.secao("Informações Complementares")
+    corpo.paragrafo("", servico.get("xInfComp") or dados_dps.get("xInfComp") or "-")
+    corpo.rodape(AVISO)
+    return doc.gerar()
+
+def _renderizar_evento(inf: ET.Element) -> bytes:
+    campos = _folhas(inf)
+    doc = DocumentoPDF()
+    corpo = _Diagramacao(doc)
+    corpo.cabecalho("Evento da NFS-e", campos.get("xDesc") or "Evento registrado no ADN")
+    corpo.campos([
+        ("Chave de Acesso da NFS-e", campos.get("chNFSe")),
+    ], colunas=1)
+    corpo.campos([
+        ("Data e Hora do evento", _data(campos.get("dhEvento") or campos.get("dhProc"))),
+        ("Sequência", campos.get("nSeqEvento") or campos.get("nPedRegEvento")),
+        ("Autor", _documento(campos)),
+    ])
+    corpo.paragrafo("Motivo", campos.get("xMotivo") or campos.get("cMotivo"))
+    corpo.rodape(AVISO)
+    return doc.gerar()
+
+## ------------------------------------------------------------------------------
+## Renderização em lote
+## ------------------------------------------------------------------------------
+class RenderizadorDANFSe:
+    """
+    Gera DANFSe locais. Com ``processos`` > 0 o trabalho vai para o pool de
+    processos compartilhado com a decodificação dos lotes; sem pool (ou se
+    ele cair), renderiza na própria thread.
+    """
+
+    def __init__(self, processos: int = 0):
+        self.processos = max(0, int(processos))
+
+    @classmethod
+    def do_config(cls, config) -> "RenderizadorDANFSe":
+        return cls(config.decode_processes)
+
+    def renderizar(self, xml_bytes: bytes) -> bytes:
+        if self.processos:
+            pool = None
+            try:
+                pool = obter_pool(self.processos)
+                return pool.submit(renderizar_danfse, xml_bytes).result()
+            except BrokenExecutor as e:
+                logger.warning(f"Falha no pool de processos, gerando o PDF na thread: {e}")
+                descartar_pool(pool)
+            except RuntimeError as e:
+                # Pool já encerrado por outra thread (o próximo obter_pool cria outro)
+                logger.warning(f"Pool de processos indisponível, gerando o PDF na thread: {e}")
+        return renderizar_danfse(xml_bytes)
+
+    def renderizar_lote(self, xmls: list) -> list:
+        """PDFs de ``xmls`` na mesma ordem; itens que falharem vêm como a exceção levantada"""
+        if self.processos and len(xmls) > 1:
+            pool = None
+            try:
+                pool = obter_pool(self.processos)
+                futuros = [pool.submit(renderizar_danfse, xml) for xml in xmls]
+                resultados = [futuro.exception() or futuro.result() for futuro in futuros]
+                if any(isinstance(r, BrokenExecutor) for r in resultados):
+                    raise BrokenExecutor("processo do pool encerrado")
+                return resultados
+            except BrokenExecutor as e:
+                logger.warning(f"Falha no pool de processos, gerando os PDFs na thread: {e}")
+                descartar_pool(pool)
+            except RuntimeError as e:
+                logger.warning(f"Pool de processos indisponível, gerando os PDFs na thread: {e}")
+
+        resultados = []
+        for xml in xmls:
+            try:
+                resultados.append(renderizar_danfse(xml))
+            except Exception as e:
+                resultados.append(e)
+        return resultados
@@ -0,0 +1,121 @@
+import atexit
+import base64
+import gzip
+import logging
+import threading
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor
+from typing import Optional
+
+## Módulos auxiliares
+from downloader.extrator import ExtratorNFSe
+logger = logging.getLogger(__name__)
+
+# Pool de processos compartilhado pelas empresas baixadas em paralelo
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_processos = 0
+_pool_lock = threading.Lock()
+
+def obter_pool(processos: int) -> ProcessPoolExecutor:
+    """Pool de processos compartilhado (decodificação dos lotes e DANFSe locais)"""
+    global _pool, _pool_processos
+    with _pool_lock:
+        if _pool is None or _pool_processos != processos:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool = ProcessPoolExecutor(max_workers=processos)
+            _pool_processos = processos
+            logger.info(f"Pool de processos iniciado com {processos} processos")
+        return _pool
+
+def descartar_pool(pool: Optional[ProcessPoolExecutor]) -> None:
+    """
+    Descarta ``pool`` depois de uma falha, se ele ainda for o compartilhado; o
+    próximo ``obter_pool`` cria outro. Se outra thread já o substituiu, o pool
+    novo (em uso pelas outras empresas) é preservado.
+    """
+    global _pool
+    with _pool_lock:
+        if pool is not None and _pool is pool:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+            logger.warning("Pool de processos descartado após falha")
+
+@atexit.register
+def encerrar_pool() -> None:
+    """Encerra o pool de processos (chamado também na saída do programa)"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+## ------------------------------------------------------------------------------
+## Trabalho executado em cada processo
+## ------------------------------------------------------------------------------
+def decodificar_documento(arquivo_xml: str) -> tuple:
+    """
+    base64 + gzip + extração de um item do LoteDFe.
+
+    Returns:
+        tuple: (xml_bytes, DadosNFSe, caminho rápido?, erro)
+    """
+    try:
+        xml_bytes = gzip.decompress(base64.b64decode(arquivo_xml))
+    except (ValueError, OSError, EOFError) as e:
+        return None, None, False, f"ArquivoXml inválido: {e}"
+    dados = ExtratorNFSe._extrair_rapido(xml_bytes)
+    if dados is not None:
+        return xml_bytes, dados, True, None
+    return xml_bytes, ExtratorNFSe()._extrair_completo(xml_bytes), False, None
+
+## ------------------------------------------------------------------------------
+## Etapa de decodificação dos lotes
+## ------------------------------------------------------------------------------
+class DecodificadorLotes:
+    """
+    Decodifica os documentos de uma página do LoteDFe. Com ``processos`` > 0 e
+    lotes de pelo menos ``minimo`` documentos, o trabalho vai para o pool de
+    processos, fora do GIL da thread de download e da interface; lotes
+    pequenos são decodificados na própria thread.
+    """
+
+    def __init__(self, extrator: ExtratorNFSe, processos: int = 0, minimo: int = 20):
+        self.extrator = extrator
+        self.processos = max(0, int(processos))
+        self.minimo = max(1, int(minimo))
+
+    @classmethod
+    def do_config(cls, config, extrator: ExtratorNFSe) -> "DecodificadorLotes":
+        return cls(extrator, config.decode_processes, config.decode_min_batch)
+
+    def decodificar(self, documentos: list) -> list:
+        """Retorna, na ordem de ``documentos``, tuplas (xml_bytes, DadosNFSe, erro)"""
+        arquivos = [doc["ArquivoXml"] for doc in documentos]
+
+        if self.processos and len(arquivos) >= self.minimo:
+            pool = None
+            try:
+                pool = obter_pool(self.processos)
+                lote = max(1, len(arquivos) // (self.processos * 2))
+                resultados = list(pool.map(decodificar_documento, arquivos, chunksize=lote))
+            except BrokenExecutor as e:
+                # Pool quebrado (processo encerrado, falta de memória...): segue na thread
+                logger.warning(f"Falha no pool de decodificação, decodificando na thread: {e}")
+                descartar_pool(pool)
+            except Exception as e:
+                # Falha do lote ou pool já substituído por outra thread: o pool compartilhado continua em uso
+                logger.warning(f"Falha ao decodificar o lote no pool, decodificando na thread: {e}")
+            else:
+                for _, dados, rapido, _ in resultados:
+                    if dados is not None:
+                        self.extrator.contar(rapido)
+                return [(xml_bytes, dados, erro) for xml_bytes, dados, _, erro in resultados]
+
+        return [self._decodificar_local(arquivo) for arquivo in arquivos]
+
+    def _decodificar_local(self, arquivo_xml: str) -> tuple:
+        try:
+            xml_bytes = gzip.decompress(base64.b64decode(arquivo_xml))
+        except (ValueError, OSError, EOFError) as e:
+            return None, None, f"ArquivoXml inválido: {e}"
+        return xml_bytes, self.extrator.extrair(xml_bytes), None
@@ -0,0 +1,178 @@
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+from typing import Iterable, Optional
+logger = logging.getLogger(__name__)
+
+ARQUIVO_DIARIO = "erros.jsonl"  # Em dados/{cnpj}: uma linha JSON por erro
+ARQUIVO_TEXTO = "erros.txt"     # Na pasta da empresa (vai no .zip): mesma lista em texto
+INTERVALO_GRAVACAO = 5.0        # Segundos que um erro espera no buffer antes de ir ao disco
+
+## ------------------------------------------------------------------------------
+## Diário de erros da execução
+## ------------------------------------------------------------------------------
+class DiarioErros:
+    """
+    Erros da execução (NSU, chave, tipo, competência, status HTTP, tentativa e
+    data/hora) acumulados em memória e gravados em bloco: no máximo
+    ``intervalo`` segundos depois do primeiro erro pendente, ou em ``fechar()``
+    ao final da execução. Cada gravação abre os arquivos uma única vez, em vez
+    de uma abertura por erro.
+
+    O diário estruturado fica em ``dados/{cnpj}/erros.jsonl`` e pode ser
+    consultado (``consultar``/``agrupar``); o ``erros.txt`` da pasta da empresa
+    continua sendo gerado, com uma linha legível por erro.
+    """
+
+    def __init__(self, pasta_dados: str, pasta_saida: str, intervalo: float = INTERVALO_GRAVACAO):
+        self.arquivo = os.path.join(pasta_dados, ARQUIVO_DIARIO)
+        self.arquivo_texto = os.path.join(pasta_saida, ARQUIVO_TEXTO)
+        self.intervalo = intervalo
+        self._pendentes: list = []
+        self._lock = threading.Lock()
+        self._lock_arquivo = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+        self.contagem: dict = {}  # Tipo -> erros registrados nesta execução
+
+    @classmethod
+    def do_config(cls, config) -> "DiarioErros":
+        return cls(config.data_dir, config.output_dir)
+
+    def limpar(self) -> None:
+        """Início de uma nova execução: descarta o diário e o erros.txt anteriores"""
+        with self._lock:
+            self._pendentes.clear()
+            self.contagem.clear()
+            self._cancelar_timer()
+        with self._lock_arquivo:
+            if os.path.exists(self.arquivo):
+                os.remove(self.arquivo)
+            os.makedirs(os.path.dirname(self.arquivo_texto) or ".", exist_ok=True)
+            with open(self.arquivo_texto, "w", encoding="utf-8"):
+                pass
+
+    ## ------------------------------------------------------------------------------
+    ## Registro e gravação
+    ## ------------------------------------------------------------------------------
+    def registrar(self, nsu, chave: str, tipo: str, descricao: str, competencia: Optional[str] = None,
+                  status: Optional[int] = None, tentativa: Optional[int] = None) -> dict:
+        """Acrescenta um erro ao buffer (chamado também das threads de PDF); ``competencia`` em AAAA-MM"""
+        erro = {
+            "data": datetime.now().isoformat(timespec="seconds"),
+            "nsu": nsu,
+            "chave": chave,
+            "tipo": tipo,
+            "competencia": competencia,
+            "status": status,
+            "tentativa": tentativa,
+            "erro": descricao,
+        }
+        with self._lock:
+            self._pendentes.append(erro)
+            self.contagem[tipo] = self.contagem.get(tipo, 0) + 1
+            if self._timer is None:
+                self._timer = threading.Timer(self.intervalo, self.gravar)
+                self._timer.daemon = True
+                self._timer.start()
+        return erro
+
+    def _cancelar_timer(self) -> None:
+        """Chamado com o lock"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def gravar(self) -> int:
+        """Grava os erros pendentes nos dois arquivos; retorna quantos foram gravados"""
+        with self._lock_arquivo:
+            with self._lock:
+                pendentes, self._pendentes = self._pendentes, []
+                self._cancelar_timer()
+            if not pendentes:
+                return 0
+            try:
+                os.makedirs(os.path.dirname(self.arquivo) or ".", exist_ok=True)
+                with open(self.arquivo, "a", encoding="utf-8") as f:
+                    f.writelines(json.dumps(erro, ensure_ascii=False) + "\n" for erro in pendentes)
+                with open(self.arquivo_texto, "a", encoding="utf-8") as f:
+                    f.writelines(renderizar(erro) + "\n" for erro in pendentes)
+            except OSError as e:
+                logger.error(f"Falha ao gravar o diário de erros: {e}")
+            return len(pendentes)
+
+    def fechar(self) -> None:
+        """Fim da execução: grava o que restou no buffer"""
+        self.gravar()
+        if self.contagem:
+            logger.info("Erros registrados: " + ", ".join(f"{tipo}: {n}" for tipo, n in sorted(self.contagem.items())))
+
+    ## ------------------------------------------------------------------------------
+    ## Consulta
+    ## ------------------------------------------------------------------------------
+    def ler(self) -> Iterable[dict]:
+        """Erros já gravados no diário (os do buffer entram após ``gravar``)"""
+        if not os.path.exists(self.arquivo):
+            return
+        with open(self.arquivo, "r", encoding="utf-8") as f:
+            for linha in f:
+                try:
+                    yield json.loads(linha)
+                except ValueError:
+                    continue  # Linha truncada por queda no meio da gravação
+
+    def consultar(self, tipo: Optional[str] = None, nsu_inicial: Optional[int] = None,
+                  nsu_final: Optional[int] = None, competencia: Optional[str] = None) -> list:
+        """Erros do diário filtrados por tipo, faixa de NSU e competência (AAAA-MM)"""
+        resultado = []
+        for erro in self.ler():
+            nsu = erro.get("nsu")
+            if tipo is not None and erro.get("tipo") != tipo:
+                continue
+            if competencia is not None and erro.get("competencia") != competencia:
+                continue
+            if (nsu_inicial is not None or nsu_final is not None) and not isinstance(nsu, int):
+                continue
+            if nsu_inicial is not None and nsu < nsu_inicial:
+                continue
+            if nsu_final is not None and nsu > nsu_final:
+                continue
+            resultado.append(erro)
+        return resultado
+
+    def agrupar(self, tamanho_faixa: int = 1000, erros: Optional[Iterable[dict]] = None) -> list:
+        """
+        Erros agrupados por tipo e faixa de NSU (``tamanho_faixa`` NSUs por faixa).
+
+        Returns:
+            Lista de {tipo, nsu_inicial, nsu_final, quantidade, status}, por tipo e faixa
+        """
+        grupos: dict = {}
+        for erro in (self.ler() if erros is None else erros):
+            nsu = erro.get("nsu")
+            faixa = nsu // tamanho_faixa if isinstance(nsu, int) else None
+            grupo = grupos.setdefault((erro.get("tipo") or "", faixa), {
+                "tipo": erro.get("tipo"), "nsu_inicial": None, "nsu_final": None,
+                "quantidade": 0, "status": {},
+            })
+            grupo["quantidade"] += 1
+            if faixa is not None:
+                grupo["nsu_inicial"] = nsu if grupo["nsu_inicial"] is None else min(grupo["nsu_inicial"], nsu)
+                grupo["nsu_final"] = nsu if grupo["nsu_final"] is None else max(grupo["nsu_final"], nsu)
+            if erro.get("status") is not None:
+                status = str(erro["status"])
+                grupo["status"][status] = grupo["status"].get(status, 0) + 1
+        return [grupos[chave] for chave in sorted(grupos, key=lambda c: (c[0], c[1] is None, c[1] or 0))]
+
+def renderizar(erro: dict) -> str:
+    """Linha do erros.txt, no formato de sempre"""
+    data = datetime.fromisoformat(erro["data"]).strftime("%d/%m/%Y %H:%M:%S")
+    ano, _, mes = (erro.get("competencia") or "").partition("-")
+    linha = (f"[{data}] Competência: {mes}/{ano} - NSU: {erro.get('nsu')} - Chave: {erro.get('chave')} "
+             f"- Tipo: {erro.get('tipo')} - Erro: {erro.get('erro')}")
+    if erro.get("status") is not None:
+        linha += f" - Status: {erro['status']}"
+    if erro.get("tentativa") is not None:
+        linha += f" - Tentativa: {erro['tentativa']}"
+    return linha
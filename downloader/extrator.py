@@ -0,0 +1,231 @@
+import logging
+import re
+import threading
+import xml.etree.ElementTree as ET
+from datetime import datetime
+from typing import Optional
+logger = logging.getLogger(__name__)
+
+# Campos procurados, em ordem de prioridade
+TAGS_COMPETENCIA = ("dCompet", "Competencia", "DataCompetencia")
+TAGS_EMISSAO = ("dhEmi", "dhEvento", "DataEmissao")
+TAGS_EVENTO = ("evento", "Evento", "InfEvento", "infEvento")
+TAGS_DOCUMENTO = ("CNPJ", "Cnpj", "CPF", "Cpf")
+BLOCOS = ("prest", "Prestador", "prestador", "toma", "Tomador", "tomador", "emit")
+# Eventos que anulam os valores da nota: cancelamento, cancelamento por substituição,
+# cancelamento deferido em análise fiscal e cancelamento por ofício
+EVENTOS_CANCELAMENTO = ("101101", "105102", "105104", "305101")
+
+# Caminho rápido: campos do leiaute nacional lidos direto dos bytes
+_RE_COMPET = re.compile(rb"<(?:\w+:)?dCompet>\s*(\d{4})-(\d{2})")
+_RE_EMISSAO = re.compile(rb"<(?:\w+:)?dhEmi>\s*(\d{4})-(\d{2})")
+_RE_PRESTADOR = re.compile(rb"<(?:\w+:)?prest>\s*<(?:\w+:)?(?:CNPJ|CPF)>\s*(\d+)\s*<")
+_RE_TOMADOR = re.compile(rb"<(?:\w+:)?toma>\s*<(?:\w+:)?(?:CNPJ|CPF)>\s*(\d+)\s*<")
+_RE_NUMERO = re.compile(rb"<(?:\w+:)?nNFSe>\s*(\d+)\s*<")
+_RE_VSERV = re.compile(rb"<(?:\w+:)?vServ>\s*([\d.]+)\s*<")
+_RE_VLIQ = re.compile(rb"<(?:\w+:)?vLiq>\s*([\d.]+)\s*<")
+_RE_EVENTO = re.compile(rb"<(?:\w+:)?(?:evento|Evento|InfEvento|infEvento)[\s>]")
+_RE_CODIGO_EVENTO = re.compile(r"e(\d{6})")
+
+def nome_local(tag: str) -> str:
+    """Nome da tag sem o namespace"""
+    return tag.rsplit("}", 1)[-1]
+
+def cancela_nota(codigo_evento: Optional[str]) -> bool:
+    """Se o evento anula a nota; eventos sem código identificado contam como cancelamento"""
+    return codigo_evento is None or codigo_evento in EVENTOS_CANCELAMENTO
+
+def codigo_evento(nome: str) -> Optional[str]:
+    """Código do grupo do evento (``e101101`` -> ``101101``), ou None se a tag não for um"""
+    achado = _RE_CODIGO_EVENTO.fullmatch(nome)
+    return achado.group(1) if achado else None
+
+def _grupo(padrao: re.Pattern, xml_bytes: bytes) -> Optional[str]:
+    achado = padrao.search(xml_bytes)
+    return achado.group(1).decode("ascii") if achado else None
+
+def _ano_mes_bytes(padrao: re.Pattern, xml_bytes: bytes) -> Optional[tuple[str, str]]:
+    achado = padrao.search(xml_bytes)
+    if not achado or not 1 <= int(achado.group(2)) <= 12:
+        return None
+    return achado.group(1).decode("ascii"), achado.group(2).decode("ascii")
+
+def _ano_mes(txt: Optional[str], formatos: tuple) -> Optional[tuple[str, str]]:
+    """Converte a data (ISO ou um dos ``formatos``) em (ano, mês)"""
+    if not txt:
+        return None
+    try:
+        dt = datetime.fromisoformat(txt.replace("Z", ""))
+        return str(dt.year), f"{dt.month:02d}"
+    except ValueError:
+        for fmt in formatos:
+            try:
+                dt = datetime.strptime(txt[:10], fmt)
+                return str(dt.year), f"{dt.month:02d}"
+            except ValueError:
+                continue
+    return None
+
+## ------------------------------------------------------------------------------
+## Registro com os dados usados no download
+## ------------------------------------------------------------------------------
+class DadosNFSe:
+    """Campos de um documento do ADN extraídos numa única leitura do XML"""
+
+    __slots__ = (
+        "ano_compet", "mes_compet", "ano_emissao", "mes_emissao",
+        "cnpj_prestador", "cnpj_tomador", "evento", "codigo_evento",
+        "numero", "valor_servico", "valor_liquido",
+    )
+
+    def __init__(self, ano_compet: str, mes_compet: str, ano_emissao: str, mes_emissao: str,
+                 cnpj_prestador: Optional[str] = None, cnpj_tomador: Optional[str] = None,
+                 evento: bool = False, numero: Optional[str] = None,
+                 valor_servico: Optional[str] = None, valor_liquido: Optional[str] = None,
+                 codigo_evento: Optional[str] = None):
+        self.ano_compet = ano_compet
+        self.mes_compet = mes_compet
+        self.ano_emissao = ano_emissao
+        self.mes_emissao = mes_emissao
+        self.cnpj_prestador = cnpj_prestador
+        self.cnpj_tomador = cnpj_tomador
+        self.evento = evento
+        self.codigo_evento = codigo_evento
+        self.numero = numero
+        self.valor_servico = valor_servico
+        self.valor_liquido = valor_liquido
+
+    @property
+    def cancelamento(self) -> bool:
+        """Evento que anula a nota da mesma chave (cancelamento ou substituição)"""
+        return self.evento and cancela_nota(self.codigo_evento)
+
+    def tipo(self, cnpj_empresa: str) -> str:
+        """PRESTADOS, TOMADOS ou EVENTOS em relação à empresa que está baixando"""
+        if self.cnpj_prestador:
+            return "PRESTADOS" if self.cnpj_prestador == cnpj_empresa else "TOMADOS"
+        # Sem prestador identificado (eventos ou layout desconhecido)
+        return "EVENTOS"
+
+    def __repr__(self) -> str:
+        return (f"DadosNFSe(compet={self.mes_compet}/{self.ano_compet}, "
+                f"emissao={self.mes_emissao}/{self.ano_emissao}, prestador={self.cnpj_prestador}, "
+                f"evento={self.evento})")
+
+## ------------------------------------------------------------------------------
+## Extrator
+## ------------------------------------------------------------------------------
+class ExtratorNFSe:
+    """
+    Lê o XML uma única vez e devolve um ``DadosNFSe``. Datas ausentes ou
+    ilegíveis caem no mês atual, como nas rotinas anteriores.
+
+    Documentos do leiaute nacional (dCompet, dhEmi e prest/CNPJ presentes)
+    são lidos direto dos bytes; eventos e demais leiautes passam pela
+    árvore completa. ``rapidos`` e ``completos`` contam cada caminho.
+    """
+
+    def __init__(self):
+        self.rapidos = 0
+        self.completos = 0
+        self._lock = threading.Lock()
+
+    def extrair(self, xml_bytes: bytes) -> DadosNFSe:
+        dados = self._extrair_rapido(xml_bytes)
+        self.contar(dados is not None)
+        return dados if dados is not None else self._extrair_completo(xml_bytes)
+
+    def contar(self, rapido: bool) -> None:
+        """Registra o caminho usado (também para extrações feitas em outro processo)"""
+        with self._lock:
+            if rapido:
+                self.rapidos += 1
+            else:
+                self.completos += 1
+
+    def resumo(self) -> dict:
+        """Quantos documentos saíram do caminho rápido e quantos precisaram da árvore"""
+        return {"extracao_rapida": self.rapidos, "extracao_completa": self.completos}
+
+    @staticmethod
+    def _extrair_rapido(xml_bytes: bytes) -> Optional[DadosNFSe]:
+        """Campos do leiaute nacional por expressões regulares, ou None se não decidir"""
+        if _RE_EVENTO.search(xml_bytes):
+            return None
+        competencia = _ano_mes_bytes(_RE_COMPET, xml_bytes)
+        emissao = _ano_mes_bytes(_RE_EMISSAO, xml_bytes)
+        prestador = _grupo(_RE_PRESTADOR, xml_bytes)
+        if competencia is None or emissao is None or prestador is None:
+            return None
+        return DadosNFSe(
+            *competencia,
+            *emissao,
+            cnpj_prestador=prestador,
+            cnpj_tomador=_grupo(_RE_TOMADOR, xml_bytes),
+            numero=_grupo(_RE_NUMERO, xml_bytes),
+            valor_servico=_grupo(_RE_VSERV, xml_bytes),
+            valor_liquido=_grupo(_RE_VLIQ, xml_bytes),
+        )
+
+    def _extrair_completo(self, xml_bytes: bytes) -> DadosNFSe:
+        """Leitura pela árvore do XML, para qualquer leiaute"""
+        agora = datetime.now()
+        padrao = (str(agora.year), f"{agora.month:02d}")
+
+        try:
+            root = ET.fromstring(xml_bytes)
+        except ET.ParseError as e:
+            logger.error(f"XML ilegível: {e}")
+            return DadosNFSe(*padrao, *padrao)
+
+        # Uma passada na árvore guardando a primeira ocorrência de cada campo
+        campos: dict = {}
+        blocos: dict = {}
+        evento = False
+        codigo = None
+        for el in root.iter():
+            nome = nome_local(el.tag)
+            if nome in BLOCOS:
+                blocos.setdefault(nome, el)
+            elif nome in TAGS_EVENTO:
+                evento = True
+            elif codigo is None and codigo_evento(nome):
+                codigo = codigo_evento(nome)
+            elif nome not in campos and el.text and el.text.strip():
+                campos[nome] = el.text.strip()
+
+        competencia = next(
+            (_ano_mes(campos.get(tag), ("%Y-%m-%d", "%d/%m/%Y", "%Y%m")) for tag in TAGS_COMPETENCIA if tag in campos),
+            None,
+        )
+        emissao = next(
+            (_ano_mes(campos.get(tag), ("%Y-%m-%d", "%d/%m/%Y")) for tag in TAGS_EMISSAO if tag in campos),
+            None,
+        )
+
+        prestador = (self._documento(blocos, ("prest", "Prestador", "prestador", "emit"))
+                     or next((campos[tag] for tag in ("CNPJ", "Cnpj") if tag in campos), None))
+
+        return DadosNFSe(
+            *(competencia or padrao),
+            *(emissao or padrao),
+            cnpj_prestador=prestador,
+            cnpj_tomador=self._documento(blocos, ("toma", "Tomador", "tomador")),
+            evento=evento,
+            codigo_evento=codigo,
+            numero=campos.get("nNFSe"),
+            valor_servico=campos.get("vServ"),
+            valor_liquido=campos.get("vLiq"),
+        )
+
+    @staticmethod
+    def _documento(blocos: dict, nomes: tuple) -> Optional[str]:
+        """CNPJ/CPF do primeiro bloco encontrado (prest, toma, ...)"""
+        for nome in nomes:
+            bloco = blocos.get(nome)
+            if bloco is None:
+                continue
+            for el in bloco.iter():
+                if nome_local(el.tag) in TAGS_DOCUMENTO and el.text and el.text.strip():
+                    return el.text.strip()
+        return None
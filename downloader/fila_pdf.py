@@ -0,0 +1,155 @@
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+from typing import Iterable, Optional
+logger = logging.getLogger(__name__)
+
+ARQUIVO_FILA = "pdf_pendentes.json"
+SALVAR_A_CADA = 20  # Alterações entre gravações do arquivo
+
+## ------------------------------------------------------------------------------
+## Fila persistente de PDFs pendentes
+## ------------------------------------------------------------------------------
+class FilaPDF:
+    """
+    PDFs ainda não baixados da empresa, gravados em ``dados/{cnpj}/pdf_pendentes.json``
+    com chave, destino, tentativas e último erro. Cada item entra ao ser agendado
+    e sai quando o PDF é gravado; se a execução cair ou o download falhar, o
+    item continua na fila para a próxima tentativa, sem consultar o DFe de novo.
+
+    Falhas reagendam o item com backoff exponencial e jitter (``proxima``).
+    """
+
+    def __init__(self, pasta_dados: str, backoff: float = 5.0, backoff_max: float = 300.0):
+        self.arquivo = os.path.join(pasta_dados, ARQUIVO_FILA)
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.itens: dict = {}  # (chave, destino) -> item
+        self._alteracoes = 0
+        self._lock = threading.Lock()
+        self._lock_arquivo = threading.Lock()
+        self._carregar()
+
+    @classmethod
+    def do_config(cls, config) -> "FilaPDF":
+        return cls(config.data_dir, float(config.retry_backoff) * 5, float(config.retry_backoff_max) * 10)
+
+    def _carregar(self) -> None:
+        try:
+            if os.path.exists(self.arquivo):
+                with open(self.arquivo, "r", encoding="utf-8") as f:
+                    for item in json.load(f):
+                        self.itens[(item["chave"], item["destino"])] = item
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Fila de PDFs ilegível, iniciando vazia: {e}")
+            self.itens = {}
+
+    def salvar(self) -> None:
+        """Grava a fila (arquivo temporário + os.replace); sem itens, remove o arquivo"""
+        with self._lock_arquivo:
+            with self._lock:
+                itens = [dict(item) for item in self.itens.values()]
+                self._alteracoes = 0
+            self._gravar(itens)
+
+    def _gravar(self, itens: list) -> None:
+        try:
+            if not itens:
+                if os.path.exists(self.arquivo):
+                    os.remove(self.arquivo)
+                return
+            fd, temp = tempfile.mkstemp(dir=os.path.dirname(self.arquivo), prefix=".pdf_", suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(itens, f, ensure_ascii=False, indent=1)
+            os.replace(temp, self.arquivo)
+        except OSError as e:
+            logger.warning(f"Não foi possível gravar a fila de PDFs: {e}")
+
+    def _alterado(self) -> bool:
+        """Chamado com o lock: indica se já é hora de gravar (a cada SALVAR_A_CADA alterações)"""
+        self._alteracoes += 1
+        return self._alteracoes >= SALVAR_A_CADA
+
+    ## ------------------------------------------------------------------------------
+    ## Operações
+    ## ------------------------------------------------------------------------------
+    def registrar(self, chave: str, destino: str, nsu: Optional[int] = None, copias: Iterable[str] = ()) -> None:
+        """
+        Inclui o PDF como pendente (mantém tentativas se já estava na fila).
+        ``copias`` são outros destinos do mesmo PDF, preenchidos a partir de ``destino``.
+        """
+        with self._lock:
+            item = self.itens.setdefault((chave, destino), {
+                "chave": chave, "destino": destino, "nsu": nsu,
+                "tentativas": 0, "ultimo_erro": None, "proxima": 0.0,
+            })
+            for copia in copias:
+                if copia not in item.setdefault("copias", []):
+                    item["copias"].append(copia)
+            gravar = self._alterado()
+        if gravar:
+            self.salvar()
+
+    def copias(self, chave: str, destino: str) -> list:
+        """Outros destinos do PDF pendente (vazio se não houver ou se já saiu da fila)"""
+        with self._lock:
+            return list(self.itens.get((chave, destino), {}).get("copias", []))
+
+    def concluir(self, chave: str, destino: str) -> None:
+        with self._lock:
+            gravar = self.itens.pop((chave, destino), None) is not None and self._alterado()
+        if gravar:
+            self.salvar()
+
+    def falhar(self, chave: str, destino: str, erro: str) -> int:
+        """Conta a tentativa, guarda o erro e reagenda. Retorna o total de tentativas"""
+        with self._lock:
+            item = self.itens.setdefault((chave, destino), {
+                "chave": chave, "destino": destino, "nsu": None,
+                "tentativas": 0, "ultimo_erro": None, "proxima": 0.0,
+            })
+            item["tentativas"] += 1
+            item["ultimo_erro"] = erro
+            espera = random.uniform(0, min(self.backoff_max, self.backoff * (2 ** item["tentativas"])))
+            item["proxima"] = time.time() + espera
+            tentativas = item["tentativas"]
+            gravar = self._alterado()
+        if gravar:
+            self.salvar()
+        return tentativas
+
+    def vencidos(self, limite_tentativas: int) -> list:
+        """Itens que já falharam, com nova tentativa vencida e abaixo do limite"""
+        agora = time.time()
+        with self._lock:
+            return [
+                dict(item) for item in self.itens.values()
+                if 0 < item["tentativas"] < limite_tentativas and item["proxima"] <= agora
+            ]
+
+    def aguardando(self, limite_tentativas: int) -> int:
+        """Quantos itens ainda têm nova tentativa agendada nesta execução"""
+        with self._lock:
+            return sum(1 for item in self.itens.values() if 0 < item["tentativas"] < limite_tentativas)
+
+    def liberar(self) -> list:
+        """Zera tentativas e espera de todos os itens (reprocessamento manual)"""
+        with self._lock:
+            for item in self.itens.values():
+                item["tentativas"] = 0
+                item["proxima"] = 0.0
+            return [dict(item) for item in self.itens.values()]
+
+    def limpar(self) -> None:
+        """Esvazia a fila (nova execução que recria as pastas da empresa)"""
+        with self._lock:
+            self.itens.clear()
+        self.salvar()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self.itens)
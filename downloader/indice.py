@@ -0,0 +1,328 @@
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Iterable, Optional
+
+## Módulos auxiliares
+from config.config import pasta_dados_empresa
+from downloader.extrator import DadosNFSe
+from downloader.pastas import EXTENSAO_GZIP, EXTENSAO_XML
+logger = logging.getLogger(__name__)
+
+ARQUIVO_INDICE = "documentos.db"
+LOTE_GRAVACAO = 200  # Linhas acumuladas por transação
+
+# Situação do PDF de cada documento
+PDF_PENDENTE = "pendente"
+PDF_OK = "ok"
+PDF_FALHA = "falha"
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS documentos (
+    nsu             INTEGER PRIMARY KEY,
+    chave           TEXT NOT NULL,
+    cnpj_empresa    TEXT NOT NULL,
+    tipo            TEXT NOT NULL,
+    competencia     TEXT NOT NULL,
+    emissao         TEXT NOT NULL,
+    cnpj_prestador  TEXT,
+    cnpj_tomador    TEXT,
+    evento          INTEGER NOT NULL DEFAULT 0,
+    cancelada       INTEGER NOT NULL DEFAULT 0,
+    numero          TEXT,
+    valor_servico   REAL,
+    valor_liquido   REAL,
+    arquivo         TEXT,
+    pdf             TEXT,
+    arquivo_pdf     TEXT,
+    atualizado_em   TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_documentos_chave ON documentos (chave);
+CREATE INDEX IF NOT EXISTS idx_documentos_competencia ON documentos (competencia, tipo);
+CREATE INDEX IF NOT EXISTS idx_documentos_emissao ON documentos (emissao, tipo);
+CREATE INDEX IF NOT EXISTS idx_documentos_arquivo ON documentos (arquivo);
+CREATE TABLE IF NOT EXISTS arquivos (
+    nsu             INTEGER NOT NULL,
+    arquivo         TEXT NOT NULL,
+    pdf             TEXT,
+    arquivo_pdf     TEXT,
+    atualizado_em   TEXT NOT NULL,
+    PRIMARY KEY (nsu, arquivo)
+);
+CREATE INDEX IF NOT EXISTS idx_arquivos_arquivo ON arquivos (arquivo);
+"""
+
+_INSERIR = """
+INSERT INTO documentos (
+    nsu, chave, cnpj_empresa, tipo, competencia, emissao, cnpj_prestador, cnpj_tomador,
+    evento, cancelada, numero, valor_servico, valor_liquido, arquivo, pdf, arquivo_pdf, atualizado_em
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (nsu) DO UPDATE SET
+    chave = excluded.chave, cnpj_empresa = excluded.cnpj_empresa, tipo = excluded.tipo,
+    competencia = excluded.competencia, emissao = excluded.emissao,
+    cnpj_prestador = excluded.cnpj_prestador, cnpj_tomador = excluded.cnpj_tomador,
+    evento = excluded.evento, cancelada = excluded.cancelada, numero = excluded.numero,
+    valor_servico = excluded.valor_servico, valor_liquido = excluded.valor_liquido,
+    arquivo = excluded.arquivo, pdf = excluded.pdf, arquivo_pdf = excluded.arquivo_pdf,
+    atualizado_em = excluded.atualizado_em
+"""
+
+_INSERIR_ARQUIVO = """
+INSERT INTO arquivos (nsu, arquivo, pdf, arquivo_pdf, atualizado_em) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (nsu, arquivo) DO UPDATE SET
+    pdf = excluded.pdf, arquivo_pdf = excluded.arquivo_pdf, atualizado_em = excluded.atualizado_em
+"""
+
+def _numero(valor: Optional[str]) -> Optional[float]:
+    try:
+        return float(valor) if valor else None
+    except ValueError:
+        return None
+
+## ------------------------------------------------------------------------------
+## Índice SQLite dos documentos baixados
+## ------------------------------------------------------------------------------
+class IndiceDocumentos:
+    """
+    Uma linha por documento baixado da empresa em ``dados/{cnpj}/documentos.db``
+    (chave, NSU, CNPJs, competência, emissão, tipo, valores, arquivo e situação
+    do PDF) e, na tabela ``arquivos``, uma por arquivo gravado: o documento que
+    vai para mais de um mês tem uma cópia em cada pasta, cada uma com seu PDF.
+    As linhas ficam em memória e são gravadas em lotes de ``LOTE_GRAVACAO``
+    numa única transação; ``salvar()`` grava o restante. Se a gravação falhar
+    (banco bloqueado, por exemplo), as linhas continuam em memória e vão na
+    próxima.
+
+    Eventos de cancelamento/substituição são cruzados com as notas na entrada,
+    por um conjunto das chaves canceladas: a nota fica com ``cancelada = 1``
+    chegue ela antes ou depois do evento (na linha do evento, ``cancelada``
+    indica que ele anula a nota). O resumo já sai sem os valores cancelados.
+
+    Pode ser usado pela thread de download e pelas threads de PDF ao mesmo tempo.
+    """
+
+    def __init__(self, caminho: str, cnpj_empresa: str = ""):
+        self.caminho = caminho
+        self.cnpj_empresa = cnpj_empresa
+        self._linhas: list = []
+        self._arquivos: list = []
+        self._pdfs: list = []
+        self._cancelamentos: list = []
+        self._limite = LOTE_GRAVACAO  # Linhas pendentes que disparam a próxima gravação
+        self._lock = threading.Lock()
+        self._conexao = sqlite3.connect(caminho, check_same_thread=False)
+        self._conexao.row_factory = sqlite3.Row
+        self._conexao.execute("PRAGMA journal_mode=WAL")
+        novo_arquivos = self._migrar()
+        self._conexao.executescript(_ESQUEMA)
+        if novo_arquivos:
+            with self._conexao:
+                self._conexao.execute(
+                    "INSERT OR IGNORE INTO arquivos SELECT nsu, arquivo, pdf, arquivo_pdf, atualizado_em "
+                    "FROM documentos WHERE arquivo IS NOT NULL"
+                )
+        self._canceladas = {
+            linha["chave"] for linha in
+            self._conexao.execute("SELECT DISTINCT chave FROM documentos WHERE evento = 1 AND cancelada = 1")
+        }
+
+    def _migrar(self) -> bool:
+        """
+        Inclui as colunas novas em índices criados por versões anteriores.
+        Retorna True se o índice já existia sem a tabela ``arquivos``, que é
+        então preenchida com o arquivo de cada documento.
+        """
+        colunas = {linha["name"] for linha in self._conexao.execute("PRAGMA table_info(documentos)")}
+        if colunas and "cancelada" not in colunas:
+            with self._conexao:
+                self._conexao.execute("ALTER TABLE documentos ADD COLUMN cancelada INTEGER NOT NULL DEFAULT 0")
+        tabela_arquivos = self._conexao.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'arquivos'"
+        ).fetchone()
+        return bool(colunas) and tabela_arquivos is None
+
+    @classmethod
+    def do_config(cls, config) -> "IndiceDocumentos":
+        return cls(os.path.join(config.data_dir, ARQUIVO_INDICE), config.cnpj)
+
+    @classmethod
+    def da_empresa(cls, cnpj: str) -> "IndiceDocumentos":
+        """Abre o índice de uma empresa pelo CNPJ (uso na interface e nas exportações)"""
+        return cls(str(pasta_dados_empresa(cnpj) / ARQUIVO_INDICE), cnpj)
+
+    def __enter__(self) -> "IndiceDocumentos":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.fechar()
+
+    ## ------------------------------------------------------------------------------
+    ## Gravação
+    ## ------------------------------------------------------------------------------
+    def registrar(self, nsu: int, chave: str, dados: DadosNFSe, tipo: str, arquivo: str,
+                  pdf: Optional[str] = None, copias: Iterable[tuple] = ()) -> None:
+        """
+        Inclui ou atualiza o documento e cruza com os cancelamentos; grava quando
+        o lote completa. ``copias`` são pares (arquivo, situação do PDF) dos
+        demais arquivos gravados do mesmo documento.
+        """
+        agora = datetime.now().isoformat(timespec="seconds")
+        with self._lock:
+            if dados.evento:
+                cancelada = dados.cancelamento
+                if cancelada and chave not in self._canceladas:
+                    # Notas da chave gravadas antes do evento
+                    self._canceladas.add(chave)
+                    self._cancelamentos.append((chave,))
+            else:
+                cancelada = chave in self._canceladas
+            self._linhas.append((
+                int(nsu), chave, self.cnpj_empresa, tipo,
+                f"{dados.ano_compet}-{dados.mes_compet}", f"{dados.ano_emissao}-{dados.mes_emissao}",
+                dados.cnpj_prestador, dados.cnpj_tomador, int(bool(dados.evento)), int(bool(cancelada)),
+                dados.numero, _numero(dados.valor_servico), _numero(dados.valor_liquido),
+                arquivo, pdf, None, agora,
+            ))
+            for arquivo_copia, pdf_copia in [(arquivo, pdf), *copias]:
+                self._arquivos.append((int(nsu), arquivo_copia, pdf_copia, None, agora))
+            if self._pendentes() >= self._limite:
+                self._gravar()
+
+    def marcar_pdf(self, chave: str, arquivo_pdf: str, situacao: str) -> None:
+        """Situação do PDF (pendente, ok ou falha) do documento cujo XML (ou .xml.gz) está ao lado do PDF"""
+        base = os.path.splitext(arquivo_pdf)[0]
+        with self._lock:
+            self._pdfs.append((situacao, arquivo_pdf, base + EXTENSAO_XML, base + EXTENSAO_GZIP))
+            if self._pendentes() >= self._limite:
+                self._gravar()
+
+    def concluir_pdf(self, chave: str, arquivo_pdf: str, sucesso: bool) -> None:
+        """Retorno do downloader de PDF (``NFSePDFDownloader.ao_concluir``)"""
+        self.marcar_pdf(chave, arquivo_pdf, PDF_OK if sucesso else PDF_FALHA)
+
+    def _pendentes(self) -> int:
+        return len(self._linhas) + len(self._pdfs)
+
+    def _gravar(self) -> bool:
+        """
+        Chamado com o lock: grava documentos, arquivos e situações de PDF numa
+        transação. Em caso de erro mantém tudo em memória para a próxima
+        gravação (um lote adiante, para não repetir a cada documento).
+        """
+        if not self._linhas and not self._arquivos and not self._pdfs and not self._cancelamentos:
+            return True
+        try:
+            with self._conexao:
+                self._conexao.executemany(_INSERIR, self._linhas)
+                # Arquivos de uma execução anterior do documento saem; valem os desta
+                self._conexao.executemany(
+                    "DELETE FROM arquivos WHERE nsu = ?", [(linha[0],) for linha in self._linhas]
+                )
+                self._conexao.executemany(_INSERIR_ARQUIVO, self._arquivos)
+                self._conexao.executemany(
+                    "UPDATE documentos SET cancelada = 1 WHERE chave = ? AND evento = 0",
+                    self._cancelamentos,
+                )
+                self._conexao.executemany(
+                    "UPDATE documentos SET pdf = ?, arquivo_pdf = ? WHERE arquivo IN (?, ?)",
+                    self._pdfs,
+                )
+                self._conexao.executemany(
+                    "UPDATE arquivos SET pdf = ?, arquivo_pdf = ? WHERE arquivo IN (?, ?)",
+                    self._pdfs,
+                )
+        except sqlite3.Error as e:
+            self._limite = self._pendentes() + LOTE_GRAVACAO
+            logger.warning(f"Não foi possível gravar o índice de documentos, nova tentativa no próximo lote: {e}")
+            return False
+        self._linhas.clear()
+        self._arquivos.clear()
+        self._pdfs.clear()
+        self._cancelamentos.clear()
+        self._limite = LOTE_GRAVACAO
+        return True
+
+    def salvar(self) -> None:
+        with self._lock:
+            self._gravar()
+
+    def fechar(self) -> None:
+        with self._lock:
+            if not self._gravar():
+                logger.error(f"Índice de documentos fechado com {len(self._linhas)} documento(s) sem gravar")
+            self._conexao.close()
+
+    def cancelada(self, chave: str) -> bool:
+        """Se a chave já tem evento de cancelamento ou substituição (consulta em memória)"""
+        with self._lock:
+            return chave in self._canceladas
+
+    ## ------------------------------------------------------------------------------
+    ## Consultas
+    ## ------------------------------------------------------------------------------
+    def consultar(self, competencia: Optional[str] = None, emissao: Optional[str] = None,
+                  tipo: Optional[str] = None, cnpj: Optional[str] = None,
+                  chave: Optional[str] = None, pdf: Optional[str] = None,
+                  cancelada: Optional[bool] = None) -> list:
+        """
+        Documentos que atendem a todos os filtros informados, em ordem de NSU.
+
+        Args:
+            competencia: Mês de competência no formato ``AAAA-MM``
+            emissao: Mês de emissão no formato ``AAAA-MM``
+            tipo: PRESTADOS, TOMADOS ou EVENTOS
+            cnpj: CNPJ/CPF do prestador ou do tomador
+            chave: Chave de acesso
+            pdf: Situação do PDF (pendente, ok ou falha)
+            cancelada: Apenas notas canceladas (True) ou não canceladas (False)
+
+        Returns:
+            Lista de dicionários com as colunas da tabela
+        """
+        filtros, parametros = [], []
+        for coluna, valor in (("competencia", competencia), ("emissao", emissao), ("tipo", tipo),
+                              ("chave", chave), ("pdf", pdf)):
+            if valor is not None:
+                filtros.append(f"{coluna} = ?")
+                parametros.append(valor)
+        if cancelada is not None:
+            filtros.append("cancelada = ?")
+            parametros.append(int(cancelada))
+        if cnpj is not None:
+            filtros.append("(cnpj_prestador = ? OR cnpj_tomador = ?)")
+            parametros += [cnpj, cnpj]
+
+        sql = "SELECT * FROM documentos"
+        if filtros:
+            sql += " WHERE " + " AND ".join(filtros)
+        with self._lock:
+            self._gravar()
+            return [dict(linha) for linha in self._conexao.execute(sql + " ORDER BY nsu", parametros)]
+
+    def arquivos(self, nsu: int) -> list:
+        """Arquivos gravados do documento (um por pasta de destino), com a situação do PDF de cada um"""
+        with self._lock:
+            self._gravar()
+            return [dict(linha) for linha in self._conexao.execute(
+                "SELECT * FROM arquivos WHERE nsu = ? ORDER BY arquivo", (int(nsu),)
+            )]
+
+    def chaves(self, competencia: str, cnpj: Optional[str] = None, tipo: Optional[str] = None) -> list:
+        """Chaves de acesso da competência ``AAAA-MM``, sem repetição"""
+        documentos = self.consultar(competencia=competencia, cnpj=cnpj, tipo=tipo)
+        return list(dict.fromkeys(doc["chave"] for doc in documentos))
+
+    def resumo(self, competencia: str) -> dict:
+        """Quantidade e totais por tipo na competência ``AAAA-MM``; notas canceladas não somam valores"""
+        with self._lock:
+            self._gravar()
+            linhas = self._conexao.execute(
+                "SELECT tipo, COUNT(*) AS quantidade, SUM(cancelada = 1 AND evento = 0) AS canceladas, "
+                "SUM(CASE WHEN cancelada = 1 AND evento = 0 THEN 0 ELSE valor_servico END) AS valor_servico, "
+                "SUM(CASE WHEN cancelada = 1 AND evento = 0 THEN 0 ELSE valor_liquido END) AS valor_liquido "
+                "FROM documentos WHERE competencia = ? GROUP BY tipo",
+                (competencia,),
+            ).fetchall()
+        return {linha["tipo"]: dict(linha) for linha in linhas}
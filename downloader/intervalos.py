@@ -0,0 +1,139 @@
+from bisect import bisect_left, bisect_right
+from typing import Optional
+
+## ------------------------------------------------------------------------------
+## Índice de intervalos NSU por competência (nsu_competencia.json)
+## ------------------------------------------------------------------------------
+class IndiceIntervalos:
+    """
+    Registros ``registros[ano][mes] = {nsu_inicial, nsu_final}`` carregados uma
+    vez em listas ordenadas, para consultas por busca binária (bisect) em vez
+    de percorrer os dicionários e criar um ``datetime`` por registro a cada
+    chamada.
+
+    - Ordem cronológica: competências (ano, mês) como inteiros, com o maior
+      ``nsu_final`` acumulado até cada posição (NSU inicial de um mês novo).
+    - Ordem por ``nsu_inicial``: mês que contém um NSU.
+
+    O índice é uma fotografia: depois de alterar ``registros``, crie outro.
+    As chaves devolvidas (``chave``) são as strings originais do JSON, para
+    gravar as correções no mesmo dicionário.
+    """
+
+    def __init__(self, registros: dict):
+        itens = []
+        for ano, meses in (registros or {}).items():
+            for mes, dados in meses.items():
+                try:
+                    competencia = (int(ano), int(mes))
+                except ValueError:
+                    continue
+                itens.append((competencia, (ano, mes), dados.get("nsu_inicial", 0), dados.get("nsu_final", 0)))
+        itens.sort(key=lambda item: item[0])
+
+        self.competencias = [item[0] for item in itens]
+        self.chaves = [item[1] for item in itens]
+        self.iniciais = [item[2] for item in itens]
+        self.finais = [item[3] for item in itens]
+        self._maior_final = []
+        maior = 0
+        for final in self.finais:
+            maior = max(maior, final)
+            self._maior_final.append(maior)
+
+        por_nsu = sorted(range(len(itens)), key=lambda i: (self.iniciais[i], self.competencias[i]))
+        self._ordem_nsu = por_nsu
+        self._iniciais_ordenados = [self.iniciais[i] for i in por_nsu]
+        # Maior nsu_final até cada posição da ordem por nsu_inicial (intervalos aninhados)
+        self._maior_final_nsu = []
+        maior = 0
+        for i in por_nsu:
+            maior = max(maior, self.finais[i])
+            self._maior_final_nsu.append(maior)
+
+    @classmethod
+    def do_nsu_comp(cls, nsu_comp: dict) -> "IndiceIntervalos":
+        return cls(nsu_comp.get("registros", {}))
+
+    def __len__(self) -> int:
+        return len(self.competencias)
+
+    def _posicao(self, ano, mes) -> int:
+        """Posição da competência na ordem cronológica; -1 se não registrada"""
+        competencia = (int(ano), int(mes))
+        i = bisect_left(self.competencias, competencia)
+        return i if i < len(self.competencias) and self.competencias[i] == competencia else -1
+
+    def registro(self, i: int) -> dict:
+        ano, mes = self.chaves[i]
+        return {"ano": ano, "mes": mes, "nsu_inicial": self.iniciais[i], "nsu_final": self.finais[i]}
+
+    ## ------------------------------------------------------------------------------
+    ## Consultas
+    ## ------------------------------------------------------------------------------
+    def contem(self, ano, mes) -> bool:
+        return self._posicao(ano, mes) >= 0
+
+    def nsu_inicial(self, ano, mes) -> int:
+        """
+        NSU de início da competência: o registrado, se houver; senão, o maior
+        ``nsu_final`` das competências anteriores + 1 (ou 1, sem anteriores).
+        """
+        i = self._posicao(ano, mes)
+        if i >= 0:
+            return self.iniciais[i] or 1
+        anteriores = bisect_left(self.competencias, (int(ano), int(mes)))
+        if anteriores and self._maior_final[anteriores - 1] > 0:
+            return self._maior_final[anteriores - 1] + 1
+        return 1
+
+    def competencia_do_nsu(self, nsu: int) -> Optional[tuple]:
+        """
+        Chave (ano, mês) do registro cujo intervalo contém ``nsu``; None se
+        nenhum. Em sobreposições, vale o de maior ``nsu_inicial`` entre os que
+        contêm ``nsu``; um intervalo aninhado em outro não esconde o de fora.
+        """
+        j = bisect_right(self._iniciais_ordenados, nsu) - 1
+        # Volta enquanto algum intervalo anterior ainda pode alcançar o NSU
+        while j >= 0 and self._maior_final_nsu[j] >= nsu:
+            i = self._ordem_nsu[j]
+            if nsu <= self.finais[i]:
+                return self.chaves[i]
+            j -= 1
+        return None
+
+    def anterior(self, ano, mes) -> Optional[dict]:
+        """Registro da competência imediatamente anterior a (ano, mês)"""
+        i = bisect_left(self.competencias, (int(ano), int(mes)))
+        return self.registro(i - 1) if i > 0 else None
+
+    def desvio(self, ano, mes) -> Optional[int]:
+        """
+        Diferença entre o ``nsu_inicial`` da competência e o NSU seguinte ao
+        fim da anterior: positivo é lacuna, negativo é sobreposição, 0 é
+        sequencial. None se a competência ou a anterior não existirem.
+        """
+        i = self._posicao(ano, mes)
+        if i <= 0:
+            return None
+        return self.iniciais[i] - (self.finais[i - 1] + 1)
+
+    def ultimos(self, quantidade: int = 2) -> list:
+        """Registros mais recentes, do mais novo para o mais antigo"""
+        return [self.registro(i) for i in range(len(self) - 1, max(len(self) - quantidade, 0) - 1, -1)]
+
+    def sequencia(self) -> list:
+        """Pares (anterior, atual) de competências consecutivas registradas, em ordem cronológica"""
+        return [(self.registro(i - 1), self.registro(i)) for i in range(1, len(self))]
+
+    def lacunas(self) -> list:
+        """Pares (anterior, atual) com NSUs sem competência entre eles"""
+        return [(a, b) for a, b in self.sequencia() if b["nsu_inicial"] > a["nsu_final"] + 1]
+
+    def sobreposicoes(self) -> list:
+        """Pares (anterior, atual) em que o atual começa antes do fim do anterior"""
+        return [(a, b) for a, b in self.sequencia() if b["nsu_inicial"] <= a["nsu_final"]]
+
+    def invertidos(self) -> list:
+        """Registros com ``nsu_inicial`` maior que ``nsu_final``"""
+        return [self.registro(i) for i in range(len(self)) if self.iniciais[i] > self.finais[i]]
@@ -0,0 +1,185 @@
+import base64
+import gzip
+import logging
+import os
+import shutil
+from typing import Optional
+logger = logging.getLogger(__name__)
+
+PASTAS_TIPO = ("PRESTADOS", "TOMADOS", "EVENTOS")
+EXTENSAO_XML = ".xml"
+EXTENSAO_GZIP = ".xml.gz"  # ArquivoXml do ADN gravado como veio (archive_gzip no config.json)
+
+## ------------------------------------------------------------------------------
+## Arquivos de documento (.xml ou .xml.gz)
+## ------------------------------------------------------------------------------
+def documento_para_gravar(config, item: dict, xml_bytes: bytes) -> tuple:
+    """
+    (conteúdo, extensão) do documento: com ``archive_gzip``, o ``ArquivoXml``
+    do ADN como veio (gzip, sem descompactar de novo); senão, o XML.
+    """
+    if getattr(config, "archive_gzip", False) and item.get("ArquivoXml"):
+        return base64.b64decode(item["ArquivoXml"]), EXTENSAO_GZIP
+    return xml_bytes, EXTENSAO_XML
+
+def eh_documento(caminho: str) -> bool:
+    nome = caminho.lower()
+    return nome.endswith(EXTENSAO_XML) or nome.endswith(EXTENSAO_GZIP)
+
+def base_documento(caminho: str) -> str:
+    """Caminho sem a extensão do documento (.xml ou .xml.gz); base do PDF ao lado"""
+    for extensao in (EXTENSAO_GZIP, EXTENSAO_XML):
+        if caminho.lower().endswith(extensao):
+            return caminho[:-len(extensao)]
+    return os.path.splitext(caminho)[0]
+
+def ler_documento(caminho: str) -> bytes:
+    """XML do documento, descompactado só aqui quando gravado em gzip"""
+    with open(caminho, "rb") as f:
+        conteudo = f.read()
+    return gzip.decompress(conteudo) if caminho.lower().endswith(EXTENSAO_GZIP) else conteudo
+
+def documento_do_pdf(caminho_pdf: str) -> Optional[str]:
+    """Caminho do XML gravado ao lado do PDF, em qualquer dos dois formatos; None se não houver"""
+    base = os.path.splitext(caminho_pdf)[0]
+    for extensao in (EXTENSAO_XML, EXTENSAO_GZIP):
+        if os.path.exists(base + extensao):
+            return base + extensao
+    return None
+
+def ler_documento_do_pdf(caminho_pdf: str) -> bytes:
+    """XML gravado ao lado do PDF, em qualquer dos dois formatos"""
+    caminho = documento_do_pdf(caminho_pdf)
+    if caminho is None:
+        raise FileNotFoundError(f"XML não encontrado para {caminho_pdf}")
+    return ler_documento(caminho)
+
+def _normalizar(caminho: str) -> str:
+    return os.path.normcase(os.path.abspath(caminho))
+
+## ------------------------------------------------------------------------------
+## Pastas de saída da empresa
+## ------------------------------------------------------------------------------
+class PastasEmpresa:
+    """
+    Pastas PRESTADOS, TOMADOS e EVENTOS da empresa a cada nova execução.
+
+    No modo incremental (``incremental_folders`` no config.json) nada é apagado
+    no início: os arquivos existentes são inventariados, o download mantém os
+    que já estão no lugar (``manter``) e, ao final de uma execução concluída,
+    ``remover_antigos()`` apaga só o que não pertence mais ao período. Fora
+    dele, as pastas são esvaziadas no início, como antes.
+    """
+
+    def __init__(self, pasta_saida: str, incremental: bool = True):
+        self.pasta_saida = pasta_saida
+        self.incremental = incremental
+        self.existentes: dict = {}  # caminho normalizado -> tamanho
+        self.pertencem: set = set()
+        self.mantidos = 0
+        self.novos = 0
+        self.removidos = 0
+        self._inventariado = False
+
+    @classmethod
+    def do_config(cls, config) -> "PastasEmpresa":
+        return cls(config.output_dir, bool(getattr(config, "incremental_folders", True)))
+
+    def preparar(self, retomando: bool = False) -> None:
+        """
+        Início da execução. Retomando, só garante as pastas (os arquivos já
+        baixados continuam e nada é removido ao final).
+        """
+        self.existentes.clear()
+        self.pertencem.clear()
+        self.mantidos = self.novos = self.removidos = 0
+        self._inventariado = self.incremental and not retomando
+        if not self.incremental and not retomando:
+            self.limpar()
+        self.criar()
+        if self._inventariado:
+            for caminho in self._arquivos():
+                try:
+                    self.existentes[_normalizar(caminho)] = os.path.getsize(caminho)
+                except OSError:
+                    continue
+            logger.info(f"{len(self.existentes)} arquivos já existentes nas pastas da empresa")
+
+    def _arquivos(self):
+        for pasta in PASTAS_TIPO:
+            for raiz, _, arquivos in os.walk(os.path.join(self.pasta_saida, pasta)):
+                for nome in arquivos:
+                    yield os.path.join(raiz, nome)
+
+    def criar(self) -> None:
+        for pasta in PASTAS_TIPO:
+            os.makedirs(os.path.join(self.pasta_saida, pasta), exist_ok=True)
+
+    def limpar(self) -> None:
+        """Esvazia as pastas PRESTADOS, TOMADOS e EVENTOS"""
+        for pasta in PASTAS_TIPO:
+            pasta_path = os.path.join(self.pasta_saida, pasta)
+            if not os.path.exists(pasta_path):
+                continue
+            for arquivo in os.listdir(pasta_path):
+                caminho_arquivo = os.path.join(pasta_path, arquivo)
+                try:
+                    if os.path.isdir(caminho_arquivo):
+                        shutil.rmtree(caminho_arquivo)
+                    else:
+                        os.remove(caminho_arquivo)
+                except OSError as e:
+                    logger.error(f"Erro ao deletar {caminho_arquivo}: {e}")
+
+    ## ------------------------------------------------------------------------------
+    ## Durante o download
+    ## ------------------------------------------------------------------------------
+    def manter(self, caminho: str, tamanho: Optional[int] = None) -> bool:
+        """
+        Documento do período com destino ``caminho``: retorna True se o arquivo
+        já existe (com o mesmo ``tamanho``, se informado) e pode ser mantido;
+        False se precisa ser gravado. Conta mantidos e novos.
+        """
+        if self.pertence(caminho, tamanho):
+            self.mantidos += 1
+            return True
+        self.novos += 1
+        return False
+
+    def pertence(self, caminho: str, tamanho: Optional[int] = None) -> bool:
+        """Marca o arquivo como do período (sem contar); True se já existe"""
+        chave = _normalizar(caminho)
+        self.pertencem.add(chave)
+        existente = self.existentes.get(chave)
+        return existente is not None and (tamanho is None or existente == tamanho)
+
+    def preservar(self, nsu) -> int:
+        """
+        Documento que falhou nesta execução: marca como do período os arquivos
+        já existentes do NSU (XML e PDF de uma execução anterior), para que
+        ``remover_antigos`` não apague a cópia boa. Retorna quantos marcou.
+        """
+        marcador = f"_NSU-{nsu}_"
+        preservados = [c for c in self.existentes if marcador in os.path.basename(c)]
+        self.pertencem.update(preservados)
+        return len(preservados)
+
+    def remover_antigos(self) -> int:
+        """Apaga os arquivos que não pertencem ao período e as subpastas que ficarem vazias"""
+        if not self._inventariado:
+            return 0
+        for caminho in set(self.existentes) - self.pertencem:
+            try:
+                os.remove(caminho)
+                self.removidos += 1
+            except OSError as e:
+                logger.error(f"Erro ao deletar {caminho}: {e}")
+        for pasta in PASTAS_TIPO:
+            for raiz, _, _ in os.walk(os.path.join(self.pasta_saida, pasta), topdown=False):
+                if raiz != os.path.join(self.pasta_saida, pasta) and not os.listdir(raiz):
+                    os.rmdir(raiz)
+        self._inventariado = False
+        return self.removidos
+
+    def resumo(self) -> dict:
+        return {"mantidos": self.mantidos, "novos": self.novos, "removidos": self.removidos}
@@ -1,16 +1,118 @@
 import logging
-from typing import Optional
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Optional
+import requests
+from requests.adapters import HTTPAdapter
+
+## Módulos auxiliares
+from downloader.danfse import RenderizadorDANFSe
+from downloader.fila_pdf import FilaPDF
+from downloader.pastas import documento_do_pdf, ler_documento_do_pdf
+from downloader.rate_limit import LimitadorTaxa
+from config.config import MAX_TENT_429
 logger = logging.getLogger(__name__)
 
+TAMANHO_BLOCO = 64 * 1024
+MARCA_INICIO = b"%PDF"
+MARCA_FIM = b"%%EOF"
+# Origem do PDF: ADN, gerado do XML, ou gerado com o ADN como reserva
+MODOS_PDF = ("Remoto", "Local", "Local e Remoto")
+
+class PDFInvalido(Exception):
+    """Conteúdo recebido não é um PDF completo"""
+
 class NFSePDFDownloader:
-    """Downloader para documentos PDF do portal nacional de NFS-e."""
+    """
+    Downloader para documentos PDF do portal nacional de NFS-e.
+
+    ``baixar`` faz um download imediato; ``enfileirar`` entrega o PDF a um pool
+    de ``workers`` threads, com limitador de taxa próprio (separado do
+    endpoint de DFe), para que a leitura dos XMLs siga enquanto os PDFs baixam.
+
+    Com uma ``fila`` persistente, cada PDF agendado fica registrado até ser
+    gravado; falhas são repetidas em segundo plano com backoff até
+    ``tentativas`` e depois aguardam o reprocessamento manual.
+
+    ``modo`` escolhe a origem do PDF: ``Remoto`` (DANFSe do ADN), ``Local``
+    (gerado do XML já baixado, sem requisição) ou ``Local e Remoto`` (gera
+    localmente e recorre ao ADN se a geração falhar).
+    """
 
     BASE_URL = "https://adn.nfse.gov.br/danfse"
     
-    def __init__(self, session, timeout: int = 30):
+    def __init__(self, session, timeout: int = 30, retry=None, workers: int = 1,
+                 limitador: Optional[LimitadorTaxa] = None, running: Optional[Callable[[], bool]] = None,
+                 fila: Optional[FilaPDF] = None, tentativas: int = 3, modo: str = "Remoto",
+                 renderizador: Optional[RenderizadorDANFSe] = None):
         self.session = session
-        self.timeout = timeout
-        # Remove logger duplicado - usa o do módulo
+        self.retry = retry
+        # Com política de retry usa o par (conexão, leitura) dela
+        self.timeout = retry.timeout if retry else timeout
+        self.workers = max(1, int(workers))
+        self.limitador = limitador
+        self.running = running or (lambda: True)
+        self.fila = fila
+        self.tentativas = max(1, int(tentativas))
+        self.modo = modo
+        self.renderizador = renderizador or (RenderizadorDANFSe() if modo != "Remoto" else None)
+        self.sucessos = 0
+        self.gerados = 0
+        # Avisado (chave, destino, sucesso) quando um PDF é gravado ou esgota as tentativas
+        self.ao_concluir: Optional[Callable[[str, str, bool], None]] = None
+        self.falhas = 0
+        self._executor: Optional[ThreadPoolExecutor] = None
+        # Limita os PDFs aguardando na fila: a leitura de XML espera se eles acumularem
+        self._vagas = threading.BoundedSemaphore(self.workers * 4)
+        self._lock = threading.Lock()
+        self._em_andamento: set = set()
+        self._callbacks: dict = {}
+        self._copias: dict = {}  # (chave, destino) -> outros destinos, sem fila persistente
+        self._dreno: Optional[threading.Thread] = None
+        self._parar_dreno = threading.Event()
+
+    @classmethod
+    def do_config(cls, config, session, retry=None, running: Optional[Callable[[], bool]] = None) -> "NFSePDFDownloader":
+        """
+        Cria o downloader com sessão e limitador próprios. A sessão reaproveita o
+        certificado da sessão de DFe, com um pool de conexões do tamanho do pool de threads.
+        """
+        workers = max(1, int(config.pdf_workers))
+        modo = config.pdf_mode
+        if modo not in MODOS_PDF:
+            logger.warning("pdf_mode desconhecido (%s); usando Remoto", modo)
+            modo = "Remoto"
+        sessao = requests.Session()
+        sessao.cert = session.cert
+        sessao.verify = session.verify
+        sessao.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=workers))
+        limitador = None if modo == "Local" else LimitadorTaxa(
+            float(config.pdf_rate_max),
+            taxa_min=float(config.rate_min),
+            taxa_max=float(config.pdf_rate_max),
+            latencia_alvo=float(config.latency_target),
+            capacidade=float(workers),
+            arquivo_estado=os.path.join(config.data_dir, "limitador_pdf.json"),
+        )
+        renderizador = RenderizadorDANFSe.do_config(config) if modo != "Remoto" else None
+        return cls(sessao, config.timeout, retry, workers, limitador, running,
+                   FilaPDF.do_config(config), config.pdf_retry_attempts, modo, renderizador)
+
+    def _consultar(self, url: str) -> requests.Response:
+        """Uma requisição ao DANFSe, informando o resultado ao limitador de taxa"""
+        inicio = time.monotonic()
+        try:
+            resp = self.session.get(url, timeout=self.timeout, stream=True)
+        except requests.exceptions.Timeout:
+            if self.limitador:
+                self.limitador.registrar(None, time.monotonic() - inicio)
+            raise
+        if self.limitador:
+            self.limitador.registrar(resp.status_code, time.monotonic() - inicio, resp.headers.get("Retry-After"))
+        return resp
 
     def baixar(self, chave: str, dest_path: str) -> bool:
         """
@@ -23,45 +125,329 @@ class NFSePDFDownloader:
         Returns:
             True se download bem-sucedido, False caso contrário
         """
+        return self._obter(chave, dest_path) is None
+
+    def _obter(self, chave: str, dest_path: str, xml_bytes: Optional[bytes] = None) -> Optional[str]:
+        """Gera ou baixa o PDF conforme o modo; retorna None em caso de sucesso ou a descrição do erro"""
+        if self.modo == "Remoto":
+            return self._baixar(chave, dest_path)
+        erro = self._gerar(chave, dest_path, xml_bytes)
+        if erro is None or self.modo == "Local":
+            return erro
+        logger.info("DANFSe local indisponível para %s (%s); baixando do ADN", chave, erro)
+        return self._baixar(chave, dest_path)
+
+    def _gerar(self, chave: str, dest_path: str, xml_bytes: Optional[bytes] = None) -> Optional[str]:
+        """Gera o DANFSe a partir do XML (o recebido ou o gravado ao lado do PDF)"""
+        try:
+            if xml_bytes is None:
+                xml_bytes = ler_documento_do_pdf(dest_path)
+            self._gravar_pdf(dest_path, self.renderizador.renderizar(xml_bytes))
+        except Exception as e:
+            logger.error("Erro ao gerar PDF local %s: %s", chave, str(e))
+            return f"PDF local: {e}"
+        with self._lock:
+            self.gerados += 1
+        return None
+
+    @staticmethod
+    def _gravar_pdf(dest_path: str, conteudo: bytes) -> None:
+        """Grava o PDF gerado em ``.part`` e renomeia, como nos downloads"""
+        temp_path = dest_path + ".part"
+        try:
+            with open(temp_path, "wb") as f:
+                f.write(conteudo)
+            os.replace(temp_path, dest_path)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+
+    def _baixar(self, chave: str, dest_path: str) -> Optional[str]:
+        """Baixa o PDF; retorna None em caso de sucesso ou a descrição do erro"""
         url = f"{self.BASE_URL}/{chave}"
         
         try:
-            with self.session.get(url, timeout=self.timeout) as resp:
+            for _ in range(MAX_TENT_429):
+                if self.limitador and not self.limitador.aguardar(self.running):
+                    return "Interrompido"
+                requisicao = lambda: self._consultar(url)
+                resp = self.retry.executar(requisicao, f"PDF {chave}", self.running) if self.retry else requisicao()
+                # 429: o limitador já reduziu a taxa; tenta de novo
+                if resp.status_code != 429:
+                    break
+                resp.close()
+            with resp:
                 if resp.status_code == 200:
-                    self._salvar_arquivo(dest_path, resp.content)
+                    self._salvar_arquivo(dest_path, resp)
                     logger.info("PDF baixado com sucesso: %s", chave)
-                    return True
+                    return None
                 else:
                     logger.error("Falha ao baixar PDF %s: HTTP %s", chave, resp.status_code)
-                    return False
+                    return f"HTTP {resp.status_code}"
                     
         except Exception as e:
             logger.error("Erro ao baixar PDF %s: %s", chave, str(e))
-            return False
+            return str(e) or type(e).__name__
+
+    def _salvar_arquivo(self, dest_path: str, resp: requests.Response) -> None:
+        """
+        Grava a resposta em blocos num arquivo ``.part`` e só renomeia para
+        ``dest_path`` depois de conferir tamanho e marcas de início/fim do PDF.
+        Um download interrompido nunca deixa um PDF truncado no destino.
+
+        Raises:
+            PDFInvalido: conteúdo incompleto ou que não é PDF
+        """
+        temp_path = dest_path + ".part"
+        recebidos = 0
+        inicio = b""
+        final = b""
+        try:
+            with open(temp_path, "wb") as f:
+                for bloco in resp.iter_content(chunk_size=TAMANHO_BLOCO):
+                    if not bloco:
+                        continue
+                    if len(inicio) < len(MARCA_INICIO):
+                        inicio += bloco[:len(MARCA_INICIO)]
+                    # Guarda só a cauda, para achar o %%EOF sem manter o arquivo em memória
+                    final = (final + bloco)[-1024:]
+                    recebidos += len(bloco)
+                    f.write(bloco)
+
+            # Content-Length só vale para o corpo sem compressão de transporte
+            esperado = resp.headers.get("Content-Length")
+            if esperado and resp.headers.get("Content-Encoding", "identity") == "identity" and int(esperado) != recebidos:
+                raise PDFInvalido(f"recebidos {recebidos} de {esperado} bytes")
+            if not inicio.startswith(MARCA_INICIO):
+                raise PDFInvalido("conteúdo não começa com %PDF")
+            if MARCA_FIM not in final:
+                raise PDFInvalido("marca %%EOF ausente (arquivo truncado)")
+
+            os.replace(temp_path, dest_path)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
 
-    def _salvar_arquivo(self, dest_path: str, content: bytes) -> None:
-        """Salva o conteúdo no caminho especificado."""
-        with open(dest_path, "wb") as f:
-            f.write(content)
+    ## ------------------------------------------------------------------------------
+    ## Fila de downloads concorrentes
+    ## ------------------------------------------------------------------------------
+    def enfileirar(self, chave: str, dest_path: str, ao_falhar: Optional[Callable[[], None]] = None,
+                   nsu: Optional[int] = None, xml_bytes: Optional[bytes] = None, copias: Iterable[str] = ()) -> None:
+        """
+        Agenda o download do PDF no pool e o registra na fila persistente.
+        ``ao_falhar`` é chamado (na thread do pool) quando as tentativas se
+        esgotam; downloads interrompidos por parada continuam pendentes na fila.
+        ``xml_bytes`` evita reler o XML do disco na geração local. ``copias``
+        são outros destinos do mesmo documento: o PDF é obtido uma vez e
+        replicado neles (hardlink ou cópia).
+        """
+        copias = list(copias)
+        if self.fila is not None:
+            self.fila.registrar(chave, dest_path, nsu, copias)
+        elif copias:
+            with self._lock:
+                self._copias[(chave, dest_path)] = copias
+        if ao_falhar:
+            with self._lock:
+                self._callbacks[(chave, dest_path)] = ao_falhar
+        self._submeter(chave, dest_path, xml_bytes if self.modo != "Remoto" else None)
+
+    def _submeter(self, chave: str, dest_path: str, xml_bytes: Optional[bytes] = None) -> bool:
+        """Envia ao pool, aguardando vaga; False se parado"""
+        if self._executor is None:
+            nome = threading.current_thread().name
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"{nome}-pdf")
+            if self.fila is not None:
+                self._parar_dreno.clear()
+                self._dreno = threading.Thread(target=self._drenar, name=f"{nome}-pdf-fila", daemon=True)
+                self._dreno.start()
+        with self._lock:
+            if (chave, dest_path) in self._em_andamento:
+                return True
+        while not self._vagas.acquire(timeout=0.5):
+            if not self.running():
+                return False
+        with self._lock:
+            self._em_andamento.add((chave, dest_path))
+        try:
+            self._executor.submit(self._tarefa, chave, dest_path, xml_bytes)
+        except RuntimeError:
+            with self._lock:
+                self._em_andamento.discard((chave, dest_path))
+            self._vagas.release()
+            raise
+        return True
+
+    def _tarefa(self, chave: str, dest_path: str, xml_bytes: Optional[bytes] = None) -> None:
+        item = (chave, dest_path)
+        try:
+            if not self.running():
+                return
+            if not os.path.isdir(os.path.dirname(dest_path)) or documento_do_pdf(dest_path) is None:
+                # Pendência de outra execução cujo documento saiu das pastas da empresa
+                logger.warning("Destino do PDF %s não existe mais; removido da fila", chave)
+                if self.fila is not None:
+                    self.fila.concluir(chave, dest_path)
+                return
+
+            erro = self._obter(chave, dest_path, xml_bytes)
+            if erro is None:
+                copias = self._copias_de(item)
+                for copia in copias:
+                    self._replicar(dest_path, copia)
+                with self._lock:
+                    self.sucessos += 1
+                    self._callbacks.pop(item, None)
+                    self._copias.pop(item, None)
+                if self.fila is not None:
+                    self.fila.concluir(chave, dest_path)
+                if self.ao_concluir:
+                    for destino in [dest_path] + copias:
+                        self.ao_concluir(chave, destino, True)
+                return
+
+            if not self.running():
+                return  # Interrompido: fica pendente para a próxima execução
+            tentativas = self.fila.falhar(chave, dest_path, erro) if self.fila is not None else self.tentativas
+            if tentativas < self.tentativas:
+                return  # O dreno da fila tenta de novo após o backoff
+
+            copias = self._copias_de(item)
+            with self._lock:
+                self.falhas += 1
+                ao_falhar = self._callbacks.pop(item, None)
+            if ao_falhar:
+                ao_falhar()
+            if self.ao_concluir:
+                for destino in [dest_path] + copias:
+                    self.ao_concluir(chave, destino, False)
+        except Exception:
+            logger.exception("Erro inesperado no download do PDF %s", chave)
+        finally:
+            with self._lock:
+                self._em_andamento.discard(item)
+            self._vagas.release()
+
+    def _copias_de(self, item: tuple) -> list:
+        """Outros destinos do PDF ``item`` (chave, destino)"""
+        if self.fila is not None:
+            return self.fila.copias(*item)
+        with self._lock:
+            return list(self._copias.get(item, []))
+
+    @staticmethod
+    def _replicar(origem: str, destino: str) -> None:
+        """Coloca o PDF já obtido em outro destino: hardlink no mesmo volume, senão cópia"""
+        if not os.path.isdir(os.path.dirname(destino)):
+            return
+        temp_path = destino + ".part"
+        try:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            try:
+                os.link(origem, temp_path)
+            except OSError:
+                shutil.copy2(origem, temp_path)
+            os.replace(temp_path, destino)
+        except OSError as e:
+            logger.error("Erro ao copiar o PDF para %s: %s", destino, e)
+
+    def _drenar(self) -> None:
+        """Thread de fundo: reenvia ao pool os PDFs que falharam, quando o backoff vence"""
+        while not self._parar_dreno.wait(1.0) and self.running():
+            for item in self.fila.vencidos(self.tentativas):
+                if self._parar_dreno.is_set() or not self._submeter(item["chave"], item["destino"]):
+                    return
+
+    def _ocupado(self) -> bool:
+        with self._lock:
+            if self._em_andamento:
+                return True
+        return bool(self.fila is not None and self.fila.aguardando(self.tentativas))
+
+    def encerrar(self) -> tuple[int, int]:
+        """
+        Aguarda os PDFs em andamento e as novas tentativas agendadas (ou
+        descarta os não iniciados, se parado), grava a fila e o limitador e
+        fecha a sessão própria.
+
+        Returns:
+            Tupla (sucessos, falhas)
+        """
+        if self._executor is not None:
+            while self.running() and self._ocupado():
+                time.sleep(0.5)
+            self._parar_dreno.set()
+            if self._dreno is not None:
+                self._dreno.join()
+                self._dreno = None
+            self._executor.shutdown(wait=True, cancel_futures=not self.running())
+            self._executor = None
+        if self.fila is not None:
+            self.fila.salvar()
+            if len(self.fila):
+                logger.warning("%d PDF(s) pendentes na fila para reprocessar", len(self.fila))
+        if self.limitador:
+            self.limitador.salvar()
+        self.session.close()
+        logger.info("PDFs concluídos: %d sucessos (%d gerados localmente), %d falhas",
+                    self.sucessos, self.gerados, self.falhas)
+        return self.sucessos, self.falhas
 
     def baixar_lote(self, chaves_destinos: list[tuple[str, str]]) -> tuple[int, int]:
         """
-        Baixa múltiplos PDFs em lote.
+        Baixa múltiplos PDFs em lote, em paralelo. Nos modos locais o lote é
+        gerado de uma vez no pool de processos; o que falhar segue pela fila.
         
         Args:
             chaves_destinos: Lista de tuplas (chave, caminho_destino)
             
         Returns:
-            Tupla (sucessos, falhas)
+            Tupla (sucessos, falhas) deste lote
         """
-        sucessos = 0
-        falhas = 0
+        sucessos_antes, falhas_antes = self.sucessos, self.falhas
         
-        for chave, destino in chaves_destinos:
-            if self.baixar(chave, destino):
-                sucessos += 1
-            else:
-                falhas += 1
+        pendentes = chaves_destinos
+        if self.modo != "Remoto":
+            pendentes = self._gerar_lote(chaves_destinos)
+        for chave, destino in pendentes:
+            self.enfileirar(chave, destino)
+        while self.running() and self._ocupado():
+            time.sleep(0.5)
                 
+        sucessos = self.sucessos - sucessos_antes
+        falhas = self.falhas - falhas_antes
         logger.info("Lote concluído: %d sucessos, %d falhas", sucessos, falhas)
-        return sucessos, falhas
\ No newline at end of file
+        return sucessos, falhas
+
+    def _gerar_lote(self, chaves_destinos: list[tuple[str, str]]) -> list[tuple[str, str]]:
+        """Gera os DANFSe do lote a partir dos XMLs gravados; retorna os que não foram gerados"""
+        pendentes, lote, xmls = [], [], []
+        for chave, destino in chaves_destinos:
+            try:
+                xmls.append(ler_documento_do_pdf(destino))
+                lote.append((chave, destino))
+            except (OSError, EOFError):
+                pendentes.append((chave, destino))
+
+        for (chave, destino), conteudo in zip(lote, self.renderizador.renderizar_lote(xmls)):
+            try:
+                if isinstance(conteudo, Exception):
+                    raise conteudo
+                self._gravar_pdf(destino, conteudo)
+            except Exception as e:
+                logger.error("Erro ao gerar PDF local %s: %s", chave, str(e))
+                pendentes.append((chave, destino))
+                continue
+            with self._lock:
+                self.sucessos += 1
+                self.gerados += 1
+            if self.ao_concluir:
+                self.ao_concluir(chave, destino, True)
+        return pendentes
\ No newline at end of file
@@ -0,0 +1,188 @@
+import logging
+import queue
+import threading
+from dataclasses import dataclass, field
+from typing import Callable, Iterator, Optional
+import requests
+
+## Módulos auxiliares
+from config.config import STATUS_STOP, MAX_TENT, MAX_TENT_429
+logger = logging.getLogger(__name__)
+
+## ------------------------------------------------------------------------------
+## Página de lote entregue ao consumidor
+## ------------------------------------------------------------------------------
+@dataclass
+class PaginaLote:
+    """Resultado de uma consulta ao ADN a partir de ``nsu``"""
+    nsu: int
+    documentos: list = field(default_factory=list)
+    proximo: Optional[int] = None      # Cursor da próxima consulta
+    status_code: Optional[int] = None
+    tipo_erro: Optional[str] = None    # CONEXÃO, HTTP ou MT.REQ
+    erro: Optional[str] = None
+    fim: bool = False                  # Produtor encerrou após esta página
+
+## ------------------------------------------------------------------------------
+## Produtor: busca os lotes à frente do processamento
+## ------------------------------------------------------------------------------
+class BuscadorLotes:
+    """
+    Consulta os lotes do ADN em uma thread própria e os entrega por uma fila
+    limitada, de modo que a próxima página já esteja em trânsito enquanto a
+    atual é decodificada e gravada.
+
+    O cursor da próxima consulta é o maior NSU do lote recebido. As condições
+    de parada HTTP (STATUS_STOP, 429 persistente, erros consecutivos e falha de
+    conexão) ficam aqui; as de negócio (tent_post) ficam no consumidor, que
+    chama ``parar()`` ao decidir encerrar.
+
+    Com um ``armazem``, as faixas de NSU já consultadas são servidas do disco
+    e só as demais vão ao ADN; cada lote recebido é guardado no armazém.
+    """
+
+    def __init__(
+        self,
+        requisitar: Callable[[int, Callable[[], bool]], Optional[requests.Response]],
+        nsu_inicial: int,
+        running: Callable[[], bool],
+        write: Optional[Callable] = None,
+        tamanho_fila: int = 2,
+        armazem=None,
+    ):
+        self.requisitar = requisitar
+        self.armazem = armazem
+        self.nsu_inicial = nsu_inicial
+        self.running = running
+        self.write = write or (lambda msg, log=True: None)
+        self._fila: queue.Queue = queue.Queue(maxsize=max(1, int(tamanho_fila)))
+        self._parar = threading.Event()
+        self._thread = threading.Thread(
+            target=self._produzir,
+            name=f"{threading.current_thread().name}-busca",
+            daemon=True,
+        )
+
+    def iniciar(self) -> "BuscadorLotes":
+        self._thread.start()
+        return self
+
+    def parar(self) -> None:
+        """Interrompe o produtor e aguarda a requisição em andamento"""
+        self._parar.set()
+        self._thread.join()
+
+    def _ativo(self) -> bool:
+        return self.running() and not self._parar.is_set()
+
+    def _enfileirar(self, pagina: Optional[PaginaLote]) -> bool:
+        """Enfileira respeitando a capacidade; desiste se o consumidor parou"""
+        while True:
+            try:
+                self._fila.put(pagina, timeout=0.5)
+                return True
+            except queue.Full:
+                if not self._ativo():
+                    return False
+
+    def _produzir(self) -> None:
+        nsu = self.nsu_inicial
+        tent_erro = 0
+        tent_429 = 0
+
+        try:
+            while self._ativo():
+                self.write(f"Consultando NSU: {nsu}", log=False)
+                
+                # Faixa já consultada antes: serve do armazém local
+                local = self.armazem.pagina(nsu) if self.armazem else None
+                if local:
+                    documentos, proximo = local
+                    logger.info(f"NSU {nsu} a {proximo} servidos do armazém local ({len(documentos)} documentos)")
+                    if not self._enfileirar(PaginaLote(nsu, documentos, proximo, 200)):
+                        return
+                    nsu = proximo
+                    continue
+                
+                logger.info(f"Consultando a partir do NSU {nsu}...")
+
+                try:
+                    resp = self.requisitar(nsu, self._ativo)
+                except requests.exceptions.RequestException as e:
+                    status_code = getattr(e.response, 'status_code', 'N/A') if hasattr(e, 'response') else 'N/A'
+                    self._enfileirar(PaginaLote(
+                        nsu, tipo_erro="CONEXÃO", fim=True,
+                        erro=f"Erro de conexão no NSU {nsu}: {e} (Status: {status_code})",
+                    ))
+                    return
+
+                if resp is None:  # Interrompido aguardando o limitador
+                    return
+
+                if resp.status_code == 200:
+                    tent_erro = 0
+                    tent_429 = 0
+                    resposta = resp.json()
+                    documentos = []
+                    proximo = nsu
+                    if resposta.get("StatusProcessamento") == "DOCUMENTOS_LOCALIZADOS":
+                        documentos = sorted(resposta.get("LoteDFe", []), key=lambda d: int(d.get("NSU", 0)))
+                        proximo = max(int(d["NSU"]) for d in documentos) if documentos else nsu + 1
+                        if self.armazem:
+                            self.armazem.guardar(nsu, documentos)
+
+                    if not self._enfileirar(PaginaLote(nsu, documentos, proximo, resp.status_code)):
+                        return
+                    nsu = proximo
+
+                elif resp.status_code in STATUS_STOP:
+                    self._enfileirar(PaginaLote(
+                        nsu, status_code=resp.status_code, tipo_erro="HTTP", fim=True,
+                        erro=f"Status de parada {resp.status_code} no NSU {nsu}",
+                    ))
+                    return
+
+                elif resp.status_code == 429:
+                    # Limitador já reduziu a taxa; repete o mesmo NSU
+                    tent_429 += 1
+                    logger.warning(f"Rate limit (429) no NSU {nsu}. Tentativa {tent_429}/{MAX_TENT_429}")
+                    if tent_429 >= MAX_TENT_429:
+                        self._enfileirar(PaginaLote(
+                            nsu, status_code=429, tipo_erro="MT.REQ", fim=True,
+                            erro=f"Rate limit (429) persistente no NSU {nsu}",
+                        ))
+                        return
+
+                else:
+                    # Avança o NSU mesmo com erro, até o máximo de erros consecutivos
+                    tent_erro += 1
+                    logger.info(f"Erro HTTP. Tentativas consecutivas: {tent_erro}/{MAX_TENT}")
+                    fim = tent_erro >= MAX_TENT
+                    if not self._enfileirar(PaginaLote(
+                        nsu, proximo=nsu + 1, status_code=resp.status_code, tipo_erro="HTTP", fim=fim,
+                        erro=f"Erro HTTP {resp.status_code} no NSU {nsu}: {resp.text}",
+                    )) or fim:
+                        return
+                    nsu += 1
+
+        except Exception as e:
+            logger.exception("Erro inesperado na busca de lotes")
+            self._enfileirar(PaginaLote(nsu, tipo_erro="CONEXÃO", erro=f"Erro na busca do NSU {nsu}: {e}", fim=True))
+        finally:
+            # Sentinela de término para o consumidor
+            self._enfileirar(None)
+
+    def __iter__(self) -> Iterator[PaginaLote]:
+        """Entrega as páginas na ordem em que foram buscadas"""
+        while True:
+            try:
+                pagina = self._fila.get(timeout=0.5)
+            except queue.Empty:
+                if not self._thread.is_alive() and self._fila.empty():
+                    return
+                continue
+            if pagina is None:
+                return
+            yield pagina
+            if pagina.fim:
+                return
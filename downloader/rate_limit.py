@@ -0,0 +1,167 @@
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Callable, Optional
+logger = logging.getLogger(__name__)
+
+## ------------------------------------------------------------------------------
+## Auxiliares
+## ------------------------------------------------------------------------------
+def interpretar_retry_after(valor: Optional[str]) -> Optional[float]:
+    """Converte o cabeçalho Retry-After (segundos ou data HTTP) em segundos de espera"""
+    if not valor:
+        return None
+    valor = valor.strip()
+    try:
+        return max(float(valor), 0.0)
+    except ValueError:
+        pass
+    try:
+        data = parsedate_to_datetime(valor)
+        if data.tzinfo is None:
+            data = data.replace(tzinfo=timezone.utc)
+        return max((data - datetime.now(timezone.utc)).total_seconds(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+## ------------------------------------------------------------------------------
+## Limitador de taxa adaptativo (token bucket + AIMD)
+## ------------------------------------------------------------------------------
+class LimitadorTaxa:
+    """
+    Token bucket com ajuste AIMD da taxa de requisições por segundo.
+
+    A taxa sobe em passos aditivos enquanto as respostas chegam rápidas e sem
+    erro, e cai multiplicativamente ao receber 429/503 ou latência acima do alvo.
+    O Retry-After do servidor bloqueia novas requisições até o prazo indicado.
+    """
+
+    STATUS_REDUCAO = (429, 503)
+
+    def __init__(
+        self,
+        taxa_inicial: float,
+        taxa_min: float = 0.1,
+        taxa_max: float = 2.0,
+        latencia_alvo: float = 5.0,
+        incremento: float = 0.05,
+        fator_reducao: float = 0.5,
+        capacidade: float = 1.0,
+        arquivo_estado: Optional[str] = None,
+    ):
+        self.taxa_min = taxa_min
+        self.taxa_max = max(taxa_max, taxa_min)
+        self.latencia_alvo = latencia_alvo
+        self.incremento = incremento
+        self.fator_reducao = fator_reducao
+        self.capacidade = capacidade
+        self.arquivo_estado = arquivo_estado
+        self.taxa = self._limitar(taxa_inicial)
+        self.taxa_boa = self.taxa  # Última taxa segura, salva para a próxima execução
+        self.reducoes = 0
+        self._tokens = capacidade
+        self._ultimo = time.monotonic()
+        self._bloqueado_ate = 0.0
+        self._lock = threading.Lock()
+
+        if arquivo_estado:
+            self._carregar()
+
+    @classmethod
+    def do_config(cls, config, arquivo_estado: Optional[str] = None) -> "LimitadorTaxa":
+        """Cria o limitador a partir do Config, usando delay_seconds como intervalo inicial"""
+        delay = float(config.delay_seconds)
+        taxa_inicial = 1.0 / delay if delay > 0 else float(config.rate_max)
+        return cls(
+            taxa_inicial,
+            taxa_min=float(config.rate_min),
+            taxa_max=float(config.rate_max),
+            latencia_alvo=float(config.latency_target),
+            arquivo_estado=arquivo_estado,
+        )
+
+    def _limitar(self, taxa: float) -> float:
+        return min(max(taxa, self.taxa_min), self.taxa_max)
+
+    def _repor(self, agora: float) -> None:
+        """Repõe os tokens proporcionalmente ao tempo decorrido"""
+        self._tokens = min(self.capacidade, self._tokens + (agora - self._ultimo) * self.taxa)
+        self._ultimo = agora
+
+    def aguardar(self, running: Optional[Callable[[], bool]] = None) -> bool:
+        """
+        Bloqueia até haver um token disponível.
+
+        Returns:
+            False se ``running`` indicar parada durante a espera, True caso contrário
+        """
+        while True:
+            with self._lock:
+                agora = time.monotonic()
+                self._repor(agora)
+                espera = self._bloqueado_ate - agora
+                if espera <= 0:
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return True
+                    espera = (1 - self._tokens) / self.taxa
+
+            if running is not None and not running():
+                return False
+            # Espera em fatias curtas para responder rápido a stop()
+            time.sleep(min(espera, 0.5))
+
+    def registrar(self, status_code: Optional[int], latencia: float, retry_after: Optional[str] = None) -> None:
+        """Ajusta a taxa conforme o resultado da última requisição"""
+        with self._lock:
+            espera = interpretar_retry_after(retry_after)
+            if espera:
+                self._bloqueado_ate = max(self._bloqueado_ate, time.monotonic() + espera)
+
+            if status_code in self.STATUS_REDUCAO or latencia > self.latencia_alvo:
+                anterior = self.taxa
+                self.taxa = self._limitar(self.taxa * self.fator_reducao)
+                self.taxa_boa = min(self.taxa_boa, self.taxa)
+                self._tokens = min(self._tokens, 0.0)
+                self.reducoes += 1
+                logger.info(
+                    f"Limitador: reduzindo taxa {anterior:.2f} -> {self.taxa:.2f} req/s "
+                    f"(status {status_code}, latência {latencia:.1f}s, Retry-After {espera or 0:.0f}s)"
+                )
+            elif status_code is not None and status_code < 400:
+                self.taxa_boa = self.taxa
+                self.taxa = self._limitar(self.taxa + self.incremento)
+
+    ## ------------------------------------------------------------------------------
+    ## Persistência do estado por certificado
+    ## ------------------------------------------------------------------------------
+    def _carregar(self) -> None:
+        """Carrega a última taxa boa conhecida, se houver"""
+        try:
+            if os.path.exists(self.arquivo_estado):
+                with open(self.arquivo_estado, "r", encoding="utf-8") as f:
+                    dados = json.load(f)
+                self.taxa = self._limitar(float(dados.get("taxa", self.taxa)))
+                self.taxa_boa = self.taxa
+                logger.info(f"Limitador: retomando taxa de {self.taxa:.2f} req/s")
+        except Exception as e:
+            logger.warning(f"Não foi possível carregar estado do limitador: {e}")
+
+    def salvar(self) -> None:
+        """Salva a última taxa boa conhecida para a próxima execução"""
+        if not self.arquivo_estado:
+            return
+        try:
+            with self._lock:
+                dados = {
+                    "taxa": round(self.taxa_boa, 4),
+                    "atualizado_em": datetime.now().isoformat(timespec="seconds"),
+                }
+            with open(self.arquivo_estado, "w", encoding="utf-8") as f:
+                json.dump(dados, f, indent=2, ensure_ascii=False)
+        except Exception as e:
+            logger.warning(f"Não foi possível salvar estado do limitador: {e}")
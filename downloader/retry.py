@@ -0,0 +1,140 @@
+import logging
+import random
+import threading
+import time
+from typing import Callable, Iterable, Optional
+import requests
+logger = logging.getLogger(__name__)
+
+# Status HTTP considerados transitórios (o 429 é tratado pelo limitador de taxa)
+STATUS_RETENTAVEIS = frozenset({408, 500, 502, 503, 504})
+
+# Falhas de rede que valem nova tentativa
+EXCECOES_RETENTAVEIS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+)
+
+## ------------------------------------------------------------------------------
+## Política de retentativas com backoff exponencial e jitter
+## ------------------------------------------------------------------------------
+class PoliticaRetry:
+    """
+    Repete requisições que falham por motivos transitórios.
+
+    Cada tentativa extra espera um tempo sorteado entre 0 e
+    ``min(backoff_max, backoff * 2^tentativa)`` (full jitter), evitando que
+    várias empresas repitam ao mesmo tempo. As estatísticas são compartilhadas
+    entre as consultas de NSU e os PDFs da mesma empresa.
+    """
+
+    def __init__(
+        self,
+        tentativas: int = 4,
+        backoff: float = 1.0,
+        backoff_max: float = 30.0,
+        connect_timeout: float = 10.0,
+        read_timeout: float = 60.0,
+        status_retentaveis: Iterable[int] = STATUS_RETENTAVEIS,
+        running: Optional[Callable[[], bool]] = None,
+    ):
+        self.tentativas = max(1, int(tentativas))
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.status_retentaveis = frozenset(status_retentaveis)
+        self.running = running or (lambda: True)
+        self.retentativas = 0
+        self.tempo_perdido = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def do_config(cls, config, running: Optional[Callable[[], bool]] = None) -> "PoliticaRetry":
+        """Cria a política a partir do Config (timeout é o tempo de leitura)"""
+        return cls(
+            tentativas=config.retry_attempts,
+            backoff=float(config.retry_backoff),
+            backoff_max=float(config.retry_backoff_max),
+            connect_timeout=float(config.connect_timeout),
+            read_timeout=float(config.timeout),
+            running=running,
+        )
+
+    @property
+    def timeout(self) -> tuple[float, float]:
+        """Tupla (conexão, leitura) no formato aceito pelo requests"""
+        return (self.connect_timeout, self.read_timeout)
+
+    def retentavel(self, status_code: int) -> bool:
+        return status_code in self.status_retentaveis
+
+    def espera(self, tentativa: int) -> float:
+        """Tempo de espera antes da próxima tentativa (full jitter)"""
+        return random.uniform(0, min(self.backoff_max, self.backoff * (2 ** tentativa)))
+
+    def executar(
+        self,
+        requisicao: Callable[[], requests.Response],
+        descricao: str = "",
+        running: Optional[Callable[[], bool]] = None,
+    ) -> requests.Response:
+        """
+        Executa ``requisicao`` repetindo falhas transitórias.
+
+        ``running`` substitui o controle de parada da política nesta chamada.
+
+        Returns:
+            A primeira resposta não retentável, ou a última resposta obtida
+            quando as tentativas se esgotam
+
+        Raises:
+            requests.exceptions.RequestException: se a última tentativa falhar na rede
+        """
+        running = running or self.running
+        for tentativa in range(self.tentativas):
+            inicio = time.monotonic()
+            try:
+                resp = requisicao()
+                motivo = f"HTTP {resp.status_code}"
+                if not self.retentavel(resp.status_code):
+                    return resp
+            except EXCECOES_RETENTAVEIS as e:
+                if tentativa + 1 >= self.tentativas or not running():
+                    raise
+                erro = e
+                resp = None
+                motivo = type(e).__name__
+
+            if tentativa + 1 >= self.tentativas or not running():
+                return resp
+
+            espera = self.espera(tentativa)
+            logger.warning(
+                f"{descricao}: {motivo}. Tentativa {tentativa + 2}/{self.tentativas} em {espera:.1f}s"
+            )
+            if resp is not None:
+                resp.close()
+
+            # Espera em fatias curtas para responder rápido a stop()
+            limite = time.monotonic() + espera
+            while running() and time.monotonic() < limite:
+                time.sleep(max(0.0, min(0.5, limite - time.monotonic())))
+
+            with self._lock:
+                self.retentativas += 1
+                self.tempo_perdido += time.monotonic() - inicio
+
+            # Interrompido durante a espera: devolve o último resultado
+            if not running():
+                if resp is None:
+                    raise erro
+                return resp
+
+        return resp
+
+    def resumo(self) -> dict:
+        """Estatísticas para o resumo da execução"""
+        with self._lock:
+            return {"retentativas": self.retentativas, "tempo_perdido": round(self.tempo_perdido, 1)}
@@ -0,0 +1,356 @@
+import os
+import json
+import shutil
+import tempfile
+import logging
+from datetime import datetime
+from functools import partial
+from typing import Optional
+import requests
+
+## Módulos auxiliares
+from downloader.armazem import ArmazemDFe
+from downloader.emissao import NFSeDownloaderEmissao
+from downloader.indice import IndiceDocumentos, PDF_PENDENTE
+from downloader.pastas import PASTAS_TIPO, base_documento, documento_para_gravar, eh_documento
+from downloader.pdf import NFSePDFDownloader
+from downloader.pipeline import BuscadorLotes
+from downloader.rate_limit import LimitadorTaxa
+from config.config import STATUS_STOP
+logger = logging.getLogger(__name__)
+
+ARQUIVO_MARCA = "sincronizacao.json"
+ARQUIVO_COMPETENCIAS = "competencias.json"  # Em acervo/: documentos de competência diferente do mês de emissão
+
+class SincronizacaoIncompleta(Exception):
+    """Sincronização encerrada por erro antes do fim do fluxo de NSU, ou com documentos que falharam"""
+
+    def __init__(self, mensagem: str, documentos: int = 0, erros: int = 1):
+        super().__init__(mensagem)
+        self.documentos = documentos
+        self.erros = erros
+
+## ------------------------------------------------------------------------------
+## Sincronização incremental por marca de NSU (high-water mark)
+## ------------------------------------------------------------------------------
+class NFSeDownloaderSincronizar(NFSeDownloaderEmissao):
+    """
+    Mantém um acervo local por CNPJ em ``dados/{cnpj}/acervo/{AAAA-MM}/{TIPO}``
+    e consulta o ADN somente acima do maior NSU já sincronizado. Cada documento
+    novo vai para a pasta do mês de emissão; se a competência for de outro mês,
+    ele também é anotado em ``acervo/competencias.json`` sob a competência. Ao
+    final, o mês escolhido é copiado do acervo para as pastas da empresa pelos
+    mesmos critérios de ``deve_baixar_documento`` (competência ou emissão).
+
+    Só é copiado (e só há remoção nas pastas) quando a sincronização chega ao
+    fim do fluxo de NSU e o mês está coberto pelo acervo, isto é, não é
+    anterior ao mês da primeira sincronização.
+    """
+
+    ## ------------------------------------------------------------------------------
+    ## Marca de sincronização
+    ## ------------------------------------------------------------------------------
+    def _arquivo_marca(self) -> str:
+        return os.path.join(self.config.data_dir, ARQUIVO_MARCA)
+
+    def pasta_acervo(self, ano: str, mes: str, tipo: Optional[str] = None) -> str:
+        pasta = os.path.join(self.config.data_dir, "acervo", f"{ano}-{mes}")
+        return os.path.join(pasta, tipo) if tipo else pasta
+
+    def _ler_marca(self) -> dict:
+        try:
+            if os.path.exists(self._arquivo_marca()):
+                with open(self._arquivo_marca(), "r", encoding="utf-8") as f:
+                    return json.load(f)
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"Marca de sincronização ilegível: {e}")
+        return {}
+
+    def carregar_marca(self) -> Optional[int]:
+        """Maior NSU já sincronizado para o CNPJ, ou None na primeira execução"""
+        try:
+            return int(self._ler_marca()["nsu_maximo"])
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def inicio_acervo(self) -> Optional[str]:
+        """Mês (AAAA-MM) da primeira sincronização; None em marcas gravadas antes deste campo"""
+        return self._ler_marca().get("inicio")
+
+    def mes_coberto(self, ano: str, mes: str) -> bool:
+        """O acervo tem o mês completo: não é anterior ao início da sincronização"""
+        inicio = self.inicio_acervo()
+        if inicio is None:
+            return os.path.isdir(self.pasta_acervo(ano, mes))
+        return f"{ano}-{mes}" >= inicio
+
+    def salvar_marca(self, nsu: int, inicio: Optional[str] = None) -> None:
+        """Grava a marca de forma atômica, mantendo o mês de início já gravado"""
+        dados = {
+            "nsu_maximo": nsu,
+            "inicio": inicio or self.inicio_acervo(),
+            "atualizado_em": datetime.now().isoformat(timespec="seconds"),
+        }
+        fd, temp = tempfile.mkstemp(dir=self.config.data_dir, prefix=".sinc_", suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(dados, f, indent=2, ensure_ascii=False)
+        os.replace(temp, self._arquivo_marca())
+
+    def _arquivo_competencias(self) -> str:
+        return os.path.join(self.config.data_dir, "acervo", ARQUIVO_COMPETENCIAS)
+
+    def carregar_competencias(self) -> dict:
+        """Competência (AAAA-MM) -> documentos do acervo (relativos a acervo/) emitidos em outro mês"""
+        try:
+            if os.path.exists(self._arquivo_competencias()):
+                with open(self._arquivo_competencias(), "r", encoding="utf-8") as f:
+                    return {mes: set(arquivos) for mes, arquivos in json.load(f).items()}
+        except (OSError, ValueError, AttributeError) as e:
+            self.logger.warning(f"Índice de competências do acervo ilegível: {e}")
+        return {}
+
+    def salvar_competencias(self, competencias: dict) -> None:
+        pasta = os.path.dirname(self._arquivo_competencias())
+        os.makedirs(pasta, exist_ok=True)
+        fd, temp = tempfile.mkstemp(dir=pasta, prefix=".comp_", suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({mes: sorted(arquivos) for mes, arquivos in sorted(competencias.items())},
+                      f, indent=1, ensure_ascii=False)
+        os.replace(temp, self._arquivo_competencias())
+
+    ## ------------------------------------------------------------------------------
+    ## Execução
+    ## ------------------------------------------------------------------------------
+    def run_sincronizar(self, ano, mes, nsu_competencia_file, write=None, meses=None):
+        """
+        Busca apenas os NSUs acima da marca, arquiva cada documento no mês de
+        emissão (e na competência, se for outra) e disponibiliza o(s) mês(es)
+        escolhido(s) nas pastas da empresa.
+
+        Returns:
+            int: Número de documentos dos meses escolhidos disponíveis após a sincronização
+
+        Raises:
+            SincronizacaoIncompleta: a busca parou por erro antes do fim do fluxo
+                de NSU ou algum documento falhou (com a contagem de erros)
+        """
+        if write is None:
+            write = lambda msg, log=True: self.logger.info(msg) if log else None
+
+        alvos = sorted(set(meses or [(ano, mes)]))
+        ano, mes = alvos[0]
+
+        self.limpar_arquivo_erros()
+
+        marca = self.carregar_marca()
+        inicio = None
+        if marca is None:
+            # Primeira sincronização começa pelo mês escolhido, não pelo início do CNPJ
+            nsu_comp = self.carregar_nsu_competencia(nsu_competencia_file)
+            marca = min(self.obter_nsu_inicial_competencia(nsu_comp, a, m) for a, m in alvos) - 1
+            inicio = "-".join(alvos[0])
+            self.logger.info(f"Sem marca de sincronização. Iniciando no NSU {marca}")
+        else:
+            self.logger.info(f"Sincronizando NSUs acima de {marca}")
+
+        intervalos_por_mes = {}
+        competencias = self.carregar_competencias()
+        novos = 0
+        erros = 0          # Erros de página e de documento (PDFs ficam na fila de pendentes)
+        concluido = False  # Chegou ao fim do fluxo de NSU (status de parada)
+        nsu_falha = None   # Primeiro documento com erro: a marca não passa dele
+
+        with self.pfx_to_pem() as pem_cert:
+            self.session = requests.Session()
+            self.session.cert = pem_cert
+            self.session.verify = True
+
+            if self.config.download_pdf:
+                pdf_dl = NFSePDFDownloader.do_config(self.config, self.session, self.retry, self.running)
+
+            self.limitador = LimitadorTaxa.do_config(
+                self.config, os.path.join(self.config.data_dir, "limitador.json")
+            )
+            armazem = ArmazemDFe.do_config(self.config)
+            # Índice SQLite dos documentos gravados, consultável depois do download
+            indice = IndiceDocumentos.do_config(self.config)
+            if self.config.download_pdf:
+                pdf_dl.ao_concluir = indice.concluir_pdf
+            buscador = BuscadorLotes(
+                self._requisitar_lote, marca, self.running, write, self.config.prefetch_pages, armazem
+            ).iniciar()
+
+            try:
+                for pagina in buscador:
+                    if pagina.erro:
+                        if pagina.status_code in STATUS_STOP:
+                            # Fim do fluxo de NSU: acervo em dia
+                            concluido = True
+                            self.logger.info(f"Acervo sincronizado até o NSU {marca}")
+                        else:
+                            erros += 1
+                            self.logger.error(pagina.erro)
+                            self.registrar_erro(pagina.nsu, "N/A", pagina.tipo_erro, pagina.erro, ano, mes,
+                                                pagina.status_code)
+                        continue
+
+                    decodificados = self.decodificador.decodificar(pagina.documentos)
+
+                    for nfse, (xml_bytes, dados, erro_decodificacao) in zip(pagina.documentos, decodificados):
+                        if not self.running():
+                            break
+
+                        nsu_item = int(nfse["NSU"])
+                        chave = nfse["ChaveAcesso"]
+                        write(f"Processando NSU: {nsu_item}", log=False)
+
+                        try:
+                            if erro_decodificacao:
+                                raise ValueError(erro_decodificacao)
+                            ano_doc, mes_doc = dados.ano_emissao, dados.mes_emissao
+                            ano_compet, mes_compet = dados.ano_compet, dados.mes_compet
+                            tipo_documento = dados.tipo(self.config.cnpj)
+
+                            # Controle de NSU por competência, como no modo Competência
+                            intervalo = intervalos_por_mes.setdefault(
+                                (ano_compet, mes_compet), {"nsu_inicial": nsu_item, "nsu_final": nsu_item}
+                            )
+                            intervalo["nsu_inicial"] = min(intervalo["nsu_inicial"], nsu_item)
+                            intervalo["nsu_final"] = max(intervalo["nsu_final"], nsu_item)
+
+                            pasta_tipo = self.pasta_acervo(ano_doc, mes_doc, tipo_documento)
+                            os.makedirs(pasta_tipo, exist_ok=True)
+                            nome = f"{self.config.file_prefix}_NSU-{nsu_item}_{chave}"
+                            conteudo, extensao = documento_para_gravar(self.config, nfse, xml_bytes)
+                            arquivo_xml = os.path.join(pasta_tipo, nome + extensao)
+                            with open(arquivo_xml, "wb") as fxml:
+                                fxml.write(conteudo)
+                            if (ano_compet, mes_compet) != (ano_doc, mes_doc):
+                                # Também disponível na competência, sem duplicar o arquivo
+                                competencias.setdefault(f"{ano_compet}-{mes_compet}", set()).add(
+                                    os.path.join(f"{ano_doc}-{mes_doc}", tipo_documento, nome + extensao)
+                                )
+
+                            novos += 1
+                            write(f"XML baixado ({tipo_documento}): {chave} (NSU: {nsu_item}) - {mes_doc}/{ano_doc}")
+                            indice.registrar(
+                                nsu_item, chave, dados, tipo_documento, arquivo_xml,
+                                PDF_PENDENTE if self.config.download_pdf else None
+                            )
+
+                            if self.config.download_pdf:
+                                pdf_dl.enfileirar(chave, os.path.join(pasta_tipo, f"{nome}.pdf"), partial(
+                                    self.registrar_erro, nsu_item, chave, "PDF", "Falha no download", ano_doc, mes_doc,
+                                    tentativa=pdf_dl.tentativas
+                                ), nsu=nsu_item, xml_bytes=xml_bytes)
+
+                        except Exception as e:
+                            erros += 1
+                            if nsu_falha is None:
+                                nsu_falha = nsu_item
+                            self.logger.error(f"Erro ao processar documento NSU {nsu_item}: {str(e)}")
+                            self.registrar_erro(nsu_item, chave, "XML", str(e), ano, mes)
+
+                    # Só avança a marca com o lote inteiro gravado; depois de um documento
+                    # com erro, ela fica antes dele para a próxima sincronização buscá-lo de novo
+                    if self.running() and pagina.documentos:
+                        marca = pagina.proximo if nsu_falha is None else max(marca, nsu_falha - 1)
+                        self.salvar_marca(marca, inicio)
+                        inicio = None
+
+            finally:
+                buscador.parar()
+                if self.config.download_pdf:
+                    write("Aguardando PDFs pendentes...", log=False)
+                    pdf_dl.encerrar()
+                self.salvar_competencias(competencias)
+                indice.fechar()
+                self.erros.fechar()
+                self.limitador.salvar()
+                if armazem:
+                    armazem.salvar()
+                self.logger.info(f"Extração de XML: {self.extrator.rapidos} pelo caminho rápido, "
+                                 f"{self.extrator.completos} pela leitura completa")
+                if self.session:
+                    self.session.close()
+                    self.session = None
+
+        # Mantém o controle de NSU por competência usado pelos outros modos
+        self.atualizar_arquivo_competencia(nsu_competencia_file, intervalos_por_mes)
+        self.logger.info(f"Sincronização: {novos} documentos novos, {erros} erros")
+        if nsu_falha is not None:
+            self.logger.warning(f"Marca de sincronização mantida em {marca}: NSU {nsu_falha} será buscado de novo")
+
+        if not self.running():
+            self.logger.warning("Sincronização cancelada: pastas da empresa mantidas como estavam")
+            return 0
+        if not concluido:
+            self.logger.warning("Sincronização não chegou ao fim do fluxo de NSU: pastas da empresa mantidas como estavam")
+            raise SincronizacaoIncompleta(
+                f"Sincronização interrompida antes do fim dos NSUs ({erros} erros)", 0, max(erros, 1)
+            )
+
+        cobertos = [(a, m) for a, m in alvos if self.mes_coberto(a, m)]
+        for a, m in alvos:
+            if (a, m) not in cobertos:
+                self.logger.warning(f"{m}/{a} é anterior ao início do acervo ({self.inicio_acervo()}): "
+                                    f"não disponibilizado; use o modo Emissão ou Competência para esse mês")
+
+        self.pastas.preparar()
+        if len(alvos) == 1:
+            total = self.materializar_mes(ano, mes, competencias) if cobertos else 0
+        else:
+            total = sum(self.materializar_mes(a, m, competencias, subpasta=True) for a, m in cobertos)
+
+        # Remoção só com todos os meses cobertos e sem documentos com erro
+        if len(cobertos) == len(alvos) and not erros:
+            self.pastas.remover_antigos()
+        else:
+            self.logger.warning("Arquivos antigos das pastas da empresa mantidos (mês fora do acervo ou documentos com erro)")
+        resumo = self.pastas.resumo()
+        write(f"Pastas: {resumo['mantidos']} mantidos, {resumo['novos']} novos, {resumo['removidos']} removidos")
+
+        if erros:
+            raise SincronizacaoIncompleta(f"Sincronização com {erros} documento(s) com erro", total, erros)
+        return total
+
+    def materializar_mes(self, ano: str, mes: str, competencias: Optional[dict] = None,
+                         subpasta: bool = False) -> int:
+        """
+        Copia o mês escolhido do acervo para as pastas PRESTADOS/TOMADOS/EVENTOS
+        (em {TIPO}/{AAAA-MM} quando ``subpasta``): os documentos emitidos no mês
+        e os de competência do mês emitidos em outro (``competencias``). As
+        pastas já devem estar preparadas; arquivos iguais já presentes (modo
+        incremental) não são copiados.
+        """
+        arquivos = []  # (origem, tipo)
+        for tipo in PASTAS_TIPO:
+            origem = self.pasta_acervo(ano, mes, tipo)
+            if os.path.isdir(origem):
+                arquivos.extend((os.path.join(origem, arquivo), tipo) for arquivo in os.listdir(origem))
+        acervo = os.path.join(self.config.data_dir, "acervo")
+        for relativo in sorted((competencias or {}).get(f"{ano}-{mes}", ())):
+            caminho = os.path.join(acervo, relativo)
+            tipo = os.path.basename(os.path.dirname(caminho))
+            for arquivo in (caminho, base_documento(caminho) + ".pdf"):
+                if os.path.exists(arquivo):
+                    arquivos.append((arquivo, tipo))
+
+        total = 0
+        for caminho, tipo in arquivos:
+            destino = os.path.join(self.config.output_dir, tipo)
+            if subpasta:
+                destino = os.path.join(destino, f"{ano}-{mes}")
+            os.makedirs(destino, exist_ok=True)
+            arquivo = os.path.basename(caminho)
+            tamanho = os.path.getsize(caminho)
+            if eh_documento(arquivo):
+                total += 1
+                mantido = self.pastas.manter(os.path.join(destino, arquivo), tamanho)
+            else:
+                mantido = self.pastas.pertence(os.path.join(destino, arquivo), tamanho)
+            if not mantido:
+                shutil.copy2(caminho, os.path.join(destino, arquivo))
+
+        self.logger.info(f"{total} documentos de {mes}/{ano} disponibilizados a partir do acervo")
+        return total
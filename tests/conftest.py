@@ -0,0 +1,102 @@
+import base64
+import gzip
+import os
+from contextlib import contextmanager
+
+import pytest
+
+from config.config import Config
+
+CNPJ = "11222333000181"
+CNPJ_TOMADOR = "99888777000166"
+
+## ------------------------------------------------------------------------------
+## Documentos e ADN simulados
+## ------------------------------------------------------------------------------
+def documento(nsu: int, chave: str, xml: str) -> dict:
+    """Item do LoteDFe como o ADN devolve (gzip + base64)"""
+    return {
+        "NSU": nsu,
+        "ChaveAcesso": chave,
+        "ArquivoXml": base64.b64encode(gzip.compress(xml.encode("utf-8"))).decode("ascii"),
+    }
+
+def nota(nsu: int, chave: str, competencia: str, emissao: str, prestador: str = CNPJ) -> dict:
+    """NFS-e do leiaute nacional; ``competencia``/``emissao`` em AAAA-MM"""
+    return documento(nsu, chave, (
+        f'<NFSe xmlns="http://www.sped.fazenda.gov.br/nfse"><infNFSe><nNFSe>{nsu}</nNFSe>'
+        f'<valores><vLiq>100.00</vLiq></valores><DPS><infDPS>'
+        f'<dhEmi>{emissao}-10T10:00:00-03:00</dhEmi><dCompet>{competencia}-01</dCompet>'
+        f'<prest><CNPJ>{prestador}</CNPJ></prest><toma><CNPJ>{CNPJ_TOMADOR}</CNPJ></toma>'
+        f'<valores><vServPrest><vServ>100.00</vServ></vServPrest></valores>'
+        f'</infDPS></DPS></infNFSe></NFSe>'
+    ))
+
+def evento(nsu: int, chave: str, emissao: str, codigo: str = "101101") -> dict:
+    """Evento (cancelamento por padrão) da nota ``chave``"""
+    return documento(nsu, chave, (
+        f'<evento xmlns="http://www.sped.fazenda.gov.br/nfse"><infEvento><pedRegEvento><infPedReg>'
+        f'<chNFSe>{chave}</chNFSe><dhEvento>{emissao}-15T10:00:00-03:00</dhEvento>'
+        f'<e{codigo}><xDesc>Cancelamento de NFS-e</xDesc></e{codigo}>'
+        f'</infPedReg></pedRegEvento></infEvento></evento>'
+    ))
+
+class RespostaFalsa:
+    def __init__(self, status_code: int, dados: dict = None):
+        self.status_code = status_code
+        self.text = ""
+        self._dados = dados or {}
+
+    def json(self) -> dict:
+        return self._dados
+
+class ADNFalso:
+    """Devolve os documentos acima do NSU consultado, ``lote`` por vez; 204 no fim"""
+
+    def __init__(self, documentos: list, lote: int = 50):
+        self.documentos = sorted(documentos, key=lambda d: d["NSU"])
+        self.lote = lote
+        self.consultas = []
+
+    def __call__(self, nsu: int, running) -> RespostaFalsa:
+        self.consultas.append(nsu)
+        lote = [d for d in self.documentos if d["NSU"] > nsu][:self.lote]
+        if not lote:
+            return RespostaFalsa(204)
+        return RespostaFalsa(200, {"StatusProcessamento": "DOCUMENTOS_LOCALIZADOS", "LoteDFe": lote})
+
+@contextmanager
+def _sem_certificado(*args, **kwargs):
+    yield None
+
+## ------------------------------------------------------------------------------
+## Fixtures
+## ------------------------------------------------------------------------------
+@pytest.fixture
+def empresa(tmp_path):
+    """Pastas da empresa (saída e dados internos) num diretório temporário"""
+    pastas = {
+        "saida": str(tmp_path / "packs" / "1"),
+        "dados": str(tmp_path / "dados" / CNPJ),
+    }
+    for pasta in pastas.values():
+        os.makedirs(pasta)
+    pastas["controle"] = os.path.join(pastas["saida"], "nsu_competencia.json")
+    return pastas
+
+@pytest.fixture
+def criar_downloader(empresa):
+    """Downloader de ``classe`` ligado a um ADN simulado com ``documentos``, sem certificado"""
+    def criar(classe, documentos: list, **opcoes):
+        config = Config(**opcoes)
+        config.cnpj = CNPJ
+        config.cert_path = ""
+        config.cert_pass = ""
+        config.output_dir = empresa["saida"]
+        config.data_dir = empresa["dados"]
+        downloader = classe(config)
+        downloader.adn = ADNFalso(documentos)
+        downloader._requisitar_lote = downloader.adn
+        downloader.pfx_to_pem = _sem_certificado
+        return downloader
+    return criar
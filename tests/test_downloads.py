@@ -0,0 +1,86 @@
+import os
+
+import pytest
+
+from downloader.competencia import NFSeDownloaderCompetencia
+from downloader.emissao import NFSeDownloaderEmissao
+from downloader.sincronizar import NFSeDownloaderSincronizar, SincronizacaoIncompleta
+from conftest import evento, nota
+
+CHAVE = "3" * 50
+
+def _arquivos(pasta: str) -> list:
+    return sorted(os.listdir(pasta)) if os.path.isdir(pasta) else []
+
+def _executar(downloader, modo: str, controle: str, ano: str = "2025", mes: str = "03", **opcoes):
+    if modo == "Emissão":
+        return downloader.run_emissao(ano, mes, controle, **opcoes)
+    return downloader.run_competencia(ano, mes, controle, **opcoes)
+
+CLASSES = {"Emissão": NFSeDownloaderEmissao, "Competência": NFSeDownloaderCompetencia}
+
+@pytest.mark.parametrize("modo", CLASSES)
+def test_evento_com_a_chave_da_nota_e_gravado(modo, criar_downloader, empresa):
+    downloader = criar_downloader(CLASSES[modo], [
+        nota(1, CHAVE, "2025-03", "2025-03"),
+        evento(3, CHAVE, "2025-03"),
+    ])
+
+    total = _executar(downloader, modo, empresa["controle"])
+
+    assert total == 2
+    assert _arquivos(os.path.join(empresa["saida"], "PRESTADOS")) == [f"NSU_NSU-1_{CHAVE}.xml"]
+    assert _arquivos(os.path.join(empresa["saida"], "EVENTOS")) == [f"NSU_NSU-3_{CHAVE}.xml"]
+
+@pytest.mark.parametrize("modo", CLASSES)
+def test_execucao_concluida_remove_antigos_e_preserva_falhas(modo, criar_downloader, empresa):
+    prestados = os.path.join(empresa["saida"], "PRESTADOS")
+    os.makedirs(prestados)
+    for nome in ("NSU_NSU-999_antigo.xml", f"NSU_NSU-2_{'4' * 50}.xml", f"NSU_NSU-2_{'4' * 50}.pdf"):
+        with open(os.path.join(prestados, nome), "w") as f:
+            f.write("<anterior/>")
+    invalido = nota(2, "4" * 50, "2025-03", "2025-03")
+    invalido["ArquivoXml"] = "não é base64"
+    downloader = criar_downloader(CLASSES[modo], [nota(1, CHAVE, "2025-03", "2025-03"), invalido])
+
+    _executar(downloader, modo, empresa["controle"])
+
+    # O 204 do fim dos NSUs e o documento com erro não impedem a limpeza;
+    # só os arquivos do NSU que falhou ficam
+    assert _arquivos(prestados) == sorted([
+        f"NSU_NSU-1_{CHAVE}.xml", f"NSU_NSU-2_{'4' * 50}.xml", f"NSU_NSU-2_{'4' * 50}.pdf",
+    ])
+
+def test_documento_em_dois_meses_escolhidos_conta_uma_vez(criar_downloader, empresa):
+    downloader = criar_downloader(NFSeDownloaderCompetencia, [nota(1, CHAVE, "2025-03", "2025-04")],
+                                  download_pdf=True, pdf_mode="Local")
+
+    total = downloader.run_competencia("2025", "03", empresa["controle"],
+                                       meses=[("2025", "03"), ("2025", "04")])
+
+    assert total == 1
+    pdfs = []
+    for mes in ("2025-03", "2025-04"):
+        pasta = os.path.join(empresa["saida"], "PRESTADOS", mes)
+        assert _arquivos(pasta) == [f"NSU_NSU-1_{CHAVE}.pdf", f"NSU_NSU-1_{CHAVE}.xml"]
+        pdfs.append(os.path.join(pasta, f"NSU_NSU-1_{CHAVE}.pdf"))
+    # Um único DANFSe, replicado no outro mês
+    assert os.path.samefile(*pdfs)
+
+def test_sincronizacao_nao_passa_a_marca_do_documento_com_erro(criar_downloader, empresa):
+    invalido = nota(2, "4" * 50, "2025-03", "2025-03")
+    invalido["ArquivoXml"] = "não é base64"
+    documentos = [nota(1, CHAVE, "2025-03", "2025-03"), invalido, nota(3, "5" * 50, "2025-03", "2025-03")]
+    # Sem armazém: a segunda sincronização consulta o ADN de novo
+    downloader = criar_downloader(NFSeDownloaderSincronizar, documentos, armazem_max_mb=0)
+
+    with pytest.raises(SincronizacaoIncompleta) as erro:
+        downloader.run_sincronizar("2025", "03", empresa["controle"])
+    assert erro.value.erros == 1
+    assert downloader.carregar_marca() == 1
+
+    documentos[1] = nota(2, "4" * 50, "2025-03", "2025-03")
+    downloader = criar_downloader(NFSeDownloaderSincronizar, documentos, armazem_max_mb=0)
+    assert downloader.run_sincronizar("2025", "03", empresa["controle"]) == 3
+    assert downloader.adn.consultas[0] == 1
+    assert downloader.carregar_marca() == 3
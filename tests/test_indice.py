@@ -0,0 +1,95 @@
+import os
+import sqlite3
+
+import pytest
+
+from config.config import DIRETORIOS
+from downloader import indice as modulo_indice
+from downloader.extrator import DadosNFSe
+from downloader.indice import ARQUIVO_INDICE, PDF_FALHA, PDF_OK, PDF_PENDENTE, IndiceDocumentos
+from conftest import CNPJ, CNPJ_TOMADOR
+
+def _nota(competencia: str = "2025-03", valor: str = "100.00") -> DadosNFSe:
+    ano, mes = competencia.split("-")
+    return DadosNFSe(ano, mes, ano, mes, cnpj_prestador=CNPJ, cnpj_tomador=CNPJ_TOMADOR,
+                     valor_servico=valor, valor_liquido=valor)
+
+def _cancelamento(competencia: str = "2025-03") -> DadosNFSe:
+    ano, mes = competencia.split("-")
+    return DadosNFSe(ano, mes, ano, mes, evento=True, codigo_evento="101101")
+
+def _linhas(caminho: str, tabela: str = "documentos") -> list:
+    with sqlite3.connect(caminho) as conexao:
+        return conexao.execute(f"SELECT nsu FROM {tabela} ORDER BY nsu").fetchall()
+
+@pytest.fixture
+def caminho(tmp_path):
+    return str(tmp_path / ARQUIVO_INDICE)
+
+def test_grava_em_lotes(caminho, monkeypatch):
+    monkeypatch.setattr(modulo_indice, "LOTE_GRAVACAO", 2)
+    indice = IndiceDocumentos(caminho, CNPJ)
+
+    indice.registrar(1, "a", _nota(), "PRESTADOS", "/p/1.xml")
+    assert _linhas(caminho) == []
+    indice.registrar(2, "b", _nota(), "PRESTADOS", "/p/2.xml")
+    assert _linhas(caminho) == [(1,), (2,)]
+    indice.registrar(3, "c", _nota(), "PRESTADOS", "/p/3.xml")
+    indice.fechar()
+    assert _linhas(caminho) == [(1,), (2,), (3,)]
+
+def test_falha_na_gravacao_mantem_o_lote(caminho):
+    indice = IndiceDocumentos(caminho, CNPJ)
+    indice._conexao.execute("PRAGMA busy_timeout = 0")
+    bloqueio = sqlite3.connect(caminho)
+    bloqueio.execute("BEGIN IMMEDIATE")
+
+    indice.registrar(1, "a", _nota(), "PRESTADOS", "/p/1.xml")
+    indice.salvar()  # database is locked
+    bloqueio.rollback()
+    bloqueio.close()
+    indice.fechar()
+
+    assert _linhas(caminho) == [(1,)]
+    assert _linhas(caminho, "arquivos") == [(1,)]
+
+def test_cancelamento_antes_e_depois_da_nota(caminho):
+    with IndiceDocumentos(caminho, CNPJ) as indice:
+        indice.registrar(1, "a", _nota(), "PRESTADOS", "/p/1.xml")
+        indice.registrar(2, "a", _cancelamento(), "EVENTOS", "/e/2.xml")
+        indice.registrar(3, "b", _cancelamento(), "EVENTOS", "/e/3.xml")
+    # O evento de "b" já está no índice quando a nota chega em outra execução
+    with IndiceDocumentos(caminho, CNPJ) as indice:
+        indice.registrar(4, "b", _nota(), "PRESTADOS", "/p/4.xml")
+        indice.registrar(5, "c", _nota(), "PRESTADOS", "/p/5.xml")
+        assert indice.cancelada("a") and indice.cancelada("b") and not indice.cancelada("c")
+        canceladas = [doc["nsu"] for doc in indice.consultar(cancelada=True, tipo="PRESTADOS")]
+        assert canceladas == [1, 4]
+
+def test_situacao_do_pdf_em_cada_copia(caminho):
+    with IndiceDocumentos(caminho, CNPJ) as indice:
+        indice.registrar(1, "a", _nota(), "PRESTADOS", "/p/2025-03/1.xml", PDF_PENDENTE,
+                         copias=[("/p/2025-04/1.xml", PDF_PENDENTE)])
+        indice.concluir_pdf("a", "/p/2025-03/1.pdf", True)
+        indice.concluir_pdf("a", "/p/2025-04/1.pdf", False)
+
+        assert [doc["pdf"] for doc in indice.consultar(chave="a")] == [PDF_OK]
+        assert [(arq["arquivo"], arq["pdf"]) for arq in indice.arquivos(1)] == [
+            ("/p/2025-03/1.xml", PDF_OK), ("/p/2025-04/1.xml", PDF_FALHA),
+        ]
+
+def test_consultas_por_competencia(tmp_path, monkeypatch):
+    monkeypatch.setitem(DIRETORIOS, "dados", tmp_path)
+    with IndiceDocumentos.da_empresa(CNPJ) as indice:
+        indice.registrar(1, "a", _nota(valor="100.00"), "PRESTADOS", "/p/1.xml")
+        indice.registrar(2, "b", _nota(valor="50.00"), "PRESTADOS", "/p/2.xml")
+        indice.registrar(3, "b", _cancelamento(), "EVENTOS", "/e/3.xml")
+        indice.registrar(4, "c", _nota("2025-04"), "PRESTADOS", "/p/4.xml")
+
+        assert indice.chaves("2025-03") == ["a", "b"]
+        assert indice.chaves("2025-03", cnpj=CNPJ_TOMADOR, tipo="PRESTADOS") == ["a", "b"]
+        resumo = indice.resumo("2025-03")
+        assert resumo["PRESTADOS"]["quantidade"] == 2
+        assert resumo["PRESTADOS"]["canceladas"] == 1
+        assert resumo["PRESTADOS"]["valor_servico"] == 100.0
+    assert os.path.exists(tmp_path / CNPJ / ARQUIVO_INDICE)
@@ -0,0 +1,30 @@
+from downloader.intervalos import IndiceIntervalos
+
+def _indice(**meses):
+    registros = {}
+    for chave, (inicial, final) in meses.items():
+        ano, mes = chave[1:].split("_")
+        registros.setdefault(ano, {})[mes] = {"nsu_inicial": inicial, "nsu_final": final}
+    return IndiceIntervalos(registros)
+
+def test_competencia_do_nsu_sequencial():
+    indice = _indice(m2025_01=(1, 100), m2025_02=(101, 200))
+    assert indice.competencia_do_nsu(1) == ("2025", "01")
+    assert indice.competencia_do_nsu(100) == ("2025", "01")
+    assert indice.competencia_do_nsu(101) == ("2025", "02")
+    assert indice.competencia_do_nsu(201) is None
+    assert indice.competencia_do_nsu(0) is None
+
+def test_competencia_do_nsu_aninhado():
+    indice = _indice(m2025_01=(1, 100), m2025_02=(50, 60))
+    assert indice.competencia_do_nsu(70) == ("2025", "01")
+    assert indice.competencia_do_nsu(55) == ("2025", "02")
+    assert indice.competencia_do_nsu(49) == ("2025", "01")
+    assert indice.competencia_do_nsu(150) is None
+
+def test_competencia_do_nsu_lacuna_apos_aninhados():
+    indice = _indice(m2025_01=(1, 10), m2025_02=(20, 100), m2025_03=(30, 40), m2025_04=(50, 60))
+    assert indice.competencia_do_nsu(15) is None
+    assert indice.competencia_do_nsu(45) == ("2025", "02")
+    assert indice.competencia_do_nsu(70) == ("2025", "02")
+    assert indice.competencia_do_nsu(5) == ("2025", "01")
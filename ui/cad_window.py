@@ -10,6 +10,7 @@ from datetime import datetime, timedelta
 from config.config import DIRETORIOS, ROOT_DIR
 from config.utils import limpar_numero, formatar_milhar, formatar_cnpj_digitacao, validar_cnpj, limpar_cnpj, formatar_cnpj
 from config.json_handler import carregar_json, salvar_json
+from downloader.intervalos import IndiceIntervalos
 from ui.ui_basic import modal_window, back_window, ToolTip, scrolled_treeview, buttons_frame, centralizar
 logger = logging.getLogger(__name__)
 
@@ -202,6 +203,15 @@ class CadastroUI:
                     except Exception as e:
                         logger.error(f"Erro ao atualizar {caminho_arquivo}: {str(e)}")
 
+        # Marcas de sincronização e checkpoints dependem dos NSUs resetados
+        for pasta_raiz, subpastas, arquivos in os.walk(DIRETORIOS['dados']):
+            for arquivo in arquivos:
+                if arquivo in ("sincronizacao.json", "checkpoint.json"):
+                    try:
+                        os.remove(os.path.join(pasta_raiz, arquivo))
+                    except Exception as e:
+                        logger.error(f"Erro ao remover {arquivo} em {pasta_raiz}: {str(e)}")
+
         salvar_json(self.data, DIRETORIOS['cadastros_json'])
         self._atualizar_lista()
         messagebox.showinfo("Sucesso", "NSUs de todos os cadastros foram resetados com sucesso!")
@@ -258,6 +268,11 @@ class CadastroUI:
         if os.path.exists(zip_path):
             os.remove(zip_path)
 
+        # Deletar dados internos (estado do download, índices)
+        dados_path = os.path.join(DIRETORIOS['dados'], limpar_cnpj(empresa_data.get('cnpj', '')))
+        if empresa_data.get('cnpj') and os.path.exists(dados_path):
+            shutil.rmtree(dados_path)
+
         # Remover do JSON
         self.data.pop(key, None)
         salvar_json(self.data, DIRETORIOS['cadastros_json'])
@@ -740,20 +755,16 @@ class EditorNSU:
     def _atualizar_treeview(self):
         """Atualiza a treeview com os dados atuais"""
         self.tree_nsu.delete(*self.tree_nsu.get_children())
-        registros = self.dados_nsu.get('registros', {})
-
-        # Ordenar anos e meses
-        anos_ordenados = sorted(registros.keys(), key=int, reverse=True)
-        for ano in anos_ordenados:
-            meses_ordenados = sorted(registros[ano].keys(), key=int, reverse=True)
-            for mes in meses_ordenados:
-                dados = registros[ano][mes]
-                self.tree_nsu.insert('', tk.END, values=(
-                    ano, 
-                    str(mes).zfill(2),  # Força dois dígitos no mês
-                    f"{dados.get('nsu_inicial', 0):,}".replace(",", "."),  # Formata com ponto de milhar
-                    f"{dados.get('nsu_final', 0):,}".replace(",", "."),    # Formata com ponto de milhar
-                ))
+        indice = IndiceIntervalos.do_nsu_comp(self.dados_nsu)
+
+        # Mais recentes primeiro (o índice já está em ordem cronológica)
+        for dados in indice.ultimos(len(indice)):
+            self.tree_nsu.insert('', tk.END, values=(
+                dados['ano'], 
+                str(dados['mes']).zfill(2),  # Força dois dígitos no mês
+                f"{dados['nsu_inicial']:,}".replace(",", "."),  # Formata com ponto de milhar
+                f"{dados['nsu_final']:,}".replace(",", "."),    # Formata com ponto de milhar
+            ))
 
     def _limpar_campos(self):
         """Limpa os campos de entrada"""
@@ -797,6 +808,15 @@ class EditorNSU:
             messagebox.showerror("Erro", "Ano e mês devem ser números válidos!")
             return
         
+        # Avisar se o intervalo invade outra competência já registrada
+        indice = IndiceIntervalos.do_nsu_comp(self.dados_nsu)
+        for nsu in {int(n) for n in (nsu_inicial, nsu_final) if n}:
+            outra = indice.competencia_do_nsu(nsu)
+            if outra and (int(outra[0]), int(outra[1])) != (ano_int, mes_int):
+                if not messagebox.askyesno("Confirmação", f"O NSU {nsu} já pertence a {str(outra[1]).zfill(2)}/{outra[0]}. Salvar mesmo assim?"):
+                    return
+                break
+        
         # Garantir estrutura - modificado para estrutura compacta
         if 'registros' not in self.dados_nsu:
             self.dados_nsu['registros'] = {}
@@ -15,9 +15,10 @@ class ConfigUI:
     
     TOOLTIPS = {
         "file_prefix": "Como o nome do arquivo baixado será iniciado.",
-        "delay_seconds": "Tempo de download entre requisições de lotes (em segundos).\nGarantir um delay maior pode evitar bloqueios temporários.",
-        "timeout": "Tempo máximo de espera por resposta do servidor (em segundos).",
-        "consult_mode": "Modo de consulta por data de Competência ou Emissão. \nEm competência busca pela emissão também para evitar perca de NFSe.",
+        "delay_seconds": "Intervalo inicial entre requisições de lotes (em segundos).\nO intervalo é ajustado automaticamente conforme as respostas do servidor (429/lentidão).",
+        "timeout": "Tempo máximo de espera por resposta do servidor (em segundos).\nFalhas transitórias (conexão, 5xx) são repetidas com espera crescente.",
+        "max_workers": "Quantidade de empresas baixadas ao mesmo tempo.\nCada empresa usa seu próprio certificado e controle de NSU.",
+        "consult_mode": "Modo de consulta por data de Competência ou Emissão. \nEm competência busca pela emissão também para evitar perca de NFSe.\nSincronizar busca só os NSUs novos desde a última execução e monta o mês a partir do acervo local.",
         "save_mode" : "Modo de salvamento dos cadastros, se será por código da empresa ou CNPJ",
         "download_pdf": "Se marcado, baixa os arquivos em PDF. Aumenta o tempo de processamento. \nProblemas no servidor podem ocorrer e os PDFs não serem baixados."
     }
@@ -28,7 +29,7 @@ class ConfigUI:
         self.vars = {}
         
         # Cria janela modal
-        self.win = modal_window(parent.root, "Configurações - Download NFSe Nacional", 350, 250)
+        self.win = modal_window(parent.root, "Configurações - Download NFSe Nacional", 350, 285)
         self._create_widgets()
 
     def _create_widgets(self):
@@ -44,7 +45,8 @@ class ConfigUI:
         fields = [
             (0, "file_prefix", "Prefixo Arquivo"),
             (1, "delay_seconds", "Delay (s)"),
-            (2, "timeout", "Timeout (s)")
+            (2, "timeout", "Timeout (s)"),
+            (3, "max_workers", "Empresas simult.")
         ]
         
         for row, key, label in fields:
@@ -55,7 +57,7 @@ class ConfigUI:
 
     def _create_combobox(self):
         """Cria o combobox para consult_mode"""
-        row = 3
+        row = 4
         tk.Label(self.win, text="Modo Consulta").grid(row=row, column=0, sticky="w", padx=5, pady=5)
         
         # Criar StringVar para o combobox
@@ -65,7 +67,7 @@ class ConfigUI:
         consult_mode_combo = ttk.Combobox(
             self.win, 
             textvariable=self.consult_mode_var,
-            values=["Competência", "Emissão"],
+            values=["Competência", "Emissão", "Sincronizar"],
             state="readonly",
             width=22
         )
@@ -74,7 +76,7 @@ class ConfigUI:
         # Adicionar ao dicionário de variáveis
         self.vars["consult_mode"] = self.consult_mode_var
 
-        row = 4
+        row = 5
         tk.Label(self.win, text="Modo Cadastros").grid(row=row, column=0, sticky="w", padx=5, pady=5)
         
         # Criar StringVar para o combobox
@@ -97,35 +99,35 @@ class ConfigUI:
         """Cria o checkbox para download de PDF"""
         self.pdf_var = tk.BooleanVar(value=bool(self.config.download_pdf))
         chk_pdf = tk.Checkbutton(self.win, text="Baixar PDF", variable=self.pdf_var)
-        chk_pdf.grid(row=5, column=1, sticky="w", padx=5, pady=5)
+        chk_pdf.grid(row=6, column=1, sticky="w", padx=5, pady=5)
 
     def _create_tooltips(self):
         """Adiciona tooltips aos campos"""
         # Tooltips para os campos de entrada
-        for row, key in enumerate(["file_prefix", "delay_seconds", "timeout"]):
+        for row, key in enumerate(["file_prefix", "delay_seconds", "timeout", "max_workers"]):
             icon = tk.Label(self.win, text="❓", fg="blue", cursor="question_arrow")
             icon.grid(row=row, column=2, sticky="w", padx=2)
             ToolTip(icon, self.TOOLTIPS.get(key, ""))
 
-        # Tooltip para consult_mode (row 3)
+        # Tooltip para consult_mode (row 4)
         icon_consult = tk.Label(self.win, text="❓", fg="blue", cursor="question_arrow")
-        icon_consult.grid(row=3, column=2, sticky="w", padx=2)
+        icon_consult.grid(row=4, column=2, sticky="w", padx=2)
         ToolTip(icon_consult, self.TOOLTIPS.get("consult_mode", ""))
 
-        # Tooltip para save_mode (row 4)
+        # Tooltip para save_mode (row 5)
         icon_save = tk.Label(self.win, text="❓", fg="blue", cursor="question_arrow")
-        icon_save.grid(row=4, column=2, sticky="w", padx=2)
+        icon_save.grid(row=5, column=2, sticky="w", padx=2)
         ToolTip(icon_save, self.TOOLTIPS.get("save_mode", ""))
 
-        # Tooltip para download_pdf (row 5)
+        # Tooltip para download_pdf (row 6)
         icon_pdf = tk.Label(self.win, text="❓", fg="blue", cursor="question_arrow")
-        icon_pdf.grid(row=5, column=2, sticky="w", padx=2)
+        icon_pdf.grid(row=6, column=2, sticky="w", padx=2)
         ToolTip(icon_pdf, self.TOOLTIPS.get("download_pdf", ""))
 
     def _create_buttons(self):
         """Cria os botões de ação"""
         frame_buttons = tk.Frame(self.win)
-        frame_buttons.grid(row=6, column=0, columnspan=3, padx=60, pady=15)
+        frame_buttons.grid(row=7, column=0, columnspan=3, padx=60, pady=15)
 
         tk.Button(frame_buttons, text="Salvar", width=12, command=self._save).grid(row=0, column=0, padx=10)
         tk.Button(frame_buttons, text="Cancelar", width=12, command=self._on_close).grid(row=0, column=1, padx=10)
@@ -138,6 +140,8 @@ class ConfigUI:
             for key, var in self.vars.items():
                 if key in ("delay_seconds", "timeout"):
                     new_data[key] = float(var.get())
+                elif key == "max_workers":
+                    new_data[key] = max(1, int(var.get()))
                 else:
                     new_data[key] = var.get()
                 logger.info(f"Configuração de {key} definida {new_data[key]}")
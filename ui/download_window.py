@@ -1,22 +1,24 @@
 import json
 import os
-import shutil
 import logging
 import tkinter as tk
 import threading
-import time  # Mover esta importação para cá
 import traceback
-import zipfile
-import win32com.client as win32
-from pathlib import Path
-import pythoncom
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tkinter import ttk, messagebox, filedialog
 from datetime import datetime, timedelta
 ## Módulos auxiliares
-from config.config import DIRETORIOS, ROOT_DIR, Config
-from config.utils import formatar_cnpj
+from config.config import DIRETORIOS, ROOT_DIR, Config, pasta_dados_empresa
+from config.compactacao import CompactadorZip
+from config.exportacao import COPIA, HARDLINK, PULADO, ExportadorPacotes
+from config.relatorio import importar_relatorio
+from config.utils import formatar_cnpj, limpar_cnpj, meses_entre
 from downloader.emissao import NFSeDownloaderEmissao
 from downloader.competencia import NFSeDownloaderCompetencia
+from downloader.sincronizar import NFSeDownloaderSincronizar
+from downloader.checkpoint import CheckpointDownload
+from downloader.decodificacao import obter_pool
+from downloader.fila_pdf import ARQUIVO_FILA
 from ui.ui_basic import PopupProcessamento, notificar_windows, modal_window, scrolled_treeview, buttons_frame, back_window
 from config.config import Config
 from config.json_handler import carregar_cadastros
@@ -35,10 +37,13 @@ class DownloadUI:
         self.chaves_cadastros = []
         self.tree = None
         self.processo_ativo = False
+        self.retomar_download = False
         self.resultados = []
         self.contador_nfse_global = 0
         self.empresas_selecionadas = []
         self.indice_cnpj = {}  # Adicionar este
+        self.downloaders_ativos = set()
+        self._lock = threading.Lock()
         
         self._setup_ui()
 
@@ -117,17 +122,30 @@ class DownloadUI:
         self.combo_mes.set(str(mes_anterior.month).zfill(2))
         self.combo_mes.grid(row=0, column=3, padx=5)
 
+        # Até (opcional): vários meses numa única passada pelos NSUs
+        tk.Label(frame_filtros, text="Até Ano:").grid(row=0, column=4, padx=5, sticky="w")
+        self.combo_ate_ano = ttk.Combobox(frame_filtros, values=[""] + anos, state="readonly", width=10)
+        self.combo_ate_ano.set("")
+        self.combo_ate_ano.grid(row=0, column=5, padx=5)
+
+        tk.Label(frame_filtros, text="Até Mês:").grid(row=0, column=6, padx=5, sticky="w")
+        self.combo_ate_mes = ttk.Combobox(frame_filtros, values=[""] + [m[0] for m in meses], state="readonly", width=10)
+        self.combo_ate_mes.set("")
+        self.combo_ate_mes.grid(row=0, column=7, padx=5)
+
     def _criar_botoes(self):
         """Cria os botões de ação"""
         botoes_config = [
             {"text": "Selec. Todos", "width": 10, "command": self._selecionar_todos},
             {"text": "Baixar", "width": 10, "state": tk.DISABLED, "command": self._baixar_nfse},
             {"text": "Exportar", "width": 10, "state": tk.DISABLED, "command": self._exportar_nfse},
+            {"text": "PDFs Pend.", "width": 10, "state": tk.DISABLED, "command": self._reprocessar_pdfs},
         ]
         
         frame_buttons, botoes = buttons_frame(self.win, botoes_config)
         self.btn_baixar = botoes["Baixar"]
         self.btn_exportar = botoes["Exportar"]
+        self.btn_pdfs = botoes["PDFs Pend."]
 
         # Botão voltar à direita
         btn_close = tk.Button(frame_buttons, text="Voltar", width=10, command= lambda: back_window(self.win, self.parent.root))
@@ -231,6 +249,7 @@ class DownloadUI:
         if not selecionados:
             self.btn_baixar.config(state=tk.DISABLED)
             self.btn_exportar.config(state=tk.DISABLED)
+            self.btn_pdfs.config(state=tk.DISABLED)
             return
 
         # Verificar se há pelo menos uma empresa com certificado válido selecionada
@@ -248,8 +267,10 @@ class DownloadUI:
         # Habilitar/desabilitar botões
         if empresas_validas_selecionadas:
             self.btn_baixar.config(state=tk.NORMAL)
+            self.btn_pdfs.config(state=tk.NORMAL)
         else:
             self.btn_baixar.config(state=tk.DISABLED)
+            self.btn_pdfs.config(state=tk.DISABLED)
             
         # Exportar sempre está disponível (não depende do certificado)
         self.btn_exportar.config(state=tk.NORMAL)
@@ -344,11 +365,12 @@ class DownloadUI:
         empresas_nao_encontradas = []
         empresas_erro_renomeacao = []
         
-        # Criar pasta temporária para cópias renomeadas
-        pasta_temp = os.path.join(DIRETORIOS['temp'], "export_temp")
-        if os.path.exists(pasta_temp):
-            shutil.rmtree(pasta_temp)
-        os.makedirs(pasta_temp, exist_ok=True)
+        # Cada pacote vai direto ao destino (hardlink ou cópia pelo sistema),
+        # várias empresas ao mesmo tempo; os que não mudaram desde a última
+        # exportação para o mesmo destino são pulados
+        exportador = ExportadorPacotes(DIRETORIOS['exportacoes_json'])
+        modos = {PULADO: 0, HARDLINK: 0, COPIA: 0}
+        pacotes = []
         
         # Processar cada empresa selecionada
         for item in selecionados:
@@ -363,36 +385,44 @@ class DownloadUI:
                 empresas_nao_encontradas.append(f"[{cod_empresa}] {nome_empresa}")
                 continue
             
-            try:
-                # Determinar nome final baseado no save_mode
-                if save_mode == 'CNPJ':
-                    # Usar índice para busca rápida
-                    cnpj_limpo = self.indice_cnpj.get(cod_empresa)
-                    if cnpj_limpo:
-                        nome_arquivo_destino = f"{cnpj_limpo}.zip"
-                    else:
-                        # Fallback: buscar no cadastro
-                        cadastro = self._buscar_cadastro_empresa(cod_empresa)
-                        if cadastro and 'cnpj' in cadastro:
-                            cnpj_formatado = cadastro['cnpj'].replace('.', '').replace('/', '').replace('-', '')
-                            nome_arquivo_destino = f"{cnpj_formatado}.zip"
-                            # Atualizar índice
-                            self.indice_cnpj[cod_empresa] = cnpj_formatado
-                        else:
-                            logger.warning(f"CNPJ não encontrado para empresa {cod_empresa}. Usando código como fallback.")
-                            nome_arquivo_destino = nome_arquivo_origem
+            # Determinar nome final baseado no save_mode
+            if save_mode == 'CNPJ':
+                # Usar índice para busca rápida
+                cnpj_limpo = self.indice_cnpj.get(cod_empresa)
+                if cnpj_limpo:
+                    nome_arquivo_destino = f"{cnpj_limpo}.zip"
                 else:
-                    # Modo código (default)
-                    nome_arquivo_destino = nome_arquivo_origem
-                
-                # Criar cópia temporária renomeada
-                caminho_temp = os.path.join(pasta_temp, nome_arquivo_destino)
-                shutil.copy2(caminho_origem, caminho_temp)
-                
-                # Copiar da pasta temporária para o destino final
-                caminho_destino = os.path.join(destino, nome_arquivo_destino)
-                shutil.copy2(caminho_temp, caminho_destino)
+                    # Fallback: buscar no cadastro
+                    cadastro = self._buscar_cadastro_empresa(cod_empresa)
+                    if cadastro and 'cnpj' in cadastro:
+                        cnpj_formatado = cadastro['cnpj'].replace('.', '').replace('/', '').replace('-', '')
+                        nome_arquivo_destino = f"{cnpj_formatado}.zip"
+                        # Atualizar índice
+                        self.indice_cnpj[cod_empresa] = cnpj_formatado
+                    else:
+                        logger.warning(f"CNPJ não encontrado para empresa {cod_empresa}. Usando código como fallback.")
+                        nome_arquivo_destino = nome_arquivo_origem
+            else:
+                # Modo código (default)
+                nome_arquivo_destino = nome_arquivo_origem
+            
+            caminho_destino = os.path.join(destino, nome_arquivo_destino)
+            pacotes.append((cod_empresa, nome_empresa, caminho_origem, caminho_destino, nome_arquivo_destino))
+        
+        max_workers = max(1, int(getattr(config, 'max_workers', 1) or 1))
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="exportar") as executor:
+            futuros = {executor.submit(exportador.exportar, origem, caminho_destino): (cod_empresa, nome_empresa, nome_arquivo_destino)
+                       for cod_empresa, nome_empresa, origem, caminho_destino, nome_arquivo_destino in pacotes}
+            for futuro in as_completed(futuros):
+                cod_empresa, nome_empresa, nome_arquivo_destino = futuros[futuro]
+                try:
+                    modo = futuro.result()
+                except Exception as e:
+                    logger.error(f"Erro ao exportar empresa {cod_empresa}: {e}")
+                    empresas_erro_renomeacao.append(f"[{cod_empresa}] {nome_empresa}")
+                    continue
                 
+                modos[modo] += 1
                 # Adicionar à lista de exportadas com formato adequado
                 if save_mode == 'cnpj':
                     # Mostrar transformação apenas se CNPJ foi encontrado
@@ -404,18 +434,12 @@ class DownloadUI:
                 else:
                     empresas_exportadas.append(f"[{cod_empresa}] {nome_empresa}")
                     
-                logger.info(f"Exportado: {cod_empresa} -> {nome_arquivo_destino}")
-                
-            except Exception as e:
-                logger.error(f"Erro ao exportar empresa {cod_empresa}: {e}")
-                empresas_erro_renomeacao.append(f"[{cod_empresa}] {nome_empresa}")
+                logger.info(f"Exportado ({modo}): {cod_empresa} -> {nome_arquivo_destino}")
         
-        # Limpar pasta temporária
         try:
-            shutil.rmtree(pasta_temp)
-            logger.info(f"Pasta temporária limpa: {pasta_temp}")
+            exportador.salvar()
         except Exception as e:
-            logger.warning(f"Erro ao limpar pasta temporária: {e}")
+            logger.warning(f"Erro ao salvar o manifesto de exportação: {e}")
         
         # Construir mensagem de resultado
         mensagem = f"Exportação de arquivos ZIP ({save_mode}):\n\n"
@@ -425,6 +449,8 @@ class DownloadUI:
             mensagem += "\n".join(f"  • {emp}" for emp in empresas_exportadas[:10])  # Limitar a 10 itens
             if len(empresas_exportadas) > 10:
                 mensagem += f"\n  ... e mais {len(empresas_exportadas) - 10} arquivos"
+            if modos[PULADO]:
+                mensagem += f"\n  ({modos[PULADO]} sem alteração desde a última exportação)"
         
         if empresas_nao_encontradas:
             if empresas_exportadas:
@@ -448,7 +474,8 @@ class DownloadUI:
             mensagem += "\n\n📝 Nota: CNPJs exportados sem pontuação (formato: 12345678000195)"
         
         messagebox.showinfo("Exportação Concluída", mensagem)
-        logger.info(f"Exportação concluída. Modo: {save_mode}, Exportados: {len(empresas_exportadas)}")
+        logger.info(f"Exportação concluída. Modo: {save_mode}, Exportados: {len(empresas_exportadas)} "
+                    f"({modos[HARDLINK]} hardlinks, {modos[COPIA]} cópias, {modos[PULADO]} sem alteração)")
 
     def _criar_indice_cnpj(self):
         """Cria índice rápido código->CNPJ para exportação"""
@@ -482,10 +509,17 @@ class DownloadUI:
                 
             xlsm_path = os.path.join(pasta_empresa, xlsm_files[0])
             
-            macro_executada = self._executar_macro_vba(xlsm_path, 'ImportarTodosXMLs')
-            
-            if not macro_executada:
-                logger.warning(f"Falha ao executar macro para empresa {cod_empresa}")
+            # Importação dos XMLs na planilha sem Excel; com pool de processos,
+            # roda fora do GIL e várias empresas importam em paralelo
+            try:
+                config = Config.load(DIRETORIOS['config_json'])
+                processos = int(getattr(config, 'decode_processes', 0) or 0)
+                if processos > 0:
+                    obter_pool(processos).submit(importar_relatorio, xlsm_path, cnpj_empresa).result()
+                else:
+                    importar_relatorio(xlsm_path, cnpj_empresa)
+            except Exception as e:
+                logger.warning(f"Falha ao importar os XMLs na planilha da empresa {cod_empresa}: {e}")
             
             zip_path = os.path.join(DIRETORIOS['notas'], f"{cod_empresa}.zip")
             compactacao_sucesso = self._compactar_pasta_empresa(pasta_empresa, zip_path)
@@ -500,74 +534,16 @@ class DownloadUI:
             logger.error(f"Erro no processamento pós-download: {e}")
             return False
 
-    def _executar_macro_vba(self, caminho_xlsm, nome_macro):
-        """Executa macro do Excel em modo oculto"""
-        excel = None
-        workbook = None
-        try:
-            pythoncom.CoInitialize()
-            
-            excel = win32.DispatchEx("Excel.Application")
-            excel.Visible = 0
-            excel.DisplayAlerts = 0
-            excel.AskToUpdateLinks = 0
-            excel.ScreenUpdating = 0
-            excel.EnableEvents = 0
-            excel.Interactive = 0
-            
-            time.sleep(0.5)  # Usar time.sleep em vez de datetime.time.sleep
-            
-            workbook = excel.Workbooks.Open(caminho_xlsm, ReadOnly=False)
-            excel.Run(nome_macro)
-            workbook.Save()
-            workbook.Close()
-            excel.Quit()
-            
-            logging.info(f"Macro {nome_macro} executada com sucesso")
-            return True
-            
-        except Exception as e:
-            logging.error(f"Erro ao executar macro {nome_macro}: {e}")
-            try:
-                if workbook:
-                    workbook.Close(SaveChanges=False)
-                if excel:
-                    excel.Quit()
-            except:
-                pass
-            return False
-        finally:
-            try:
-                if workbook:
-                    workbook = None
-                if excel:
-                    excel = None
-            except:
-                pass
-            try:
-                pythoncom.CoUninitialize()
-            except:
-                pass
-
     def _compactar_pasta_empresa(self, pasta_origem, caminho_zip):
-        """Compacta toda a pasta incluindo subpastas"""
+        """Compacta toda a pasta incluindo subpastas, aproveitando o .zip anterior"""
         try:
-            pasta_origem = Path(pasta_origem)
-            
-            with zipfile.ZipFile(caminho_zip, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                for root, dirs, files in os.walk(pasta_origem):
-                    for dir_name in dirs:
-                        dir_path = Path(root) / dir_name
-                        rel_path = dir_path.relative_to(pasta_origem)
-                        zip_info = zipfile.ZipInfo(str(rel_path).replace("\\", "/") + "/")
-                        zipf.writestr(zip_info, "")
-                    
-                    for file_name in files:
-                        file_path = Path(root) / file_name
-                        rel_path = file_path.relative_to(pasta_origem)
-                        zipf.write(file_path, rel_path)
-                        
-            logger.info(f"Pasta {pasta_origem} compactada para {caminho_zip}")
+            # Só os arquivos novos ou alterados são compactados (em paralelo);
+            # os demais são copiados do .zip anterior pelo manifesto ao lado dele
+            compactador = CompactadorZip.do_config(Config.load(DIRETORIOS['config_json']))
+            resumo = compactador.compactar(pasta_origem, caminho_zip)
+            logger.info(f"Pasta {pasta_origem} compactada para {caminho_zip} "
+                        f"({resumo['novos']} novos, {resumo['alterados']} alterados, "
+                        f"{resumo['mantidos']} mantidos, {resumo['removidos']} removidos)")
             return True
             
         except Exception as e:
@@ -576,9 +552,11 @@ class DownloadUI:
 
     def _atualizar_contador_nfse(self, incremento=1):
         """Atualiza o contador global de NFSe"""
-        self.contador_nfse_global += incremento
+        with self._lock:
+            self.contador_nfse_global += incremento
+            contador = self.contador_nfse_global
         if hasattr(self, 'popup') and self.popup and hasattr(self.popup, 'winfo_exists') and self.popup.winfo_exists():
-            self.win.after(0, lambda: self.popup.atualizar_contador_nfse(self.contador_nfse_global))
+            self.win.after(0, lambda: self.popup.atualizar_contador_nfse(contador))
 
     def _baixar_nfse(self):
         """Função principal para baixar NFSe das empresas selecionadas"""
@@ -588,10 +566,24 @@ class DownloadUI:
             
         ano = self.combo_ano.get()
         mes = self.combo_mes.get()
+        self.ano_download = ano
+        self.mes_download = mes
+        
+        # Intervalo de meses (Até Ano/Mês vazio = apenas o mês escolhido)
+        ano_ate = self.combo_ate_ano.get() or ano
+        mes_ate = self.combo_ate_mes.get() or mes
+        self.meses_download = meses_entre(ano, mes, ano_ate, mes_ate)
+        if not self.meses_download:
+            messagebox.showwarning("Período Inválido", "O mês final deve ser igual ou posterior ao mês inicial.")
+            return
+        if len(self.meses_download) > 12:
+            messagebox.showwarning("Período Inválido", "Selecione no máximo 12 meses por download.")
+            return
+        ate = f"{ano_ate}-{mes_ate}" if len(self.meses_download) > 1 else None
         
         # Log adicional para debug
         logger.info(f"Iniciando download para {len(selecionados)} empresas selecionadas")
-        logger.info(f"Competência: {mes}/{ano}")
+        logger.info(f"Competência: {mes}/{ano}" + (f" até {mes_ate}/{ano_ate}" if ate else ""))
 
         config_global = Config.load(DIRETORIOS['config_json'])
         
@@ -644,68 +636,135 @@ class DownloadUI:
                                 "Atualize os certificados antes de fazer o download.")
             return
 
+        # Downloads interrompidos desta competência podem continuar de onde pararam
+        self.retomar_download = False
+        pendentes = [
+            e for e in self.empresas_selecionadas
+            if CheckpointDownload.pendente(
+                str(DIRETORIOS['dados'] / limpar_cnpj(e['cadastro']['cnpj'])), config_global.consult_mode, ano, mes, ate
+            )
+        ]
+        if pendentes:
+            self.retomar_download = messagebox.askyesno(
+                "Download Interrompido",
+                f"{len(pendentes)} empresa(s) com download interrompido de {mes}/{ano}.\n\n"
+                "Deseja continuar de onde parou?\n(Não = baixar novamente do início)"
+            )
+
         self.popup = PopupProcessamento(
             self.win, 
             titulo="Baixando - Download NFS-e Nacional", 
             texto=f"Baixando NFSe para {len(self.empresas_selecionadas)} empresa(s) válida(s)..."
         )
+        # Fechar o popup cancela o download de todas as empresas em andamento
+        self.popup.win.protocol("WM_DELETE_WINDOW", self._cancelar_download)
         
         self.resultados = []
         self.processo_ativo = True
         self.contador_nfse_global = 0
+        self.empresas_iniciadas = 0
+        self.downloaders_ativos = set()
         
         # Iniciar thread de download
         thread_download = threading.Thread(target=self._processo_download, daemon=True)
         thread_download.start()
 
     def _processo_download(self):
-        """Processo de download em thread separada"""
+        """Processo de download em thread separada, com várias empresas simultâneas"""
         try:
             total_empresas = len(self.empresas_selecionadas)
             self.total_empresas = total_empresas  # Armazena o total
-            logger.info(f"Iniciando download para {total_empresas} empresas válidas")
-        
-            for i, empresa in enumerate(self.empresas_selecionadas, 1):
-                self.empresa_atual_index = i  # Armazena o índice atual
-                logger.info(f"Processando empresa {i}/{total_empresas}: {empresa['nome']}")
             
-                if self.processo_ativo:
+            config = Config.load(DIRETORIOS['config_json'])
+            max_workers = max(1, min(int(config.max_workers), total_empresas))
+            logger.info(f"Iniciando download para {total_empresas} empresas válidas ({max_workers} simultâneas)")
+            
+            with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="empresa") as executor:
+                futuros = {
+                    executor.submit(self._processar_empresa, empresa, self.ano_download, self.mes_download): empresa
+                    for empresa in self.empresas_selecionadas
+                }
+                for futuro in as_completed(futuros):
+                    empresa = futuros[futuro]
                     try:
-                        # Atualiza o popup com o índice da empresa e NSU zero
-                        self.win.after(0, lambda idx=i, total=total_empresas: self.popup.atualizar_contador(idx, total, 0))
+                        futuro.result()
                     except Exception as e:
-                        logger.warning(f"Erro ao atualizar popup: {e}")
-                
-                resultado = self._baixar_empresa(empresa, self.combo_ano.get(), self.combo_mes.get())
-                
-                logger.info(f"Resultado para [{empresa['cod']}] {empresa['nome']}: {resultado['documentos']} documentos, {resultado['erros']} erros")
-                
-                self.resultados.append(resultado)
-
-                if self.processo_ativo and resultado['erros'] == 0:
-                    try:                       
-                        processamento_ok = self._processar_apos_download(empresa['cod'], empresa['cadastro']['cnpj'])
-                        if processamento_ok:
-                            logger.info(f"Processamento pós-download concluído para [{empresa['cod']}] {empresa['nome']}")
-                        else:
-                            logger.warning(f"Problemas no processamento pós-download para [{empresa['cod']}] {empresa['nome']}")
-                    except Exception as e:
-                        logger.error(f"Erro no processamento pós-download para [{empresa['cod']}] {empresa['nome']}: {e}")
-                elif not self.processo_ativo:
-                    logger.warning(f"Processamento pós-download pulado para [{empresa['cod']}] {empresa['nome']} - processo cancelado")
-                else:
-                    logger.warning(f"Pulando processamento pós-download para [{empresa['cod']}] {empresa['nome']} devido a erros no download")
+                        logger.error(f"Erro inesperado para [{empresa['cod']}] {empresa['nome']}: {e}")
                     
         except Exception as e:
             logger.error(f"Erro no processo de download: {e}")
         finally:
             logger.info("Processo de download finalizado")
+            # Resultados chegam na ordem de conclusão; reordenar conforme a seleção
+            ordem = {empresa['cod']: i for i, empresa in enumerate(self.empresas_selecionadas)}
+            with self._lock:
+                self.resultados.sort(key=lambda r: ordem.get(r.get('cod'), len(ordem)))
             for resultado in self.resultados:
-                logger.info(f"Resultado final - [{resultado.get('cod', 'N/A')}] {resultado['empresa']}: {resultado['documentos']} documentos")
+                logger.info(f"Resultado final - [{resultado.get('cod', 'N/A')}] {resultado['empresa']}: {resultado['documentos']} documentos, "
+                            f"{resultado.get('retentativas', 0)} retentativas ({resultado.get('tempo_perdido', 0)}s)")
             
             if self.processo_ativo:
                 self.win.after(0, self._finalizar_processo)
 
+    def _processar_empresa(self, empresa, ano, mes):
+        """Baixa e processa uma empresa, executado por um worker do pool"""
+        if not self.processo_ativo:
+            logger.warning(f"Download pulado para [{empresa['cod']}] {empresa['nome']} - processo cancelado")
+            return
+        
+        with self._lock:
+            self.empresas_iniciadas += 1
+            empresa['indice'] = self.empresas_iniciadas
+        logger.info(f"Processando empresa {empresa['indice']}/{self.total_empresas}: {empresa['nome']}")
+        
+        try:
+            # Atualiza o popup com o índice da empresa e NSU zero
+            self.win.after(0, lambda idx=empresa['indice'], total=self.total_empresas: self.popup.atualizar_contador(idx, total, 0))
+        except Exception as e:
+            logger.warning(f"Erro ao atualizar popup: {e}")
+        
+        resultado = self._baixar_empresa(empresa, ano, mes)
+        
+        logger.info(f"Resultado para [{empresa['cod']}] {empresa['nome']}: {resultado['documentos']} documentos, {resultado['erros']} erros")
+        
+        with self._lock:
+            self.resultados.append(resultado)
+
+        if self.processo_ativo and resultado['erros'] == 0:
+            try:                       
+                processamento_ok = self._processar_apos_download(empresa['cod'], empresa['cadastro']['cnpj'])
+                if processamento_ok:
+                    logger.info(f"Processamento pós-download concluído para [{empresa['cod']}] {empresa['nome']}")
+                else:
+                    logger.warning(f"Problemas no processamento pós-download para [{empresa['cod']}] {empresa['nome']}")
+            except Exception as e:
+                logger.error(f"Erro no processamento pós-download para [{empresa['cod']}] {empresa['nome']}: {e}")
+        elif not self.processo_ativo:
+            logger.warning(f"Processamento pós-download pulado para [{empresa['cod']}] {empresa['nome']} - processo cancelado")
+        else:
+            logger.warning(f"Pulando processamento pós-download para [{empresa['cod']}] {empresa['nome']} devido a erros no download")
+
+    def _cancelar_download(self):
+        """Cancela o download, propagando stop() para todos os downloaders em andamento"""
+        if not messagebox.askyesno("Cancelar", "Deseja cancelar o download em andamento?", parent=self.popup.win):
+            return
+        
+        logger.warning("Download cancelado pelo usuário")
+        with self._lock:
+            self.processo_ativo = False
+            downloaders = list(self.downloaders_ativos)
+        
+        for downloader in downloaders:
+            try:
+                downloader.stop()
+            except Exception as e:
+                logger.warning(f"Erro ao parar downloader: {e}")
+        
+        try:
+            self.popup.finalizar()
+        except Exception as e:
+            logger.warning(f"Erro ao fechar popup: {e}")
+
     def _baixar_empresa(self, empresa, ano, mes):
         """Baixa NFSe para uma empresa específica"""
         documentos_baixados = 0
@@ -732,10 +791,6 @@ class DownloadUI:
                     'mensagem': error_msg
                 }
             
-            cert_path = os.path.join(ROOT_DIR, cadastro['cert_path'])
-            cert_pass = cadastro['cert_pass']
-            cnpj = cadastro['cnpj']
-                        
             pasta_empresa = os.path.join(DIRETORIOS['notas'], cod_empresa)
             if not os.path.exists(pasta_empresa):
                 logger.error(f"Pasta da empresa {cod_empresa} não encontrada")
@@ -749,20 +804,22 @@ class DownloadUI:
             
             arquivo_controle = os.path.join(pasta_empresa, 'nsu_competencia.json')
             
-            config_empresa = Config.load(DIRETORIOS['config_json'])
-            config_empresa.cert_path = cert_path
-            config_empresa.cert_pass = cert_pass
-            config_empresa.cnpj = cnpj
-            config_empresa.output_dir = pasta_empresa
+            config_empresa = self._config_empresa(cadastro, cod_empresa)
             
             # ALTERAÇÃO: Instanciar o downloader correto conforme o modo
             if consult_mode == 'Emissão':
-                from downloader.emissao import NFSeDownloaderEmissao
                 downloader = NFSeDownloaderEmissao(config_empresa)
+            elif consult_mode == 'Sincronizar':
+                downloader = NFSeDownloaderSincronizar(config_empresa)
             else:  # Competência
-                from downloader.competencia import NFSeDownloaderCompetencia
                 downloader = NFSeDownloaderCompetencia(config_empresa)
             
+            # Registrar para que o cancelamento alcance este worker
+            with self._lock:
+                self.downloaders_ativos.add(downloader)
+                if not self.processo_ativo:
+                    downloader.stop()
+            
             # Variável local para armazenar o NSU atual
             nsu_atual_local = 0
             
@@ -790,7 +847,7 @@ class DownloadUI:
                 # Atualiza o contador com o NSU atual
                 if hasattr(self, 'popup') and self.popup and hasattr(self.popup, 'winfo_exists') and self.popup.winfo_exists():
                     self.win.after(0, lambda: self.popup.atualizar_contador(
-                        self.empresa_atual_index,
+                        empresa.get('indice', 0),
                         self.total_empresas,
                         nsu_atual_local
                     ))
@@ -804,14 +861,26 @@ class DownloadUI:
                         ano=ano,
                         mes=mes,
                         nsu_competencia_file=arquivo_controle,
-                        write=write_progress
+                        write=write_progress,
+                        retomar=self.retomar_download,
+                        meses=self.meses_download
                     )
                 elif consult_mode == 'Competência':
                     documentos_baixados = downloader.run_competencia(
                         ano_compet=ano,
                         mes_compet=mes,
                         nsu_competencia_file=arquivo_controle,
-                        write=write_progress
+                        write=write_progress,
+                        retomar=self.retomar_download,
+                        meses=self.meses_download
+                    )
+                elif consult_mode == 'Sincronizar':
+                    documentos_baixados = downloader.run_sincronizar(
+                        ano=ano,
+                        mes=mes,
+                        nsu_competencia_file=arquivo_controle,
+                        write=write_progress,
+                        meses=self.meses_download
                     )
                 else:
                     error_msg = f"Modo de consulta desconhecido: {consult_mode}"
@@ -832,7 +901,9 @@ class DownloadUI:
                     'empresa': nome_empresa,
                     'documentos': documentos_baixados,
                     'erros': 0,
-                    'mensagem': f"Sucesso: {documentos_baixados} documentos baixados"
+                    'mensagem': f"Sucesso: {documentos_baixados} documentos baixados",
+                    **downloader.retry.resumo(),
+                    **downloader.pastas.resumo()
                 }
                     
             except Exception as e:
@@ -842,10 +913,14 @@ class DownloadUI:
                 return {
                     'cod': cod_empresa,
                     'empresa': nome_empresa,
-                    'documentos': 0,
-                    'erros': 1,
-                    'mensagem': error_msg
+                    'documentos': getattr(e, 'documentos', 0),  # SincronizacaoIncompleta traz as contagens
+                    'erros': getattr(e, 'erros', 1),
+                    'mensagem': error_msg,
+                    **downloader.retry.resumo()
                 }
+            finally:
+                with self._lock:
+                    self.downloaders_ativos.discard(downloader)
                 
         except Exception as e:
             error_msg = f"Erro ao baixar para {empresa['nome']}: {str(e)}"
@@ -859,6 +934,87 @@ class DownloadUI:
                 'mensagem': error_msg
             }
 
+    def _config_empresa(self, cadastro, cod_empresa):
+        """Configuração global acrescida do certificado e das pastas da empresa"""
+        config_empresa = Config.load(DIRETORIOS['config_json'])
+        config_empresa.cert_path = os.path.join(ROOT_DIR, cadastro['cert_path'])
+        config_empresa.cert_pass = cadastro['cert_pass']
+        config_empresa.cnpj = cadastro['cnpj']
+        config_empresa.output_dir = os.path.join(DIRETORIOS['notas'], cod_empresa)
+        config_empresa.data_dir = str(pasta_dados_empresa(limpar_cnpj(cadastro['cnpj'])))
+        return config_empresa
+
+    ## ------------------------------------------------------------------------------
+    ## Reprocessamento de PDFs pendentes
+    ## ------------------------------------------------------------------------------
+    def _reprocessar_pdfs(self):
+        """Baixa de novo os PDFs pendentes das empresas selecionadas, sem consultar o DFe"""
+        empresas = []
+        for item in self.tree.selection():
+            values = self.tree.item(item, 'values')
+            cod_empresa, nome_empresa = values[0], values[1]
+            cadastro = self._buscar_cadastro_empresa(cod_empresa)
+            if cadastro is None or self._verificar_certificado_vencido(cadastro):
+                continue
+            if not (DIRETORIOS['dados'] / limpar_cnpj(cadastro['cnpj']) / ARQUIVO_FILA).exists():
+                continue
+            empresas.append({'cod': cod_empresa, 'nome': nome_empresa, 'cadastro': cadastro})
+        
+        if not empresas:
+            messagebox.showinfo("PDFs Pendentes", "Nenhum PDF pendente para as empresas selecionadas.")
+            return
+        
+        self.popup = PopupProcessamento(
+            self.win,
+            titulo="Reprocessando PDFs - Download NFS-e Nacional",
+            texto=f"Baixando PDFs pendentes de {len(empresas)} empresa(s)..."
+        )
+        # Fechar o popup cancela, como no download
+        self.popup.win.protocol("WM_DELETE_WINDOW", self._cancelar_download)
+        self.processo_ativo = True
+        self.downloaders_ativos = set()
+        thread_pdfs = threading.Thread(target=self._processo_reprocessar_pdfs, args=(empresas,), daemon=True)
+        thread_pdfs.start()
+
+    def _processo_reprocessar_pdfs(self, empresas):
+        """Reprocessa a fila de PDFs de cada empresa, em thread separada"""
+        resumo = []
+        for indice, empresa in enumerate(empresas, 1):
+            if not self.processo_ativo:
+                resumo.append(f"[{empresa['cod']}] {empresa['nome']}: cancelado")
+                continue
+            self.win.after(0, lambda idx=indice: self.popup.atualizar_contador(idx, len(empresas), 0))
+            downloader = None
+            try:
+                downloader = NFSeDownloaderEmissao(self._config_empresa(empresa['cadastro'], empresa['cod']))
+                with self._lock:
+                    self.downloaders_ativos.add(downloader)
+                sucessos, falhas, restantes = downloader.reprocessar_pdfs()
+                resumo.append(f"[{empresa['cod']}] {empresa['nome']}: {sucessos} baixados, {restantes} pendentes")
+                
+                # O pacote exportado é o .zip: os PDFs recuperados entram nele
+                if sucessos:
+                    pasta_empresa = os.path.join(DIRETORIOS['notas'], str(empresa['cod']))
+                    zip_path = os.path.join(DIRETORIOS['notas'], f"{empresa['cod']}.zip")
+                    if not self._compactar_pasta_empresa(pasta_empresa, zip_path):
+                        resumo[-1] += " (falha ao atualizar o .zip)"
+            except Exception as e:
+                logger.error(f"Erro ao reprocessar PDFs de [{empresa['cod']}] {empresa['nome']}: {e}")
+                resumo.append(f"[{empresa['cod']}] {empresa['nome']}: erro - {e}")
+            finally:
+                with self._lock:
+                    self.downloaders_ativos.discard(downloader)
+        
+        self.processo_ativo = False
+        self.win.after(0, lambda: self._finalizar_reprocessar_pdfs(resumo))
+
+    def _finalizar_reprocessar_pdfs(self, resumo):
+        try:
+            self.popup.finalizar()
+        except Exception as e:
+            logger.warning(f"Erro ao fechar popup: {e}")
+        messagebox.showinfo("PDFs Pendentes", "\n".join(resumo))
+
     def _finalizar_processo(self):
         """Finaliza o processo de download"""
         self.processo_ativo = False
@@ -880,16 +1036,24 @@ class DownloadUI:
         total_empresas = len(self.resultados)
         total_documentos = sum(r['documentos'] for r in self.resultados)
         total_erros = sum(r['erros'] for r in self.resultados)
+        total_retentativas = sum(r.get('retentativas', 0) for r in self.resultados)
+        tempo_perdido = sum(r.get('tempo_perdido', 0) for r in self.resultados)
         
         mensagem = f"Download concluído para {total_empresas} empresa(s)\n\n"
         mensagem += f"Total de documentos baixados: {total_documentos}\n"
-        mensagem += f"Total de erros: {total_erros}\n\n"
+        mensagem += f"Total de erros: {total_erros}\n"
+        mensagem += f"Retentativas: {total_retentativas} ({tempo_perdido:.0f}s perdidos)\n\n"
         mensagem += "Detalhes por empresa:\n"
         
         for resultado in self.resultados:
             status = "✅" if resultado['erros'] == 0 else "❌"
             # Adicionar o código entre colchetes antes do nome da empresa
             mensagem += f"\n{status} [{resultado.get('cod', 'N/A')}] {resultado['empresa']} - Notas: {resultado['documentos']} - Erros: {resultado['erros']}"
+            if resultado.get('retentativas'):
+                mensagem += f" - Retentativas: {resultado['retentativas']}"
+            if resultado.get('mantidos') or resultado.get('removidos'):
+                mensagem += (f" - Mantidos: {resultado['mantidos']}, Novos: {resultado['novos']}, "
+                             f"Removidos: {resultado['removidos']}")
         
         messagebox.showinfo("Resumo do Download", mensagem)
 